@@ -13,6 +13,7 @@ import logging
 
 from modules.gui import KeyWizardGUI
 from modules.utils import check_images, create_bat_file
+from modules.profiler import install_signal_toggle
 
 def main():
     """程序主入口"""
@@ -36,6 +37,9 @@ def main():
     # 啟動GUI
     root = tk.Tk()
     app = KeyWizardGUI(root)
+    
+    # kill -USR1 <pid> 可切換效能分析 (POSIX)
+    install_signal_toggle(lambda: app.wizard)
     root.mainloop()
 
 if __name__ == "__main__":
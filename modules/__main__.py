@@ -0,0 +1,106 @@
+"""
+Headless entry point: ``python -m modules``.
+
+Runs the scanning loop without Tk or PIL. The LINE SDK and requests are
+loaded on the first notification; cv2 and numpy are imported with the
+wizard, since the first scan needs them anyway. The startup time to the
+first scan is logged.
+
+The wizard scans on a worker thread; SIGINT/SIGTERM only record the
+signal and the main thread stops the wizard. The exit status is 1 if the
+wizard failed to start, ended with an error or never captured a frame.
+"""
+
+import time
+
+STARTED_AT = time.perf_counter()
+
+import sys
+import json
+import signal
+import logging
+import argparse
+import threading
+
+
+def parse_overrides(items):
+    """
+    Parse ``KEY=VALUE`` pairs; values are read as JSON when possible.
+
+    Args:
+        items (list): Strings like "match_strategy=pyramid" or "scan_interval=1"
+
+    Returns:
+        dict: Configuration overrides
+    """
+    overrides = {}
+    for item in items or []:
+        key, separator, value = item.partition("=")
+        if not separator:
+            raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got '{item}'")
+        try:
+            overrides[key] = json.loads(value)
+        except ValueError:
+            overrides[key] = value
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m modules", description="btnSprite headless scanner")
+    parser.add_argument("--config", help="config file (default: config.json in the program directory)")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a config value (repeatable)")
+    parser.add_argument("--typing-mode", action="store_true", help="type the text instead of clicking directly")
+    parser.add_argument("--dry-run", action="store_true", help="record clicks and keys instead of sending them")
+    parser.add_argument("--profile", action="store_true", help="profile the scanning thread from the start")
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger('key_wizard')
+
+    from .config import load_config
+    from .key_wizard import KeyWizard
+    from .profiler import install_signal_toggle
+
+    overrides = parse_overrides(args.set)
+    if args.profile:
+        overrides["profile_on_start"] = True
+    config = load_config(args.config, overrides)
+
+    input_device = None
+    if args.dry_run:
+        from .benchmark import RecordingInput
+        input_device = RecordingInput()
+
+    try:
+        wizard = KeyWizard(
+            direct_click_mode=not args.typing_mode,
+            config=config,
+            input_device=input_device,
+            started_at=STARTED_AT,
+        )
+    except Exception as e:
+        logger.error(f"Failed to initialise Key Wizard: {str(e)}")
+        return 1
+    logger.info(f"Initialised in {time.perf_counter() - STARTED_AT:.3f}s")
+
+    stopping = []
+    # 訊號處理只記下訊號，由主執行緒停止精靈 (日誌、通知都不在訊號處理中執行)
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    install_signal_toggle(lambda: wizard)
+
+    scanner = threading.Thread(target=wizard.start, name="scanner")
+    scanner.start()
+    while scanner.is_alive():
+        scanner.join(0.2)
+        if stopping and wizard.running:
+            wizard.stop(f"收到訊號 {signal.Signals(stopping[0]).name}")
+
+    if input_device is not None:
+        logger.info(f"Dry run: {len(input_device.clicks)} click(s) recorded")
+    if wizard.error:
+        return 1
+    return 0 if wizard.frame_count else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
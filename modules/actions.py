@@ -0,0 +1,369 @@
+"""
+Background executor for mouse and keyboard actions.
+
+The scanning thread only decides what to do; clicks and typing are queued
+and carried out here, so detection keeps running while input is injected.
+Delays between input steps come from per-action timing profiles, repeated
+detections of a target that was just acted on are debounced, and stopping
+the wizard cancels queued and in-progress actions between steps.
+"""
+
+import math
+import queue
+import time
+import logging
+import threading
+
+# 各動作的等待時間 (秒，乘上 input_pause_scale)
+# click: 點擊 / press: 直接點擊按鈕 / type: 點擊輸入框後輸入文字再點擊確認
+# after: 一輪最後一個動作之後 / between: 同一輪多個命中之間
+DEFAULT_PROFILES = {
+    "click": {"after": 1.0, "between": 0.2},
+    "press": {"after": 1.0, "between": 0.2},
+    "type": {"focus": 0.5, "hotkey": 0.2, "text": 0.2, "retry": 0.2, "key_interval": 0.0, "after": 1.0,
+             "between": 0.5},
+}
+
+
+def order_positions(positions, order="score", start=None):
+    """
+    Order the occurrences of one rule for acting on them.
+
+    Args:
+        positions (list): (x, y, w, h) tuples, best score first
+        order (str): "score" keeps the score order, "top" goes top-to-bottom
+            (left-to-right within a row), "nearest" repeatedly picks the
+            occurrence closest to the previous one, starting at ``start``
+        start (tuple, optional): (x, y) to start "nearest" from, e.g. the cursor
+
+    Returns:
+        list: The same positions in acting order
+    """
+    if len(positions) < 2 or order == "score":
+        return list(positions)
+    if order == "top":
+        return sorted(positions, key=lambda position: (position[1], position[0]))
+    remaining = list(positions)
+    current = start or (0, 0)
+    ordered = []
+    while remaining:
+        position = min(remaining, key=lambda p: math.hypot(p[0] - current[0], p[1] - current[1]))
+        remaining.remove(position)
+        ordered.append(position)
+        current = position
+    return ordered
+
+
+class ActionCancelled(Exception):
+    """
+    Raised inside an action when the executor is cancelled.
+    """
+
+
+class Action:
+    """
+    One queued input action.
+    """
+    def __init__(self, kind, x, y, target=None, after=None, text=(), on_done=None, final=True):
+        """
+        Args:
+            kind (str): Profile name ("click", "press" or "type")
+            x (int): Screen x
+            y (int): Screen y
+            target (str, optional): What is acted on (rule name); used for debouncing and metrics
+            after (float, optional): Wait after the action; the profile's "after" if omitted
+            text (tuple): Texts typed by "type" actions, tried in order
+            on_done (callable, optional): on_done(action) called after the action completed
+            final (bool): Last action queued for this cycle; the others only wait the profile's "between"
+        """
+        self.kind = kind
+        self.x = x
+        self.y = y
+        self.target = target or kind
+        self.after = after
+        self.text = tuple(text)
+        self.on_done = on_done
+        self.final = final
+        self.queued_at = time.monotonic()
+
+    def __repr__(self):
+        return f"Action({self.kind!r}, {self.x}, {self.y}, target={self.target!r})"
+
+
+class ActionExecutor:
+    """
+    Consumer thread that performs queued actions on an input device.
+    """
+    def __init__(self, device, profiles=None, pause_scale=1.0, debounce_window=1.0, debounce_distance=10,
+                 max_pending=8, metrics=None):
+        """
+        Args:
+            device (object): Object with pyautogui's click/hotkey/typewrite
+            profiles (dict, optional): Overrides of DEFAULT_PROFILES, merged per action kind
+            pause_scale (float): Multiplier of every profile delay (0 = no waiting)
+            debounce_window (float): A target acted on within this time is not acted on again (seconds, 0 = off)
+            debounce_distance (int): Positions closer than this count as the same target (pixels)
+            max_pending (int): Queue size; further actions are dropped
+            metrics (Metrics, optional): Receives action timings and counters
+        """
+        self.device = device
+        self.profiles = {kind: dict(profile) for kind, profile in DEFAULT_PROFILES.items()}
+        for kind, profile in (profiles or {}).items():
+            self.profiles.setdefault(kind, {}).update(profile)
+        self.pause_scale = pause_scale
+        self.debounce_window = debounce_window
+        self.debounce_distance = debounce_distance
+        self.metrics = metrics
+        self.logger = logging.getLogger('key_wizard')
+
+        # 延遲全部由動作設定檔控制，不使用 pyautogui 每次呼叫後的全域暫停
+        if hasattr(device, "PAUSE"):
+            device.PAUSE = 0
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._cancel = threading.Event()
+        self._cancelled_at = float("-inf")
+        self._closing = threading.Event()
+        self._lock = threading.Lock()
+        self._active = []  # 佇列中或執行中的動作
+        self._recent = []  # (target, x, y, 完成時間)
+        self._worker = None
+        self.last_position = None  # 上次點擊的位置
+
+        # 統計
+        self.executed = 0
+        self.debounced = 0
+        self.dropped = 0
+        self.cancelled = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="actions", daemon=True)
+                self._worker.start()
+
+    def _count(self, name, **labels):
+        if self.metrics is not None:
+            self.metrics.inc(name, **labels)
+
+    def _same(self, target, x, y, action):
+        return (target == action.target and abs(x - action.x) <= self.debounce_distance
+                and abs(y - action.y) <= self.debounce_distance)
+
+    def _is_duplicate(self, action, now):
+        if any(self._same(other.target, other.x, other.y, action) for other in self._active):
+            return True
+        self._recent = [entry for entry in self._recent if now - entry[3] < self.debounce_window]
+        return any(self._same(target, x, y, action) for target, x, y, _ in self._recent)
+
+    def cursor(self):
+        """
+        Current mouse position if the device reports it, else the last click.
+
+        Returns:
+            tuple or None: (x, y)
+        """
+        position = getattr(self.device, "position", None)
+        if callable(position):
+            try:
+                return tuple(position())[:2]
+            except Exception:
+                pass
+        return self.last_position
+
+    def submit(self, action):
+        """
+        Queue an action without waiting for it.
+
+        Args:
+            action (Action): Action to perform
+
+        Returns:
+            bool: True if queued, False if debounced, dropped or closed
+        """
+        if self._closing.is_set():
+            return False
+        with self._lock:
+            if self.debounce_window > 0 and self._is_duplicate(action, time.monotonic()):
+                self.debounced += 1
+                self._count("actions_debounced", target=action.target)
+                return False
+            try:
+                self._queue.put_nowait(action)
+            except queue.Full:
+                self.dropped += 1
+                self._count("actions_dropped", target=action.target)
+                self.logger.warning(f"Action queue full, {action} dropped")
+                return False
+            self._active.append(action)
+        self._ensure_worker()
+        return True
+
+    @property
+    def pending(self):
+        """
+        Number of queued actions, including the one in progress.
+        """
+        return self._queue.unfinished_tasks
+
+    def _pause(self, seconds):
+        """
+        Wait between input steps; raises ActionCancelled when cancelled.
+        """
+        if self._cancel.is_set():
+            raise ActionCancelled()
+        seconds *= self.pause_scale
+        if seconds > 0 and self._cancel.wait(seconds):
+            raise ActionCancelled()
+
+    def _click(self, x, y):
+        if self._cancel.is_set():
+            raise ActionCancelled()
+        self.device.click(x, y)
+        self.last_position = (x, y)
+        self._count("clicks")
+
+    def _perform(self, action):
+        profile = self.profiles.get(action.kind, {})
+        if action.kind == "type":
+            # 點擊輸入框
+            self._click(action.x, action.y)
+            self._pause(profile.get("focus", 0))
+
+            # 嘗試切換輸入法為英文
+            self.device.hotkey('alt', 'shift')
+            self._pause(profile.get("hotkey", 0))
+
+            interval = profile.get("key_interval", 0) * self.pause_scale
+            for index, text in enumerate(action.text):
+                if index:
+                    # 清除可能的錯誤輸入後改用替代文字
+                    self.device.typewrite(['backspace'] * len(action.text[index - 1]), interval=interval)
+                self.device.typewrite(text, interval=interval)
+                self._pause(profile.get("text" if index == 0 else "retry", 0))
+
+            # 點擊確認按鈕
+            self._click(action.x, action.y)
+        else:
+            self._click(action.x, action.y)
+
+        if action.on_done is not None:
+            action.on_done(action)
+        if action.final:
+            self._pause(action.after if action.after is not None else profile.get("after", 0))
+        else:
+            self._pause(profile.get("between", 0))
+
+    def _run(self):
+        while True:
+            try:
+                action = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                if self._closing.is_set():
+                    break
+                continue
+
+            started = time.perf_counter()
+            done = False
+            if self.metrics is not None:
+                self.metrics.observe("action_wait", time.monotonic() - action.queued_at)
+            try:
+                # 取消之前排入的動作不再執行；之後排入的動作重新允許輸入
+                self._cancel.clear()
+                if action.queued_at <= self._cancelled_at:
+                    raise ActionCancelled()
+                self._perform(action)
+                self.executed += 1
+                done = True
+            except ActionCancelled:
+                self.cancelled += 1
+                self._count("actions_cancelled", target=action.target)
+            except Exception as e:
+                self._count("errors", stage="action")
+                self.logger.error(f"Error performing {action}: {str(e)}")
+            finally:
+                if self.metrics is not None:
+                    self.metrics.observe("action", time.perf_counter() - started)
+                with self._lock:
+                    if action in self._active:
+                        self._active.remove(action)
+                    if done and self.debounce_window > 0:
+                        self._recent.append((action.target, action.x, action.y, time.monotonic()))
+                self._queue.task_done()
+
+    def cancel(self):
+        """
+        Drop queued actions and interrupt the one in progress at its next step.
+        """
+        self._cancelled_at = time.monotonic()
+        self._cancel.set()
+        while True:
+            try:
+                action = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self.cancelled += 1
+            self._count("actions_cancelled", target=action.target)
+            with self._lock:
+                if action in self._active:
+                    self._active.remove(action)
+            self._queue.task_done()
+
+    def wait_idle(self, timeout=None):
+        """
+        Wait until every queued action has been handled.
+
+        Args:
+            timeout (float, optional): Maximum wait (seconds)
+
+        Returns:
+            bool: True if the queue drained in time
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if end is not None and time.monotonic() >= end:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def close(self, timeout=5.0):
+        """
+        Finish the queued actions within a deadline, then stop the worker.
+
+        Args:
+            timeout (float): Deadline (seconds); what is left afterwards is cancelled
+
+        Returns:
+            bool: True if every action finished in time
+        """
+        finished = self.wait_idle(timeout)
+        if not finished:
+            self.cancel()
+        self._closing.set()
+        worker = self._worker
+        if worker is not None:
+            worker.join(1.0)
+        return finished
+
+
+def create_action_executor(device, config, metrics=None):
+    """
+    Build the ActionExecutor from the configuration.
+
+    Args:
+        device (object): Input device (pyautogui or a stand-in)
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+        metrics (Metrics, optional): Receives action timings and counters
+
+    Returns:
+        ActionExecutor: Executor (its worker starts with the first action)
+    """
+    return ActionExecutor(
+        device,
+        profiles=config.get("action_profiles"),
+        pause_scale=config.get("input_pause_scale", 1.0),
+        debounce_window=config.get("action_debounce", 1.0),
+        debounce_distance=config.get("action_debounce_distance", 10),
+        max_pending=config.get("action_queue_size", 8),
+        metrics=metrics,
+    )
@@ -0,0 +1,540 @@
+"""
+Offline replay benchmark for the KeyWizard detection loop.
+
+Drives ``KeyWizard._process_action`` against synthetic screenshot sequences
+(1080p, 4K, dual 4K) or a recorded screenshot directory, with mouse and
+keyboard input replaced by a recording fake. No display is needed.
+
+Usage:
+    python -m modules.benchmark --output bench.json
+    python -m modules.benchmark --source recorded/ --config '{"match_strategy": "pyramid"}'
+
+A recorded directory may contain ``truth.json`` mapping image file names to
+the expected click positions (``{"0001.png": [[x, y]], ...}``) to enable the
+accuracy figures.
+
+The exit status is non-zero when a scenario with expected clicks falls below
+``--min-recall`` / ``--min-precision``, when a ``--compare`` variant is less
+accurate than the first variant, or when a soak run grows.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from . import __version__
+from .capture import CaptureBackend, CaptureExhausted, FrameBuffers, ReplayCapture
+from .recorder import SessionReader, is_recording
+from .config import load_config
+
+RESOLUTIONS = {
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+    "dual-4k": (7680, 2160),
+}
+
+# 合成序列中每個畫面的種類
+IDLE, TARGET, APPROVED, NOISE = "idle", "target", "approved", "noise"
+SCENARIO = [IDLE, IDLE, TARGET, IDLE, NOISE, APPROVED, IDLE, IDLE, NOISE, TARGET]
+
+
+class RecordingInput:
+    """
+    Stand-in for pyautogui that records input instead of sending it.
+    """
+    PAUSE = 0
+
+    def __init__(self):
+        self.clicks = []
+        self.keys = []
+
+    def click(self, x=None, y=None, *args, **kwargs):
+        self.clicks.append((x, y))
+
+    def hotkey(self, *keys, **kwargs):
+        self.keys.append(keys)
+
+    def typewrite(self, text, *args, **kwargs):
+        self.keys.append(text)
+
+
+class NullNotifier:
+    """
+    LINE notifier that sends nothing.
+    """
+    configured = True
+
+    def push(self, message, user_id=None):
+        pass
+
+    def format_program_stopped(self, reason=""):
+        return reason
+
+    def notify_program_stopped(self, reason=""):
+        return True
+
+    def send_message(self, message, user_id=None):
+        return True
+
+
+class SyntheticCapture(CaptureBackend):
+    """
+    Generates frames with templates pasted at known positions.
+
+    Frames are BGRA like mss and are drawn into reused buffers, so the
+    source itself does not allocate per frame.
+    """
+    name = "synthetic"
+    native_order = "bgra"
+
+    def __init__(self, size, templates, frames=60, seed=0, record_truth=True):
+        """
+        Args:
+            size (tuple): (width, height) of the frames
+            templates (dict): name -> BGR template ("target", "button", "approved")
+            frames (int): Number of frames before the source is exhausted
+            seed (int): Random seed
+            record_truth (bool): Keep the expected clicks of every frame (off for soak runs)
+        """
+        self.width, self.height = size
+        self.templates = templates
+        self.frames = frames
+        self.record_truth = record_truth
+        self.position = 0
+        self.rng = np.random.default_rng(seed)
+        self.truth = []  # 每個畫面預期的點擊位置
+
+        # 低解析度雜訊放大成背景，避免大面積純色
+        small = self.rng.integers(60, 200, (self.height // 16, self.width // 16, 3), dtype=np.uint8)
+        background = cv2.resize(small, (self.width, self.height), interpolation=cv2.INTER_LINEAR)
+        self.background = cv2.cvtColor(background, cv2.COLOR_BGR2BGRA)
+        self.noise = [cv2.cvtColor(self.rng.integers(0, 255, (200, 200, 3), dtype=np.uint8), cv2.COLOR_BGR2BGRA)
+                      for _ in range(4)]
+        self._source_buffers = FrameBuffers()
+        self._current = self.background
+
+    def frame_shape(self):
+        return (self.height, self.width)
+
+    def _paste(self, image, template):
+        h, w = template.shape[:2]
+        x = int(self.rng.integers(0, self.width - w))
+        y = int(self.rng.integers(0, self.height - h))
+        image[y:y + h, x:x + w, :3] = template
+        return (x + w // 2, y + h // 2)
+
+    def _grab(self):
+        if self.position >= self.frames:
+            raise CaptureExhausted(self.name)
+
+        kind = SCENARIO[self.position % len(SCENARIO)]
+        self.position += 1
+
+        if kind == IDLE:
+            # 靜止畫面: 沿用上一張，預期結果也相同
+            if self.record_truth:
+                self.truth.append(list(self.truth[-1]) if self.truth else [])
+            return self._current
+
+        image = self._source_buffers.get("raw", self.background.shape)
+        np.copyto(image, self.background)
+        expected = []
+        if kind == TARGET:
+            self._paste(image, self.templates["target"])
+            expected.append(self._paste(image, self.templates["button"]))
+        elif kind == APPROVED:
+            expected.append(self._paste(image, self.templates["approved"]))
+        else:
+            x = int(self.rng.integers(0, self.width - 200))
+            y = int(self.rng.integers(0, self.height - 200))
+            image[y:y + 200, x:x + 200] = self.noise[self.position % len(self.noise)]
+
+        if self.record_truth:
+            self.truth.append(expected)
+        self._current = image
+        return image
+
+
+def make_templates(directory):
+    """
+    Render synthetic templates and write them as keep/btn/approved.png.
+
+    Args:
+        directory (str): Output directory
+
+    Returns:
+        dict: name -> BGR template
+    """
+    def render(text, colour):
+        image = np.full((48, 160, 3), 40, dtype=np.uint8)
+        cv2.rectangle(image, (2, 2), (157, 45), colour, 2)
+        cv2.putText(image, text, (12, 34), cv2.FONT_HERSHEY_SIMPLEX, 1.0, colour, 2)
+        return image
+
+    templates = {
+        "target": render("KEEP", (255, 255, 255)),
+        "button": render("OK", (60, 220, 60)),
+        "approved": render("APPROVE", (60, 60, 230)),
+    }
+    for name, filename in (("target", "keep.png"), ("button", "btn.png"), ("approved", "approved.png")):
+        cv2.imwrite(os.path.join(directory, filename), templates[name])
+    return templates
+
+
+def load_truth(source):
+    """
+    Load truth.json of a recorded directory, aligned with ReplayCapture's frame order.
+
+    For a session recording the clicks recorded with each frame are the truth,
+    so a re-run scores a new configuration against the recorded behaviour.
+
+    Returns:
+        list or None: Expected clicks per frame, None if there is no truth file
+    """
+    if is_recording(source):
+        reader = SessionReader(source)
+        try:
+            return reader.actions()
+        finally:
+            reader.close()
+    path = os.path.join(source, "truth.json")
+    if not os.path.isdir(source) or not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as truth_file:
+        truth = json.load(truth_file)
+    files = sorted(f for f in os.listdir(source) if f.lower().endswith((".png", ".jpg", ".jpeg", ".bmp")))
+    return [[tuple(p) for p in truth.get(f, [])] for f in files]
+
+
+def percentiles(values):
+    """
+    Returns:
+        dict: mean/p50/p90/p99/max of the values in milliseconds
+    """
+    if not values:
+        return {}
+    ms = np.asarray(values) * 1000.0
+    return {
+        "mean": float(ms.mean()),
+        "p50": float(np.percentile(ms, 50)),
+        "p90": float(np.percentile(ms, 90)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+def score_clicks(truth, clicks, tolerance=5):
+    """
+    Compare the clicks of each cycle with the expected positions.
+
+    Args:
+        truth (list): Expected positions per frame
+        clicks (list): Recorded positions per frame
+        tolerance (int): Allowed distance in pixels
+
+    Returns:
+        dict: tp / fp / fn counts with precision and recall
+    """
+    tp = fp = fn = 0
+    for expected, actual in zip(truth, clicks):
+        # 同一位置的重複點擊只算一次
+        actual = list(dict.fromkeys(actual))
+        remaining = list(expected)
+        for x, y in actual:
+            hit = next((p for p in remaining if abs(p[0] - x) <= tolerance and abs(p[1] - y) <= tolerance), None)
+            if hit is None:
+                fp += 1
+            else:
+                tp += 1
+                remaining.remove(hit)
+        fn += len(remaining)
+
+    return {
+        "tp": tp,
+        "fp": fp,
+        "fn": fn,
+        "precision": tp / (tp + fp) if tp + fp else 1.0,
+        "recall": tp / (tp + fn) if tp + fn else 1.0,
+    }
+
+
+def check_accuracy(accuracy, min_recall, min_precision):
+    """
+    Mark whether a scenario met its expected accuracy.
+
+    Args:
+        accuracy (dict): Result of score_clicks(); "passed" is added
+        min_recall (float): Lowest acceptable recall
+        min_precision (float): Lowest acceptable precision
+
+    Returns:
+        bool: True if both floors were met
+    """
+    accuracy["passed"] = accuracy["recall"] >= min_recall and accuracy["precision"] >= min_precision
+    return accuracy["passed"]
+
+
+def find_regressions(results):
+    """
+    Compare the accuracy of each --compare variant with the first variant.
+
+    A variant that finds fewer expected clicks, or clicks more wrong places,
+    than the baseline on the same scenario is a regression; its accuracy gets
+    a "regression" entry naming the baseline.
+
+    Args:
+        results (list): Scenario results in run order
+
+    Returns:
+        list: Results that regressed
+    """
+    baselines = {}
+    regressed = []
+    for result in results:
+        accuracy = result.get("accuracy")
+        if accuracy is None or result.get("variant") is None:
+            continue
+        baseline = baselines.setdefault(result["scenario"], result)
+        if baseline is result:
+            continue
+        expected = baseline["accuracy"]
+        if accuracy["recall"] < expected["recall"] or accuracy["precision"] < expected["precision"]:
+            accuracy["regression"] = baseline["variant"]
+            regressed.append(result)
+    return regressed
+
+
+def current_rss_mb():
+    """
+    Current resident set size (falls back to the peak where /proc is unavailable).
+    """
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() / (1024.0 * 1024.0)
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def growth(samples):
+    """
+    Growth between the early steady state (10-20 %) and the end (last 10 %) of a run.
+    """
+    n = len(samples)
+    if n < 10:
+        return 0.0
+    early = samples[n // 10:n // 5]
+    late = samples[-(n // 10):]
+    return float(np.mean(late) - np.mean(early))
+
+
+def run_scenario(name, overrides, frames=60, source=None, soak=False):
+    """
+    Run one benchmark scenario (meant to run in its own process).
+
+    Args:
+        name (str): Resolution key of RESOLUTIONS, or "replay"
+        overrides (dict): Configuration overrides for KeyWizard
+        frames (int): Number of synthetic frames
+        source (str, optional): Recorded screenshot directory / video for "replay"
+        soak (bool): Track per-cycle allocations, Python heap and RSS instead of accuracy
+
+    Returns:
+        dict: Latency percentiles, fps, peak RSS and accuracy (or soak statistics)
+    """
+    from .key_wizard import KeyWizard
+
+    with tempfile.TemporaryDirectory() as workdir:
+        config = load_config(overrides=overrides)
+        config["input_pause_scale"] = 0
+        # 每張畫面的預期點擊都要計分，不略過重複目標
+        config["action_debounce"] = 0
+        if source is None:
+            templates = make_templates(workdir)
+            config["template_dir"] = workdir
+
+        device = RecordingInput()
+        wizard = KeyWizard(line_notifier=NullNotifier(), config=config, input_device=device)
+        # 不寫入正式的 button_press.log
+        logging.getLogger('key_wizard.press').disabled = True
+
+        if source is None:
+            capture = SyntheticCapture(RESOLUTIONS[name], templates, frames=frames, record_truth=not soak)
+            truth = None if soak else capture.truth
+        else:
+            capture = ReplayCapture(source)
+            truth = load_truth(source)
+        wizard._ensure_capture(capture)
+
+        if not wizard._load_templates():
+            raise RuntimeError("Failed to load templates")
+
+        wizard.running = True
+        latencies = []
+        clicks = []
+        allocated, traced, blocks, rss = [], [], [], []
+        if soak:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            while wizard.running:
+                before = len(device.clicks)
+                if soak:
+                    # 每輪暫時配置的記憶體 = 本輪峰值 - 開始時的用量
+                    tracemalloc.reset_peak()
+                    start_traced = tracemalloc.get_traced_memory()[0]
+                cycle_start = time.perf_counter()
+                wizard._process_action()
+                latencies.append(time.perf_counter() - cycle_start)
+                # 點擊在背景執行，等它完成才能對應到這張畫面
+                wizard.actions.wait_idle()
+                if soak:
+                    current, peak = tracemalloc.get_traced_memory()
+                    allocated.append(peak - start_traced)
+                    traced.append(current)
+                    blocks.append(sys.getallocatedblocks())
+                    rss.append(current_rss_mb())
+                    device.clicks.clear()
+                else:
+                    clicks.append(device.clicks[before:])
+        except CaptureExhausted:
+            pass
+        finally:
+            elapsed = time.perf_counter() - started
+            if soak:
+                tracemalloc.stop()
+            wizard.actions.close()
+            wizard.match_engine.shutdown()
+            capture.close()
+
+        result = {
+            "scenario": name,
+            "frame_size": list(capture.frame_shape() or []),
+            "frames": len(latencies),
+            "latency_ms": percentiles(latencies),
+            "fps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+            # Linux 的 ru_maxrss 單位為 KB
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            "clicks": sum(len(c) for c in clicks),
+        }
+        if truth is not None:
+            result["accuracy"] = score_clicks(truth, clicks)
+        if soak:
+            result["soak"] = {
+                "cycles": len(latencies),
+                "alloc_per_cycle_kb": float(np.median(allocated)) / 1024.0 if allocated else 0.0,
+                "traced_growth_kb": growth(traced) / 1024.0,
+                "blocks_growth": growth(blocks),
+                "rss_growth_mb": growth(rss),
+                "buffer_allocations": capture.buffers.allocations,
+            }
+        return result
+
+
+def _run_isolated(args):
+    return run_scenario(*args)
+
+
+def main(argv=None):
+    """
+    Command-line entry point.
+    """
+    parser = argparse.ArgumentParser(description="btnSprite detection-loop benchmark")
+    parser.add_argument("--resolutions", default=",".join(RESOLUTIONS),
+                        help="Comma-separated synthetic resolutions (%(default)s)")
+    parser.add_argument("--frames", type=int, default=60, help="Synthetic frames per resolution")
+    parser.add_argument("--source", help="Recorded screenshot directory or video instead of synthetic frames")
+    parser.add_argument("--config", default="{}", help="JSON configuration overrides")
+    parser.add_argument("--soak", type=int, metavar="CYCLES",
+                        help="Run CYCLES cycles at the first resolution and check memory stays flat")
+    parser.add_argument("--max-rss-growth", type=float, default=16.0, help="Soak limit for RSS growth in MB")
+    parser.add_argument("--max-heap-growth", type=float, default=256.0,
+                        help="Soak limit for traced heap growth in KB")
+    parser.add_argument("--min-recall", type=float, default=0.99,
+                        help="Fail if a scenario with expected clicks has a lower recall")
+    parser.add_argument("--min-precision", type=float, default=0.99,
+                        help="Fail if a scenario with expected clicks has a lower precision")
+    parser.add_argument("--compare", help='JSON object of named variants to run side by side, '
+                                          'e.g. {"bgr": {}, "gray": {"match_color": "gray"}}')
+    parser.add_argument("--output", default="bench_output.json", help="JSON result file")
+    args = parser.parse_args(argv)
+
+    overrides = json.loads(args.config)
+    variants = json.loads(args.compare) if args.compare else {None: {}}
+    jobs = []
+    for variant, variant_overrides in variants.items():
+        job_overrides = dict(overrides, **variant_overrides)
+        if args.soak:
+            name = args.resolutions.split(",")[0]
+            jobs.append((variant, (name, job_overrides, args.soak, None, True)))
+        elif args.source:
+            jobs.append((variant, ("replay", job_overrides, args.frames, args.source)))
+        else:
+            jobs.extend((variant, (name, job_overrides, args.frames, None))
+                        for name in args.resolutions.split(",") if name)
+
+    # 每個情境在獨立的行程執行，峰值 RSS 才不會互相影響
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for variant, job in jobs:
+        with context.Pool(1) as pool:
+            result = pool.apply(_run_isolated, (job,))
+        label = result["scenario"]
+        if variant is not None:
+            result["variant"] = variant
+            label = f"{variant}/{label}"
+        results.append(result)
+        latency = result["latency_ms"]
+        accuracy = result.get("accuracy")
+        accuracy_text = ""
+        if accuracy:
+            passed = check_accuracy(accuracy, args.min_recall, args.min_precision)
+            accuracy_text = (f", recall {accuracy['recall']:.2f}, precision {accuracy['precision']:.2f}"
+                             f"{'' if passed else ' -> FAIL'}")
+        print(f"{label}: {result['fps']:.1f} fps, p50 {latency.get('p50', 0):.1f} ms, "
+              f"p99 {latency.get('p99', 0):.1f} ms, peak RSS {result['peak_rss_mb']:.0f} MB{accuracy_text}")
+        soak = result.get("soak")
+        if soak:
+            soak["passed"] = (soak["rss_growth_mb"] <= args.max_rss_growth
+                              and soak["traced_growth_kb"] <= args.max_heap_growth)
+            print(f"  soak {soak['cycles']} cycles: {soak['alloc_per_cycle_kb']:.1f} KB allocated per cycle, "
+                  f"heap growth {soak['traced_growth_kb']:.1f} KB, blocks growth {soak['blocks_growth']:.0f}, "
+                  f"RSS growth {soak['rss_growth_mb']:.1f} MB, {soak['buffer_allocations']} frame buffer(s) "
+                  f"-> {'PASS' if soak['passed'] else 'FAIL'}")
+
+    for result in find_regressions(results):
+        print(f"{result['variant']}/{result['scenario']}: accuracy regressed against "
+              f"{result['accuracy']['regression']}")
+
+    report = {
+        "version": __version__,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "opencv": cv2.__version__,
+        "config": overrides,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2, ensure_ascii=False)
+    print(f"Results written to {args.output}")
+    failed = [result for result in results
+              if not result.get("soak", {}).get("passed", True)
+              or not result.get("accuracy", {}).get("passed", True)
+              or "regression" in result.get("accuracy", {})]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
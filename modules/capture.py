@@ -0,0 +1,535 @@
+"""
+Screen capture backends for the btnSprite application.
+
+Every backend returns ``Frame`` objects holding a BGR (or, in grayscale
+matching mode, single-channel) image, so the rest of the detection loop does
+not care where the pixels came from. Conversions write into preallocated
+buffers that are reused from frame to frame; with ``capture_native_order``
+frames keep the grabber's own channel order (BGRA for mss) and are not
+converted at all:
+
+- ``MssCapture``: fast grabber based on mss (XShm on Linux, BitBlt on Windows)
+- ``PyAutoGUICapture``: the original ``pyautogui.screenshot()`` path
+- ``ReplayCapture``: a directory of screenshots, a video file or a session
+  recording (see modules.recorder), no display needed
+"""
+
+import os
+import time
+import threading
+
+import cv2
+import numpy as np
+
+try:
+    import mss
+except ImportError:
+    mss = None
+
+from .recorder import SessionReader, is_recording
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+# 色彩排列之間的轉換碼 (來源, 目標) -> cv2 code
+CONVERSIONS = {
+    ("bgr", "gray"): cv2.COLOR_BGR2GRAY,
+    ("bgr", "bgra"): cv2.COLOR_BGR2BGRA,
+    ("bgr", "rgb"): cv2.COLOR_BGR2RGB,
+    ("bgra", "gray"): cv2.COLOR_BGRA2GRAY,
+    ("bgra", "bgr"): cv2.COLOR_BGRA2BGR,
+    ("bgra", "rgb"): cv2.COLOR_BGRA2RGB,
+    ("rgb", "gray"): cv2.COLOR_RGB2GRAY,
+    ("rgb", "bgr"): cv2.COLOR_RGB2BGR,
+    ("gray", "bgr"): cv2.COLOR_GRAY2BGR,
+    ("gray", "rgb"): cv2.COLOR_GRAY2RGB,
+}
+
+
+def convert_order(image, source, target, dst=None):
+    """
+    Convert an image between channel orders.
+
+    Args:
+        image (np.ndarray): Source image
+        source (str): Channel order of the image (bgr / bgra / rgb / gray)
+        target (str): Wanted channel order
+        dst (np.ndarray, optional): Preallocated output buffer
+
+    Returns:
+        np.ndarray: Converted image (the input itself if the orders match)
+    """
+    if source == target:
+        return image
+    return cv2.cvtColor(image, CONVERSIONS[(source, target)], dst=dst)
+
+
+def order_of(image):
+    """
+    Default channel order of an image by its channel count.
+    """
+    if image.ndim == 2:
+        return "gray"
+    return "bgra" if image.shape[2] == 4 else "bgr"
+
+
+class FrameBuffers:
+    """
+    Preallocated image buffers, reused round-robin.
+
+    Each name owns a small ring of arrays; a buffer is handed out again
+    after ``depth`` further requests, which is longer than a frame stays in
+    use (current frame, previous frame and checks still running).
+    """
+    def __init__(self, depth=4):
+        """
+        Args:
+            depth (int): Buffers per name
+        """
+        self.depth = depth
+        self._rings = {}
+        self._lock = threading.Lock()
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        """
+        Next buffer of a ring, reallocating the ring if the shape changed.
+
+        Args:
+            name (hashable): Buffer purpose, e.g. "frame" or ("gray", 2)
+            shape (tuple): Array shape
+            dtype: Array dtype
+
+        Returns:
+            np.ndarray: Uninitialised buffer
+        """
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is None or ring[0][0].shape != shape or ring[0][0].dtype != dtype:
+                ring = ([np.empty(shape, dtype) for _ in range(self.depth)], [0])
+                self._rings[name] = ring
+                self.allocations += self.depth
+            buffers, position = ring
+            buffer = buffers[position[0]]
+            position[0] = (position[0] + 1) % self.depth
+            return buffer
+
+
+class CaptureExhausted(Exception):
+    """
+    Raised when a replay source has no more frames.
+    """
+
+
+class Frame:
+    """
+    A single screen frame shared by every template check in one scan cycle.
+
+    The frame is captured and converted once; all checks in the cycle then
+    see exactly the same pixels.
+    """
+    def __init__(self, image, index=0, timestamp=None, source="screen", origin=(0, 0), order=None, buffers=None):
+        """
+        Args:
+            image (np.ndarray): BGR, BGRA, RGB or grayscale image
+            index (int): Sequence number of the frame
+            timestamp (float, optional): Capture time (time.time())
+            source (str): Where the frame came from (screen / file path)
+            origin (tuple): Screen coordinates of the frame's top-left pixel
+            order (str, optional): Channel order; guessed from the channel count if omitted
+            buffers (FrameBuffers, optional): Reusable buffers for derived images
+        """
+        self.image = image
+        self.index = index
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.source = source
+        self.origin = origin
+        self.order = order or order_of(image)
+        self.buffers = buffers
+        self.cache = {}  # 同一畫面衍生的影像 (縮圖等)，供各模板比對共用
+        self.changes = None  # 與上一畫面的差異 (FrameChanges)，None 表示未知
+        self.parent = None  # crop() 的來源畫面，可共用其 cache
+        self.offset = (0, 0)  # 在 parent 中的位置
+        self._lock = threading.Lock()
+
+    @property
+    def width(self):
+        return self.image.shape[1]
+
+    @property
+    def height(self):
+        return self.image.shape[0]
+
+    @property
+    def color(self):
+        return "gray" if self.order == "gray" else "bgr"
+
+    def _buffer(self, name, shape):
+        if self.buffers is None:
+            return np.empty(shape, np.uint8)
+        return self.buffers.get(name, shape)
+
+    def variant(self, color="bgr", scale=1):
+        """
+        The frame in another matching format, converted once per frame.
+
+        Args:
+            color (str): "bgr" (keep the frame's color channels) or "gray"
+            scale (int): Downscale factor
+
+        Returns:
+            Frame: Converted frame; coordinates are frame coordinates divided by ``scale``
+        """
+        if color == "bgr" and self.color == "gray":
+            raise ValueError("A grayscale frame cannot be matched in color")
+        if color == self.color and scale == 1:
+            return self
+
+        key = ("variant", color, scale)
+        variant = self.cache.get(key)
+        if variant is not None:
+            return variant
+
+        with self._lock:
+            variant = self.cache.get(key)
+            if variant is None:
+                image = self.image
+                # 先縮小再轉灰階，轉換的像素較少
+                if scale > 1:
+                    shape = (self.height // scale, self.width // scale) + image.shape[2:]
+                    image = cv2.resize(image, (shape[1], shape[0]), dst=self._buffer(("resize", scale), shape),
+                                       interpolation=cv2.INTER_AREA)
+                order = self.order
+                if color == "gray" and order != "gray":
+                    image = convert_order(image, order, "gray", dst=self._buffer(("gray", scale), image.shape[:2]))
+                    order = "gray"
+                variant = Frame(image, index=self.index, timestamp=self.timestamp, source=self.source,
+                                origin=self.origin, order=order, buffers=self.buffers)
+                self.cache[key] = variant
+        return variant
+
+    def crop(self, x, y, w, h):
+        """
+        View of a sub-region as a new frame (no pixel copy).
+
+        Args:
+            x, y, w, h (int): Region in frame coordinates
+
+        Returns:
+            Frame: Sub-frame whose origin is shifted accordingly
+        """
+        if (x, y, w, h) == (0, 0, self.width, self.height):
+            return self
+        cropped = Frame(
+            self.image[y:y + h, x:x + w],
+            index=self.index,
+            timestamp=self.timestamp,
+            source=self.source,
+            origin=(self.origin[0] + x, self.origin[1] + y),
+            order=self.order,
+            buffers=self.buffers,
+        )
+        cropped.parent = self.parent or self
+        cropped.offset = (self.offset[0] + x, self.offset[1] + y)
+        return cropped
+
+    @classmethod
+    def from_file(cls, path, index=0):
+        """
+        Build a frame from a saved screenshot.
+
+        Args:
+            path (str): Image file path
+            index (int): Sequence number of the frame
+
+        Returns:
+            Frame: Loaded frame
+
+        Raises:
+            IOError: If the image cannot be read
+        """
+        image = cv2.imread(path)
+        if image is None:
+            raise IOError(f"Cannot read image: {path}")
+        return cls(image, index=index, source=path, order="bgr")
+
+
+class CaptureBackend:
+    """
+    Base class for screen capture backends.
+    """
+    name = "base"
+    timings = (0.0, 0.0)
+    native_order = "bgr"  # 擷取來源本身的色彩排列
+    order = "bgr"  # 擷取後直接轉成的排列: bgr / gray / native_order
+    _buffers = None
+
+    @property
+    def buffers(self):
+        if self._buffers is None:
+            self._buffers = FrameBuffers()
+        return self._buffers
+
+    def grab(self, index=0):
+        """
+        Capture one frame.
+
+        Args:
+            index (int): Sequence number of the frame
+
+        Returns:
+            Frame: Captured frame in ``self.order``
+        """
+        start = time.perf_counter()
+        raw = self._grab()
+        grabbed = time.perf_counter()
+        image = self._convert(raw)
+        # 擷取與色彩轉換各自的耗時，供效能統計
+        self.timings = (grabbed - start, time.perf_counter() - grabbed)
+        return Frame(image, index=index, source=self.name, origin=self.origin, order=self.order, buffers=self.buffers)
+
+    @property
+    def origin(self):
+        return (0, 0)
+
+    def frame_shape(self):
+        """
+        Returns:
+            tuple or None: (height, width) of the frames, None if unknown before capturing
+        """
+        return None
+
+    def _grab(self):
+        raise NotImplementedError
+
+    def _convert(self, raw):
+        """
+        Convert a grabbed image to ``self.order``, into a reused buffer.
+        """
+        source = order_of(raw) if raw.ndim == 2 else self.native_order
+        if source == self.order:
+            return raw
+        shape = raw.shape[:2] if self.order == "gray" else raw.shape[:2] + (len(self.order),)
+        return convert_order(raw, source, self.order, dst=self.buffers.get("frame", shape))
+
+    def close(self):
+        pass
+
+    def describe(self):
+        return self.name
+
+
+class PyAutoGUICapture(CaptureBackend):
+    """
+    Capture through pyautogui.screenshot() (PIL, RGB).
+    """
+    name = "pyautogui"
+    native_order = "rgb"
+
+    def frame_shape(self):
+        import pyautogui
+        width, height = pyautogui.size()
+        return (height, width)
+
+    def _grab(self):
+        import pyautogui
+        return np.asarray(pyautogui.screenshot())
+
+
+class MssCapture(CaptureBackend):
+    """
+    Capture through mss, which uses XShm shared memory on Linux/X11.
+    """
+    name = "mss"
+    native_order = "bgra"
+
+    def __init__(self, monitor=1, region=None):
+        """
+        Args:
+            monitor (int): mss monitor index (0 = all monitors, 1 = primary)
+            region (list, optional): [x, y, w, h] in screen coordinates; captured instead of the monitor
+
+        Raises:
+            ImportError: If mss is not installed
+        """
+        if mss is None:
+            raise ImportError("mss is not installed")
+        self.monitor_index = monitor
+        self.region = tuple(region) if region else None
+        # mss 物件不可跨執行緒使用，每個執行緒各建一個
+        self._local = threading.local()
+        self._monitor = None
+
+    def _sct(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is None:
+            sct = mss.mss()
+            self._local.sct = sct
+            if self.region:
+                x, y, w, h = self.region
+                self._monitor = {"left": x, "top": y, "width": w, "height": h}
+            else:
+                self._monitor = sct.monitors[self.monitor_index]
+        return sct
+
+    @property
+    def origin(self):
+        if self._monitor is None:
+            return (0, 0)
+        return (self._monitor["left"], self._monitor["top"])
+
+    def frame_shape(self):
+        self._sct()
+        return (self._monitor["height"], self._monitor["width"])
+
+    def _grab(self):
+        sct = self._sct()
+        shot = sct.grab(self._monitor)
+        # 直接以 buffer protocol 包裝 mss 的像素資料，不複製
+        return np.frombuffer(shot.raw, dtype=np.uint8).reshape(shot.height, shot.width, 4)
+
+    def close(self):
+        sct = getattr(self._local, "sct", None)
+        if sct is not None:
+            sct.close()
+            self._local.sct = None
+
+    def describe(self):
+        if self.region:
+            return f"{self.name} (region {list(self.region)})"
+        return f"{self.name} (monitor {self.monitor_index})"
+
+
+class ReplayCapture(CaptureBackend):
+    """
+    Replay frames from a directory of screenshots, a video file or a session recording.
+    """
+    name = "replay"
+
+    def __init__(self, source, loop=False):
+        """
+        Args:
+            source (str): Directory of images, a video file or a .bsrec recording
+            loop (bool): Restart from the first frame when the source ends
+
+        Raises:
+            IOError: If the source does not exist or holds no frames
+        """
+        if not source or not os.path.exists(source):
+            raise IOError(f"Replay source not found: {source}")
+
+        self.source = source
+        self.loop = loop
+        self.position = 0
+        self._video = None
+        self._files = []
+        self._recording = None
+
+        if is_recording(source):
+            self._recording = SessionReader(source)
+            if not len(self._recording):
+                self._recording.close()
+                raise IOError(f"No frames in recording: {source}")
+            # 錄製時的畫面排列與位置，點擊座標與原本相同
+            self.native_order = self._recording.order
+        elif os.path.isdir(source):
+            self._files = sorted(
+                os.path.join(source, f) for f in os.listdir(source)
+                if f.lower().endswith(IMAGE_EXTENSIONS)
+            )
+            if not self._files:
+                raise IOError(f"No images in replay directory: {source}")
+        else:
+            self._video = cv2.VideoCapture(source)
+            if not self._video.isOpened():
+                raise IOError(f"Cannot open replay video: {source}")
+
+    def __len__(self):
+        if self._recording is not None:
+            return len(self._recording)
+        if self._video is not None:
+            return int(self._video.get(cv2.CAP_PROP_FRAME_COUNT))
+        return len(self._files)
+
+    @property
+    def origin(self):
+        if self._recording is not None:
+            return tuple(self._recording.meta.get("origin", (0, 0)))
+        return (0, 0)
+
+    def frame_shape(self):
+        if self._recording is not None:
+            return self._recording.frame_shape()
+        if self._video is not None:
+            return (int(self._video.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                    int(self._video.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        image = cv2.imread(self._files[0])
+        return image.shape[:2] if image is not None else None
+
+    def _grab(self):
+        if self._recording is not None:
+            if self.position >= len(self._recording):
+                if not self.loop:
+                    raise CaptureExhausted(self.source)
+                self.position = 0
+            # 重建的畫面在下次讀取時會被覆寫，複製到輪替使用的緩衝區
+            image = self._recording.frame(self.position)
+            replay = self.buffers.get("replay", image.shape)
+            np.copyto(replay, image)
+            image = replay
+        elif self._video is not None:
+            ok, image = self._video.read()
+            if not ok and self.loop:
+                self._video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ok, image = self._video.read()
+            if not ok:
+                raise CaptureExhausted(self.source)
+        else:
+            if self.position >= len(self._files):
+                if not self.loop:
+                    raise CaptureExhausted(self.source)
+                self.position = 0
+            path = self._files[self.position]
+            # 灰階模式直接解碼成灰階
+            image = cv2.imread(path, cv2.IMREAD_GRAYSCALE if self.order == "gray" else cv2.IMREAD_COLOR)
+            if image is None:
+                raise IOError(f"Cannot read image: {path}")
+
+        self.position += 1
+        return image
+
+    def close(self):
+        if self._video is not None:
+            self._video.release()
+        if self._recording is not None:
+            self._recording.close()
+
+    def describe(self):
+        return f"{self.name} ({self.source})"
+
+
+def create_capture_backend(config):
+    """
+    Create the capture backend selected by the configuration.
+
+    Args:
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+
+    Returns:
+        CaptureBackend: Capture backend
+
+    Raises:
+        ValueError: If the backend name is unknown
+    """
+    name = config.get("capture_backend", "auto")
+
+    if name == "auto":
+        name = "mss" if mss is not None else "pyautogui"
+
+    if name == "mss":
+        return MssCapture(monitor=config.get("capture_monitor", 1), region=config.get("capture_region"))
+    if name == "pyautogui":
+        return PyAutoGUICapture()
+    if name == "replay":
+        return ReplayCapture(config.get("capture_source"), loop=config.get("capture_loop", False))
+
+    raise ValueError(f"Unknown capture backend: {name}")
@@ -0,0 +1,125 @@
+"""
+Frame-change detection for the scanning loop.
+
+Each frame is reduced to a small grayscale thumbnail and compared with the
+previous one tile by tile. Template checks whose search region covers no
+changed tile can reuse the previous cycle's result.
+"""
+
+import cv2
+import numpy as np
+
+from .capture import FrameBuffers, convert_order
+
+
+class FrameChanges:
+    """
+    Changed tiles of one frame compared with the previous frame.
+    """
+    def __init__(self, grid, tile_size, all_changed=False):
+        """
+        Args:
+            grid (np.ndarray or None): Boolean grid, True where a tile changed
+            tile_size (int): Tile size in frame pixels
+            all_changed (bool): Treat every region as changed (first frame, resize)
+        """
+        self.grid = grid
+        self.tile_size = tile_size
+        self.all_changed = all_changed
+
+    @property
+    def any_changed(self):
+        return self.all_changed or bool(self.grid.any())
+
+    @property
+    def changed_tiles(self):
+        return -1 if self.all_changed else int(self.grid.sum())
+
+    def region_changed(self, region):
+        """
+        Check whether any tile overlapping a region changed.
+
+        Args:
+            region (tuple): (x, y, w, h) in frame coordinates
+
+        Returns:
+            bool: True if the region must be re-evaluated
+        """
+        if self.all_changed:
+            return True
+        x, y, w, h = region
+        t = self.tile_size
+        return bool(self.grid[y // t:(y + h - 1) // t + 1, x // t:(x + w - 1) // t + 1].any())
+
+
+class ChangeDetector:
+    """
+    Tiled, downsampled frame differencing.
+    """
+    def __init__(self, tile_size=64, downscale=4, threshold=12):
+        """
+        Args:
+            tile_size (int): Tile size in frame pixels (multiple of downscale)
+            downscale (int): Thumbnail reduction factor
+            threshold (int): Grey-level difference at which a tile counts as changed
+        """
+        self.downscale = max(1, downscale)
+        self.tile_size = max(self.downscale, tile_size - tile_size % self.downscale)
+        self.threshold = threshold
+        self._previous = None
+        self._shape = None
+        # 縮圖與差異影像重複使用同一組緩衝區 (目前與上一張輪流)
+        self._buffers = FrameBuffers(depth=2)
+        self._padded = None
+
+        # 統計
+        self.frames = 0
+        self.static_frames = 0
+
+    def _thumbnail(self, frame):
+        image = frame.image
+        h, w = image.shape[:2]
+        shape = (max(1, h // self.downscale), max(1, w // self.downscale))
+        small = cv2.resize(image, (shape[1], shape[0]), dst=self._buffers.get("small", shape + image.shape[2:]),
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = convert_order(small, frame.order, "gray", dst=self._buffers.get("thumb", shape))
+        return small
+
+    def update(self, frame):
+        """
+        Compare a frame with the previous one.
+
+        Args:
+            frame (Frame): New frame
+
+        Returns:
+            FrameChanges: Changed tiles
+        """
+        self.frames += 1
+        thumb = self._thumbnail(frame)
+        previous = self._previous
+        self._previous = thumb
+
+        if previous is None or previous.shape != thumb.shape or self._shape != frame.image.shape:
+            self._shape = frame.image.shape
+            return FrameChanges(None, self.tile_size, all_changed=True)
+
+        # 補齊成整數個 tile 後，一次取得每個 tile 的最大差異 (補齊的部分保持為 0)
+        t = self.tile_size // self.downscale
+        h, w = thumb.shape
+        ny, nx = -(-h // t), -(-w // t)
+        if self._padded is None or self._padded.shape != (ny * t, nx * t):
+            self._padded = np.zeros((ny * t, nx * t), dtype=thumb.dtype)
+        padded = self._padded
+        cv2.absdiff(thumb, previous, dst=padded[:h, :w])
+        grid = padded.reshape(ny, t, nx, t).max(axis=(1, 3)) > self.threshold
+
+        changes = FrameChanges(grid, self.tile_size)
+        if not changes.any_changed:
+            self.static_frames += 1
+        return changes
+
+    def reset(self):
+        self._previous = None
+        self._shape = None
@@ -0,0 +1,232 @@
+"""
+Configuration for the btnSprite application.
+
+Settings are read from ``config.json`` in the script directory (if present)
+and merged over ``DEFAULT_CONFIG``.
+"""
+
+import os
+import json
+import copy
+import logging
+
+CONFIG_FILENAME = "config.json"
+
+DEFAULT_CONFIG = {
+    # 模板圖片所在資料夾 (None = 程式目錄)
+    "template_dir": None,
+    # 偵測規則 (None = 預設的停止/核准/目標+按鈕規則)，格式見 modules/rules.py
+    "rules": None,
+    # 從 JSON 檔讀取偵測規則 (相對路徑以程式目錄為準)
+    "rules_file": None,
+    # 將縮小的模板等前處理結果快取到磁碟
+    "template_cache": True,
+    # 模板快取資料夾 (None = 程式目錄下的 .template_cache)
+    "template_cache_dir": None,
+    # 輸入動作之間等待時間的倍數 (0 = 不等待，用於重播/效能測試)
+    "input_pause_scale": 1.0,
+    # 各動作的等待時間 (秒)，覆寫 actions.DEFAULT_PROFILES，例如 {"type": {"focus": 0.3}}
+    "action_profiles": {},
+    # 同一目標在此秒數內、action_debounce_distance 像素內再次偵測到時不重複點擊 (0 = 關閉)
+    "action_debounce": 1.0,
+    "action_debounce_distance": 10,
+    # 等待執行的動作上限，超過時捨棄新的動作
+    "action_queue_size": 8,
+    # 螢幕擷取後端: auto / mss / pyautogui / replay
+    "capture_backend": "auto",
+    # mss 擷取的螢幕編號 (0 = 全部螢幕, 1 = 主螢幕)
+    "capture_monitor": 1,
+    # mss 只擷取這個螢幕區域 [x, y, 寬, 高] (None = 整個螢幕)
+    "capture_region": None,
+    # replay 來源: 截圖資料夾或影片檔
+    "capture_source": None,
+    # replay 播放完畢後是否重新開始
+    "capture_loop": False,
+    # 保留擷取來源的像素排列 (mss 為 BGRA)，省下每張畫面的色彩轉換；模板改成同樣排列
+    "capture_native_order": False,
+    # 比對策略: exhaustive (全解析度) / pyramid (先縮圖粗搜再局部精比) / fft (頻域批次比對)
+    "match_strategy": "exhaustive",
+    # 比對色彩: bgr (彩色) / gray (灰階，比對量約為三分之一)；可在規則內以 color 個別覆寫
+    "match_color": "bgr",
+    # 比對前將畫面與模板縮小的整數倍數 (1 = 原解析度)；可在規則內以 scale 個別覆寫
+    "match_scale": 1,
+    # 每個畫面對同一規則最多處理幾個命中 (1 = 只處理分數最高的)；可在規則內以 max_hits 個別覆寫
+    "match_max_hits": 1,
+    # 多個命中的處理順序: score (分數) / top (由上而下) / nearest (從游標位置依序找最近的)；可在規則內以 order 覆寫
+    "match_order": "score",
+    # pyramid: 縮放層數 (每層縮小一半)
+    "pyramid_levels": 2,
+    # pyramid: 粗搜分數可低於 confidence_threshold 的容許值
+    "pyramid_margin": 0.2,
+    # pyramid: 每個模板最多精比的候選點數
+    "pyramid_candidates": 3,
+    # fft: 搜尋範圍小於此像素數時改用直接比對
+    "fft_min_pixels": 65536,
+    # 固定搜尋範圍 (螢幕座標): {"button": [x, y, w, h], ...}
+    "roi_regions": {},
+    # 只在指定視窗內搜尋: {"button": "視窗標題", ...}
+    "roi_windows": {},
+    # 優先在上次找到的位置附近搜尋 (附近沒找到時，同一輪再搜尋整個範圍)
+    "roi_adaptive": True,
+    # 上次位置向外擴張的像素
+    "roi_margin": 40,
+    # 連續落空幾次後不再先搜尋上次位置附近
+    "roi_max_misses": 3,
+    # 畫面沒變化時沿用上次的比對結果
+    "change_detection": True,
+    # 變化偵測的區塊大小 (像素)
+    "change_tile_size": 64,
+    # 變化偵測前先縮小的倍數
+    "change_downscale": 4,
+    # 灰階差異超過此值才算變化
+    "change_threshold": 12,
+    # 閒置時最長的掃描間隔 (秒)
+    "scan_interval": 2,
+    # 有動作或畫面變化後的掃描間隔 (秒)
+    "scan_min_interval": 0.1,
+    # 閒置時每次掃描間隔放大的倍數
+    "scan_backoff": 1.5,
+    # 掃描最多佔用的 CPU 時間比例 (0 = 不限制)
+    "cpu_budget": 0.25,
+    # 同時比對模板的執行緒數 (0 或 1 = 依序比對，None = 4，單核心時依序比對)
+    "match_workers": None,
+    # LINE Messaging API 令牌與接收者 (None = 使用 LineNotifier 內的預設值)
+    "line_channel_access_token": None,
+    "line_user_id": None,
+    # LINE API 位址 (None = 官方位址；可指向本機測試伺服器)
+    "line_endpoint": None,
+    # LINE 推送失敗時的重試次數
+    "notify_retries": 3,
+    # 第一次重試前的等待秒數 (之後每次加倍)
+    "notify_backoff": 1.0,
+    # 此秒數內的多則通知合併成一則摘要
+    "notify_coalesce_window": 2.0,
+    # 結束時等待剩餘通知送出的最長秒數
+    "notify_flush_timeout": 5.0,
+    # 介面日誌保留的歷史行數
+    "log_history_lines": 5000,
+    # 日誌視窗最多顯示的行數
+    "log_max_lines": 2000,
+    # 日誌寫入視窗的間隔 (毫秒)
+    "log_flush_interval": 100,
+    # 命中區域預覽的最高更新頻率 (每秒張數)
+    "preview_fps": 5,
+    # 預覽縮圖的最長邊 (像素)
+    "preview_size": 100,
+    # 本機效能統計端點的埠號 (None = 關閉)，提供 /metrics 與 /metrics.json
+    "metrics_port": None,
+    # 定期寫出效能統計 JSON 的路徑 (None = 關閉)
+    "metrics_snapshot_path": None,
+    # 寫出效能統計 JSON 的間隔 (秒)
+    "metrics_snapshot_interval": 60,
+    # 效能分析方式: sampling (取樣，輸出 collapsed stacks) / cprofile (輸出 .prof)
+    "profile_mode": "sampling",
+    # 效能分析結果資料夾 (None = 程式目錄下的 profiles)
+    "profile_dir": None,
+    # 取樣間隔 (秒)
+    "profile_interval": 0.005,
+    # 日誌中列出的最耗時函式數
+    "profile_top": 15,
+    # 啟動精靈時就開始效能分析
+    "profile_on_start": False,
+    # python -m modules.supervisor: 每個螢幕/顯示器一個工作行程，例如
+    # [{"name": "left", "capture_monitor": 1}, {"name": "xvfb", "display": ":99"}]；空白時每個螢幕各一個
+    "supervisor_workers": [],
+    # 工作行程異常結束後重新啟動的等待時間 (秒，連續失敗時加倍直到上限)
+    "supervisor_restart_delay": 1.0,
+    "supervisor_max_restart_delay": 60.0,
+    # 每個工作行程使用的執行緒數 (None = CPU 核心數 / 工作行程數)
+    "supervisor_threads": None,
+    # 偵測伺服器位址 (unix:/路徑 或 tcp:主機:埠)；設定後比對交給伺服器，本機只擷取畫面與執行動作
+    "detection_server": None,
+    # 畫面傳送方式: auto (本機伺服器用共享記憶體) / socket / shm
+    "detection_transport": "auto",
+    # 以 socket 傳送時每隔幾張畫面送一次完整畫面，其餘只送有變化的區塊
+    "detection_keyframe_interval": 30,
+    # 連線與等待回覆的逾時 (秒)
+    "detection_timeout": 2.0,
+    # 伺服器無法連線時在本機比對，並每隔 detection_retry_delay 秒重新連線
+    "detection_fallback": True,
+    "detection_retry_delay": 5.0,
+    # 伺服器日誌中顯示的用戶端名稱 (None = 主機名稱:行程編號)
+    "detection_client_name": None,
+    # python -m modules.detection_server: 監聽位址、比對執行緒數
+    "detection_listen": "tcp:127.0.0.1:8766",
+    "detection_workers": 4,
+    # 在這段時間 (秒) 內收到的各用戶端請求合併成一批，最多 detection_batch_size 個
+    "detection_batch_window": 0.002,
+    "detection_batch_size": 16,
+    # 伺服器保留在記憶體中的模板上限 (MB，含縮放層、頻譜等比對資料；超過時淘汰最久未使用的)
+    "detection_template_mb": 256,
+    # 允許用戶端以共享記憶體傳送畫面
+    "detection_allow_shm": True,
+    # 協調器位址 (tcp:主機:埠)；設定後定期回報心跳、掃描統計與停止事件
+    "fleet_coordinator": None,
+    # 在協調器顯示的節點名稱 (None = 主機名稱，supervisor 工作行程再加上行程名稱)
+    "fleet_node_name": None,
+    # 回報間隔 (秒)；停止事件立即送出
+    "fleet_report_interval": 2.0,
+    # 連線與等待確認的逾時、斷線後重新連線的等待時間 (秒)
+    "fleet_timeout": 5.0,
+    "fleet_retry_delay": 5.0,
+    # 無法連線時最多保留的事件數
+    "fleet_max_pending": 10000,
+    # 停止通知交給協調器發送 (連不上協調器時仍由本機發送)
+    "fleet_notify": True,
+    # python -m modules.fleet: 監聽位址、狀態頁埠號 (http://127.0.0.1:埠/status，None = 關閉)
+    "fleet_listen": "tcp:127.0.0.1:8767",
+    "fleet_status_port": 8768,
+    # 超過這段時間沒有回報視為失去連線；回報中但沒有掃描視為停止回應 (秒)
+    "fleet_lost_after": 30.0,
+    "fleet_stuck_after": 60.0,
+    # 同一原因在這段時間內的停止通知合併成一則 (秒)
+    "fleet_notify_window": 10.0,
+    # 同一節點、同一原因在這段時間內只通知一次 (秒)
+    "fleet_notify_dedupe": 300.0,
+    # 每個週期最多發送的 LINE 訊息數 (0 = 不限)，超過的合併到下一則
+    "fleet_notify_limit": 5,
+    "fleet_notify_period": 600.0,
+    # 把分析過的畫面與偵測結果錄成 .bsrec 檔，可用 replay 擷取或效能測試重播
+    "record_sessions": False,
+    # 錄影檔資料夾 (None = 程式目錄下的 recordings)
+    "record_dir": None,
+    # 每隔幾個畫面存一張完整畫面，其餘只存有變化的區塊
+    "record_keyframe_interval": 300,
+    # 比對變化的區塊大小 (像素)
+    "record_tile_size": 64,
+    # zlib 壓縮等級 (0 = 不壓縮)
+    "record_compression": 1,
+    # 等待寫入的畫面數上限，寫入跟不上時略過畫面而不拖慢掃描
+    "record_queue_size": 4,
+}
+
+
+def load_config(path=None, overrides=None):
+    """
+    Load the configuration.
+
+    Args:
+        path (str, optional): Config file path; defaults to config.json in the script directory
+        overrides (dict, optional): Values that take precedence over the file
+
+    Returns:
+        dict: Merged configuration
+    """
+    logger = logging.getLogger('key_wizard')
+    config = copy.deepcopy(DEFAULT_CONFIG)
+
+    if path is None:
+        script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        path = os.path.join(script_dir, CONFIG_FILENAME)
+
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as config_file:
+                config.update(json.load(config_file))
+        except Exception as e:
+            logger.error(f"Error loading config {path}: {str(e)}")
+
+    if overrides:
+        config.update(overrides)
+
+    return config
@@ -0,0 +1,529 @@
+"""
+Client mode of KeyWizard: template matching on a detection server.
+
+RemoteMatchEngine has the interface of MatchEngine. Where and how each
+template is searched is still decided locally (region trackers, change
+detection, cached results); only the matching itself runs on the server
+(see modules.detection_server). Each cycle sends one message with the
+frame and every search that cannot reuse its previous result.
+
+Frames are sent in full every ``detection_keyframe_interval`` frames and
+otherwise as the tiles that differ from the server's copy. The client
+keeps a copy of what it sent and compares exactly (no threshold), so
+slow changes below the change detector's threshold still reach the
+server and every search runs on the same pixels as the client's frame.
+With a local server, ``detection_transport`` "shm" (the default for local
+addresses) copies the frame into shared memory instead and sends only its
+name.
+
+When the server cannot be reached, searches run locally if
+``detection_fallback`` is on; reconnecting is retried every
+``detection_retry_delay`` seconds.
+"""
+
+import os
+import time
+import socket
+import hashlib
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+
+from . import wire
+
+
+class DetectionClient:
+    """
+    Connection to a detection server.
+    """
+    def __init__(self, address, transport="auto", keyframe_interval=30, tile_size=64, timeout=2.0, retry_delay=5.0,
+                 name=None):
+        """
+        Args:
+            address (str): Server address ("unix:/path" or "tcp:host:port")
+            transport (str): "socket", "shm" or "auto" (shm for local servers)
+            keyframe_interval (int): Frames between full frames (1 = never send deltas)
+            tile_size (int): Tile size of delta frames (pixels)
+            timeout (float): Connect and reply timeout (seconds)
+            retry_delay (float): Wait before reconnecting after a failure (seconds)
+            name (str, optional): Client name shown in the server log
+        """
+        if transport not in ("auto", "socket", "shm"):
+            raise ValueError(f"Unknown detection transport: {transport}")
+        wire.parse_address(address)
+        self.address = address
+        self.transport = transport
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.tile_size = max(8, tile_size)
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.logger = logging.getLogger('key_wizard')
+
+        self.sock = None
+        self.reader = None
+        self.use_shm = False
+        self._retry_at = 0.0
+        self._uploaded = set()
+        self._digests = {}  # id(模板) -> (模板, digest)
+        self._shm = None
+        self._next_id = 0
+        self._mirror = None  # 伺服器上目前畫面的複本
+        self._synced = False  # 伺服器的畫面與 _mirror 相同
+        self._padded = None
+        self._since_keyframe = 0
+
+        # 統計
+        self.requests = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.bytes_sent = 0
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def connect(self):
+        """
+        Connect unless connected or waiting to retry.
+
+        Raises:
+            OSError: If the server cannot be reached (or a retry is not due yet)
+        """
+        if self.sock is not None:
+            return
+        if time.monotonic() < self._retry_at:
+            raise ConnectionError("Detection server unavailable")
+        try:
+            self.sock = wire.connect(self.address, self.timeout)
+            self.reader = wire.MessageReader(self.sock)
+            wire.send_message(self.sock, {"type": "hello", "version": wire.PROTOCOL_VERSION, "name": self.name})
+            welcome = self._read("welcome")
+            if welcome.get("version") != wire.PROTOCOL_VERSION:
+                raise wire.ProtocolError(f"Unsupported detection server version {welcome.get('version')}")
+            self.use_shm = self.transport == "shm" or (
+                self.transport == "auto" and welcome.get("shm") and wire.is_local(self.address))
+            self.logger.info(
+                f"Connected to detection server {self.address} "
+                f"(match strategy: {welcome.get('matcher')}, frames: {'shm' if self.use_shm else 'socket'})"
+            )
+        except (OSError, wire.ProtocolError) as e:
+            self.disconnect(f"Cannot connect to detection server {self.address}: {str(e)}")
+            raise ConnectionError(str(e))
+
+    def disconnect(self, reason=None):
+        """
+        Drop the connection; the next request reconnects after the retry delay.
+        """
+        if reason:
+            self.logger.warning(reason)
+            self._retry_at = time.monotonic() + self.retry_delay
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+        self._uploaded = set()
+        self._synced = False
+
+    def _read(self, expected=None):
+        message = self.reader.read()
+        if message is None:
+            raise ConnectionError("Detection server closed the connection")
+        header, payload = message
+        if expected is not None and header.get("type") != expected:
+            raise wire.ProtocolError(f"Expected {expected}, got {header.get('type')}")
+        return header
+
+    def digest(self, template):
+        """
+        Content digest a template is stored under on the server.
+        """
+        entry = self._digests.get(id(template))
+        if entry is None or entry[0] is not template:
+            data = hashlib.blake2b(np.ascontiguousarray(template).data, digest_size=16)
+            data.update(f"{template.shape}{template.dtype.str}".encode("ascii"))
+            entry = (template, data.hexdigest())
+            self._digests[id(template)] = entry
+        return entry[1]
+
+    def upload(self, templates):
+        """
+        Upload the templates the server does not have yet.
+
+        Args:
+            templates (list): Template arrays in their matching format
+        """
+        wanted = {}
+        for template in templates:
+            digest = self.digest(template)
+            if digest not in self._uploaded:
+                wanted[digest] = template
+        if not wanted:
+            return
+        wire.send_message(self.sock, {"type": "query", "digests": list(wanted)})
+        missing = self._read("missing")["digests"]
+        if missing:
+            items = []
+            offset = 0
+            for digest in missing:
+                template = np.ascontiguousarray(wanted[digest])
+                items.append(dict(wire.array_meta(template), digest=digest, offset=offset))
+                offset += template.nbytes
+            wire.send_message(self.sock, {"type": "templates", "templates": items},
+                              *(wanted[digest] for digest in missing))
+            self._read("ok")
+        self._uploaded.update(wanted)
+
+    def _frame_message(self, frame, keyframe=False):
+        """
+        Frame header and payloads: shared memory, changed tiles or the full image.
+        """
+        image = frame.image
+        info = {"shape": list(image.shape), "order": frame.order, "index": frame.index}
+
+        if self.use_shm:
+            from multiprocessing import shared_memory
+
+            if self._shm is None or self._shm.size < image.nbytes:
+                self._close_shm()
+                self._shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+            np.ndarray(image.shape, np.uint8, buffer=self._shm.buf)[...] = image
+            info.update(mode="shm", shm=self._shm.name)
+            return info, ()
+
+        delta = (not keyframe and self._synced and self._mirror.shape == image.shape
+                 and self._since_keyframe < self.keyframe_interval)
+        if delta:
+            rects = wire.changed_rects(self._changed_tiles(image), self.tile_size, frame.width, frame.height)
+            if sum(w * h for _, _, w, h in rects) * 2 < frame.width * frame.height:
+                # 只送出有變化的區塊 (變化超過一半時改送完整畫面)
+                self.deltas += 1
+                self._since_keyframe += 1
+                info.update(mode="delta", rects=rects)
+                return info, tuple(image[y:y + h, x:x + w] for x, y, w, h in rects)
+
+        self.keyframes += 1
+        self._since_keyframe = 1
+        info.update(mode="full")
+        return info, (image,)
+
+    def _changed_tiles(self, image):
+        """
+        Tiles that differ from the server's copy, compared exactly.
+
+        Returns:
+            np.ndarray: Boolean tile grid
+        """
+        t = self.tile_size
+        h, w = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        ny, nx = -(-h // t), -(-w // t)
+        # 通道攤平成一列 (h, w * c)，補齊成整數個 tile 後一次比較 (補齊的部分保持為 False)
+        if self._padded is None or self._padded.shape != (ny * t, nx * t * channels):
+            self._padded = np.zeros((ny * t, nx * t * channels), bool)
+        np.not_equal(image.reshape(h, w * channels), self._mirror.reshape(h, w * channels),
+                     out=self._padded[:h, :w * channels])
+        return self._padded.reshape(ny, t, nx, t * channels).any(axis=(1, 3))
+
+    def send(self, frame, searches, keyframe=False, request_id=None):
+        """
+        Send the searches of one frame.
+
+        Args:
+            frame (Frame): Frame to search
+            searches (list): (template, SearchRequest) in priority order
+            keyframe (bool): Send the full frame even if a delta would do
+            request_id (int, optional): Reuse an id (when resending)
+
+        Returns:
+            int: Request id; results are read with read_reply()
+        """
+        self.connect()
+        self.upload([template for template, _ in searches])
+        if request_id is None:
+            self._next_id += 1
+            request_id = self._next_id
+        info, payloads = self._frame_message(frame, keyframe)
+        checks = [{"template": self.digest(template), "request": request.to_dict()} for template, request in searches]
+        wire.send_message(self.sock, {"type": "match", "id": request_id, "frame": info, "checks": checks}, *payloads)
+        if info["mode"] != "shm":
+            # 伺服器套用後的畫面與這張畫面相同
+            if self._mirror is None or self._mirror.shape != frame.image.shape:
+                self._mirror = np.empty_like(frame.image)
+            np.copyto(self._mirror, frame.image)
+            self._synced = True
+        self.requests += 1
+        self.bytes_sent += sum(np.asarray(payload).nbytes for payload in payloads)
+        return request_id
+
+    def read_reply(self, request_id):
+        """
+        Read the next message about a request, skipping replies to older ones.
+
+        Returns:
+            dict: "hit", "done", "missing" or "error" message
+        """
+        while True:
+            header = self._read()
+            if header.get("id") == request_id:
+                return header
+
+    def cancel(self, request_id):
+        wire.send_message(self.sock, {"type": "cancel", "id": request_id})
+
+    def stats(self):
+        """
+        Returns:
+            dict: The server's statistics
+        """
+        self.connect()
+        wire.send_message(self.sock, {"type": "stats"})
+        return self._read("stats")
+
+    def _close_shm(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def close(self):
+        self.disconnect()
+        self._close_shm()
+
+
+class RemoteResults:
+    """
+    Results of one frame's searches, read back from the server by name.
+    """
+    def __init__(self, engine, frame, checks, results, searches):
+        """
+        Args:
+            engine (RemoteMatchEngine): Engine that sent the request
+            frame (Frame): Frame searched
+            checks (dict): name -> (template, confidence) of every submitted check
+            results (dict): name -> positions of checks resolved without searching
+            searches (dict): name -> (template, SearchRequest) of the searches sent
+        """
+        self.engine = engine
+        self.frame = frame
+        self._checks = checks
+        self._results = results
+        self._searches = searches
+        self._matches = {}  # 伺服器回傳、尚未換算的結果
+        self.request_id = None
+        self.done = not searches
+        self.cancelled = False
+
+    def _fail(self, reason):
+        # 連線中斷: 剩下的比對在本機執行 (或視為沒有找到)
+        self.engine.client.disconnect(reason)
+        self.done = True
+
+    def _receive(self, name):
+        """
+        Read server messages until the result of ``name`` (or the end of the request) arrived.
+        """
+        client = self.engine.client
+        while not self.done and name not in self._matches:
+            try:
+                reply = client.read_reply(self.request_id)
+            except (OSError, wire.ProtocolError) as e:
+                self._fail(f"Detection server connection lost: {str(e)}")
+                return
+            kind = reply.get("type")
+            if kind == "hit":
+                if "error" in reply:
+                    self.engine.logger.error(f"Detection server failed on {reply['name']}: {reply['error']}")
+                    self._matches[reply["name"]] = None
+                else:
+                    self._matches[reply["name"]] = [tuple(match) for match in reply["matches"]]
+            elif kind == "done":
+                self.done = True
+                self.engine.observe_request(reply)
+            elif kind == "missing":
+                # 伺服器已淘汰部分模板: 重新上傳並以完整畫面重送
+                client._uploaded.difference_update(reply["digests"])
+                try:
+                    client.send(self.frame, list(self._searches.values()), keyframe=True, request_id=self.request_id)
+                except (OSError, wire.ProtocolError) as e:
+                    self._fail(f"Detection server connection lost: {str(e)}")
+            else:
+                # 伺服器無法使用這張畫面: 下次送完整畫面，這次在本機比對
+                client._synced = False
+                self.engine.logger.warning(f"Detection server rejected frame {self.frame.index}: {reply.get('error')}")
+                self.done = True
+
+    def get(self, name):
+        """
+        Get the result of one check, waiting for the server if necessary.
+
+        Args:
+            name (str): Check name
+
+        Returns:
+            list or None: (center_x, center_y, w, h) of every match, None if not found or not submitted
+        """
+        if name in self._results:
+            return self._results[name]
+        if name not in self._checks:
+            return None
+
+        search = self._searches.get(name)
+        if search is None:
+            return None
+        template, request = search
+        self._receive(name)
+        if name in self._matches:
+            matches = self._matches.pop(name)
+            result = self.engine.finish(self.frame, request, matches or [])
+        elif self.cancelled:
+            result = None
+        else:
+            result = self.engine.search_locally(self.frame, template, request)
+        self._results[name] = result
+        return result
+
+    def resolved(self):
+        """
+        Returns:
+            dict: name -> result of the checks read so far
+        """
+        return dict(self._results)
+
+    def cancel(self):
+        """
+        Ask the server to skip searches that have not started yet (a higher-priority check already decided).
+        """
+        self.cancelled = True
+        if not self.done and self.engine.client.connected:
+            try:
+                self.engine.client.cancel(self.request_id)
+            except OSError as e:
+                self._fail(f"Detection server connection lost: {str(e)}")
+
+    def drain(self):
+        """
+        Consume the rest of the server's reply so the next request starts clean.
+        """
+        while not self.done:
+            self._receive(None)
+
+
+class RemoteMatchEngine:
+    """
+    Runs the template checks of a cycle on a detection server.
+    """
+    def __init__(self, client, plan, finish, run_local, fallback=True, metrics=None):
+        """
+        Args:
+            client (DetectionClient): Server connection
+            plan (callable): plan(template, confidence, frame, name) -> (SearchRequest or None, cached result)
+            finish (callable): finish(frame, request, matches) -> positions
+            run_local (callable): run_local(frame, template, request) -> positions, matching in this process
+            fallback (bool): Match locally while the server is unavailable
+            metrics (Metrics, optional): Receives request timings and counters
+        """
+        self.client = client
+        self.plan = plan
+        self.finish = finish
+        self.run_local = run_local
+        self.fallback = fallback
+        self.metrics = metrics
+        self.logger = logging.getLogger('key_wizard')
+        self._last = None
+
+    @property
+    def parallel(self):
+        return True
+
+    @contextmanager
+    def completing(self, generation):
+        # 結果都在掃描執行緒上依序套用，不會被較舊的一輪覆蓋
+        yield True
+
+    def search_locally(self, frame, template, request):
+        if not self.fallback:
+            return None
+        if self.metrics is not None:
+            self.metrics.inc("detection_fallback", template=request.name)
+        return self.run_local(frame, template, request)
+
+    def observe_request(self, reply):
+        if self.metrics is not None:
+            self.metrics.observe("detection_server", reply.get("server_ms", 0.0) / 1000)
+            if reply.get("skipped"):
+                self.metrics.inc("detection_skipped", amount=reply["skipped"])
+
+    def submit(self, frame, checks):
+        """
+        Plan the checks for one frame and send the searches to the server.
+
+        Args:
+            frame (Frame): Frame shared by all checks
+            checks (list): (name, template, confidence) tuples in priority order
+
+        Returns:
+            RemoteResults: Results to read back by name
+        """
+        if self._last is not None:
+            self._last.drain()
+            self._last = None
+
+        results = {}
+        searches = {}
+        for name, template, confidence in checks:
+            request, cached = self.plan(template, confidence, frame, name)
+            if request is None:
+                results[name] = cached
+            else:
+                searches[name] = (template, request)
+
+        remote = RemoteResults(self, frame, {name: (template, confidence) for name, template, confidence in checks},
+                               results, searches)
+        if searches:
+            try:
+                remote.request_id = self.client.send(frame, list(searches.values()))
+                self._last = remote
+            except (OSError, wire.ProtocolError) as e:
+                if self.client.connected:
+                    self.client.disconnect(f"Detection server connection lost: {str(e)}")
+                remote.done = True
+        return remote
+
+    def shutdown(self):
+        if self._last is not None:
+            self._last.cancel()
+            self._last.drain()
+            self._last = None
+        self.client.close()
+
+
+def create_remote_engine(config, plan, finish, run_local, metrics=None):
+    """
+    Build the RemoteMatchEngine for the configured detection server.
+
+    Args:
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+        plan (callable): See RemoteMatchEngine
+        finish (callable): See RemoteMatchEngine
+        run_local (callable): See RemoteMatchEngine
+        metrics (Metrics, optional): Receives request timings and counters
+
+    Returns:
+        RemoteMatchEngine: Engine (connects on the first cycle)
+    """
+    client = DetectionClient(
+        config["detection_server"],
+        transport=config.get("detection_transport", "auto"),
+        keyframe_interval=config.get("detection_keyframe_interval", 30),
+        tile_size=config.get("change_tile_size", 64),
+        timeout=config.get("detection_timeout", 2.0),
+        retry_delay=config.get("detection_retry_delay", 5.0),
+        name=config.get("detection_client_name"),
+    )
+    return RemoteMatchEngine(client, plan, finish, run_local, fallback=config.get("detection_fallback", True),
+                             metrics=metrics)
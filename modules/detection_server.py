@@ -0,0 +1,522 @@
+"""
+Detection server: template matching for many clients over a local socket.
+
+``python -m modules.detection_server`` listens on ``detection_listen``
+(``unix:/path`` or ``tcp:host:port``). Each client (a KeyWizard with
+``detection_server`` set, see modules.detection_client) uploads its
+templates once, then sends one message per scan cycle with its frame and
+the searches to run on it. Frames arrive in full, as the changed tiles
+since the previous frame, or as the name of a shared-memory block the
+client writes into.
+
+Searches of all clients go through one dispatcher: requests arriving
+within ``detection_batch_window`` are interleaved round-robin on a single
+worker pool, so a client with many checks does not starve the others.
+Results are streamed back per check in completion order; a client that
+has already decided (e.g. the stop image was found) cancels the rest of
+its request. Templates are kept decoded and prepared (pyramid levels, FFT
+data) across clients and reconnects, keyed by their content digest.
+"""
+
+import os
+import sys
+import time
+import queue
+import socket
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import wire
+from .capture import Frame, FrameBuffers
+from .config import load_config
+from .matcher import SearchRequest, create_matcher, search
+from .metrics import Metrics
+
+
+class Job:
+    """
+    The searches of one client message, run on one frame.
+    """
+    def __init__(self, session, request_id, frame, checks):
+        """
+        Args:
+            session (Session): Client that sent the request
+            request_id (int): Client's request id
+            frame (Frame): Frame to search
+            checks (list): (template, SearchRequest) in the client's priority order
+        """
+        self.session = session
+        self.id = request_id
+        self.frame = frame
+        self.checks = checks
+        self.received = time.perf_counter()
+        self.cancelled = False
+        self.skipped = 0
+        self.done = threading.Event()
+        self._pending = len(checks)
+        self._lock = threading.Lock()
+
+    def finish_check(self):
+        """
+        Returns:
+            bool: True if this was the last check of the job
+        """
+        with self._lock:
+            self._pending -= 1
+            return self._pending == 0
+
+
+class Session:
+    """
+    One client connection, served by its own thread.
+    """
+    def __init__(self, server, sock, number):
+        self.server = server
+        self.sock = sock
+        self.name = f"client-{number}"
+        self.reader = wire.MessageReader(sock)
+        self.logger = server.logger
+        self._send_lock = threading.Lock()
+        self._image = None  # 以完整畫面與差異區塊更新的畫面
+        self._buffers = FrameBuffers(depth=2)
+        self._shm = None  # (名稱, SharedMemory)
+        self._job = None
+
+    def send(self, header, *payloads):
+        with self._send_lock:
+            wire.send_message(self.sock, header, *payloads)
+
+    def run(self):
+        try:
+            while self.server.running:
+                message = self.reader.read()
+                if message is None:
+                    break
+                self.handle(*message)
+        except (OSError, wire.ProtocolError) as e:
+            if self.server.running:
+                self.logger.warning(f"Detection client {self.name} disconnected: {str(e)}")
+        finally:
+            self.close()
+
+    def handle(self, header, payload):
+        kind = header.get("type")
+        if kind == "hello":
+            self.name = str(header.get("name") or self.name)
+            self.logger.info(f"Detection client {self.name} connected")
+            self.send({
+                "type": "welcome",
+                "version": wire.PROTOCOL_VERSION,
+                "matcher": self.server.matcher.name,
+                "shm": self.server.allow_shm,
+            })
+        elif kind == "query":
+            self.send({"type": "missing", "digests": self.server.missing(header.get("digests", []))})
+        elif kind == "templates":
+            self.server.add_templates(header.get("templates", []), payload)
+            self.send({"type": "ok"})
+        elif kind == "match":
+            self._match(header, payload)
+        elif kind == "cancel":
+            job = self._job
+            if job is not None and job.id == header.get("id"):
+                job.cancelled = True
+        elif kind == "stats":
+            self.send(dict(self.server.stats(), type="stats"))
+        else:
+            raise wire.ProtocolError(f"Unknown message type: {kind}")
+
+    def _match(self, header, payload):
+        # 同一連線一次只處理一個請求: 下一張畫面會覆寫目前的畫面緩衝區
+        if self._job is not None:
+            self._job.done.wait()
+        request_id = header.get("id")
+
+        checks = []
+        missing = []
+        for item in header.get("checks", []):
+            template = self.server.template(item["template"])
+            if template is None:
+                missing.append(item["template"])
+            else:
+                checks.append((template, SearchRequest.from_dict(item["request"])))
+        if missing:
+            # 模板已被淘汰: 客戶端重新上傳後以完整畫面重送
+            self.send({"type": "missing", "id": request_id, "digests": missing})
+            return
+
+        try:
+            frame = self._frame(header["frame"], payload)
+        except (KeyError, ValueError, wire.ProtocolError) as e:
+            self.send({"type": "error", "id": request_id, "error": str(e)})
+            return
+
+        job = Job(self, request_id, frame, checks)
+        self._job = job
+        self.server.enqueue(job)
+
+    def _frame(self, info, payload):
+        """
+        Build the frame of a request from a full image, changed tiles or shared memory.
+        """
+        shape = tuple(info["shape"])
+        mode = info["mode"]
+        if mode == "shm":
+            if not self.server.allow_shm:
+                raise wire.ProtocolError("Shared memory is disabled on this server")
+            image = self._attach(info["shm"], shape)
+        elif mode == "full":
+            if self._image is None or self._image.shape != shape:
+                self._image = np.empty(shape, np.uint8)
+            self._image[...] = wire.array_from({"shape": shape, "dtype": "|u1"}, payload)
+            image = self._image
+        elif mode == "delta":
+            if self._image is None or self._image.shape != shape:
+                raise wire.ProtocolError("Delta frame without a keyframe")
+            offset = 0
+            for x, y, w, h in info["rects"]:
+                tile = wire.array_from({"shape": (h, w) + shape[2:], "dtype": "|u1"}, payload, offset)
+                self._image[y:y + h, x:x + w] = tile
+                offset += tile.nbytes
+            image = self._image
+        else:
+            raise wire.ProtocolError(f"Unknown frame mode: {mode}")
+        return Frame(image, index=info.get("index", 0), source=self.name, order=info.get("order"),
+                     buffers=self._buffers)
+
+    def _attach(self, name, shape):
+        from multiprocessing import shared_memory
+
+        if self._shm is None or self._shm[0] != name:
+            self._detach()
+            block = shared_memory.SharedMemory(name=name)
+            if os.name == "posix":
+                # 共享記憶體屬於客戶端，不要在本行程結束時被 resource_tracker 刪除
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(block._name, "shared_memory")
+            self._shm = (name, block)
+        block = self._shm[1]
+        if int(np.prod(shape)) > block.size:
+            raise wire.ProtocolError("Frame larger than the shared memory block")
+        return np.ndarray(shape, np.uint8, buffer=block.buf)
+
+    def _detach(self):
+        if self._shm is not None:
+            try:
+                self._shm[1].close()
+            except BufferError:
+                pass
+            self._shm = None
+
+    def close(self):
+        if self._job is not None:
+            self._job.cancelled = True
+            self._job.done.wait(5.0)
+        self._detach()
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+        self.server.remove_session(self)
+        self.logger.info(f"Detection client {self.name} closed")
+
+
+class DetectionServer:
+    """
+    Serves template searches for many clients from one matcher and worker pool.
+    """
+    def __init__(self, config, address=None):
+        """
+        Args:
+            config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+            address (str, optional): Listen address; detection_listen if omitted
+        """
+        self.config = config
+        self.address = address or config.get("detection_listen", "tcp:127.0.0.1:8766")
+        self.matcher = create_matcher(config)
+        self.workers = max(1, config.get("detection_workers", 4))
+        self.batch_window = config.get("detection_batch_window", 0.002)
+        self.batch_size = max(1, config.get("detection_batch_size", 16))
+        self.template_limit = config.get("detection_template_mb", 256) * 1024 * 1024
+        self.allow_shm = bool(config.get("detection_allow_shm", True))
+        self.logger = logging.getLogger('key_wizard')
+        self.metrics = Metrics()
+
+        self.running = False
+        self._templates = OrderedDict()  # digest -> 模板 (最近使用的在最後)
+        self._template_bytes = 0
+        self._templates_lock = threading.Lock()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._executor = None
+        self._listener = None
+        self._threads = []
+        self._session_count = 0
+
+        # 統計
+        self.batches = 0
+        self.jobs = 0
+        self.checks = 0
+        self.skipped = 0
+
+    # 模板
+
+    def template(self, digest):
+        with self._templates_lock:
+            template = self._templates.get(digest)
+            if template is not None:
+                self._templates.move_to_end(digest)
+            return template
+
+    def missing(self, digests):
+        with self._templates_lock:
+            return [digest for digest in digests if digest not in self._templates]
+
+    def add_templates(self, items, payload):
+        """
+        Store uploaded templates and precompute the matcher's data for them.
+
+        Args:
+            items (list): {"digest", "shape", "dtype", "offset"} per template
+            payload (memoryview): Concatenated template pixels
+        """
+        added = []
+        for item in items:
+            # 收到的資料在下一個訊息前就會被覆寫，必須複製
+            template = wire.array_from(item, payload, item.get("offset", 0)).copy()
+            template.flags.writeable = False
+            with self._templates_lock:
+                known = item["digest"] in self._templates
+            if not known:
+                added.append((item["digest"], template))
+        if not added:
+            return
+
+        # 先準備好再放進清單，被淘汰的模板才不會在之後又建立比對資料
+        self.matcher.prepare([template for _, template in added])
+        unused = []
+        with self._templates_lock:
+            for digest, template in added:
+                if digest in self._templates:
+                    # 另一個客戶端同時上傳了同一個模板
+                    unused.append(template)
+                    continue
+                self._templates[digest] = template
+            self._template_bytes = sum(self._template_size(template) for template in self._templates.values())
+            while self._template_bytes > self.template_limit and len(self._templates) > 1:
+                _, evicted = self._templates.popitem(last=False)
+                self._template_bytes -= self._template_size(evicted)
+                unused.append(evicted)
+            kept = len(self._templates)
+        if unused:
+            # 比對器以 id(template) 保存的縮放層與頻譜也要一併釋放
+            self.matcher.forget(unused)
+        self.logger.info(f"Detection server: {len(added)} template(s) added, {kept} kept")
+
+    def _template_size(self, template):
+        """
+        Bytes a stored template takes, including the matcher's prepared data.
+        """
+        return template.nbytes + self.matcher.prepared_nbytes(template)
+
+    # 批次處理
+
+    def enqueue(self, job):
+        self._jobs.put(job)
+
+    def _dispatch(self):
+        while self.running:
+            try:
+                job = self._jobs.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            # 在批次時間內收集其他客戶端的請求，一起排入工作池
+            batch = [job]
+            deadline = time.perf_counter() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._jobs.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.batches += 1
+            self.jobs += len(batch)
+            # 各客戶端輪流排入一個比對，每個客戶端內部維持優先順序
+            for index in range(max(len(job.checks) for job in batch)):
+                for job in batch:
+                    if index < len(job.checks):
+                        self._executor.submit(self._run_check, job, *job.checks[index])
+            for job in batch:
+                if not job.checks:
+                    self._finish(job)
+
+    def _run_check(self, job, template, request):
+        try:
+            if job.cancelled:
+                job.skipped += 1
+            else:
+                started = time.perf_counter()
+                try:
+                    matches = search(self.matcher, job.frame, template, request)
+                except Exception as e:
+                    self.metrics.inc("errors", stage="match")
+                    self.logger.error(f"Detection server: {request.name} failed: {str(e)}")
+                    job.session.send({"type": "hit", "id": job.id, "name": request.name, "error": str(e)})
+                else:
+                    self.metrics.observe("match", time.perf_counter() - started)
+                    job.session.send({
+                        "type": "hit",
+                        "id": job.id,
+                        "name": request.name,
+                        "matches": [[int(x), int(y), float(score)] for x, y, score in matches],
+                    })
+        except OSError:
+            # 客戶端已斷線，其餘比對略過
+            job.cancelled = True
+        finally:
+            self.checks += 1
+            if job.finish_check():
+                self._finish(job)
+
+    def _finish(self, job):
+        self.skipped += job.skipped
+        elapsed = time.perf_counter() - job.received
+        self.metrics.observe("request", elapsed)
+        try:
+            job.session.send({"type": "done", "id": job.id, "skipped": job.skipped, "server_ms": elapsed * 1000})
+        except OSError:
+            pass
+        finally:
+            job.done.set()
+
+    # 連線
+
+    def _accept(self):
+        while self.running:
+            try:
+                sock = wire.accept(self._listener)
+            except OSError:
+                break
+            self._session_count += 1
+            session = Session(self, sock, self._session_count)
+            with self._sessions_lock:
+                self._sessions.append(session)
+            threading.Thread(target=session.run, name=session.name, daemon=True).start()
+
+    def remove_session(self, session):
+        with self._sessions_lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Clients, template memory and batching counters
+        """
+        with self._sessions_lock:
+            clients = [session.name for session in self._sessions]
+        with self._templates_lock:
+            # 頻譜等比對資料在第一次比對時才建立，重新計算
+            self._template_bytes = sum(self._template_size(template) for template in self._templates.values())
+            templates = len(self._templates)
+        snapshot = self.metrics.snapshot()["stages"]
+        return {
+            "clients": clients,
+            "templates": templates,
+            "template_bytes": self._template_bytes,
+            "batches": self.batches,
+            "jobs": self.jobs,
+            "checks": self.checks,
+            "skipped": self.skipped,
+            "mean_batch": self.jobs / self.batches if self.batches else 0.0,
+            "request_p50_ms": snapshot.get("request", {}).get("p50", 0.0) * 1000,
+        }
+
+    def start(self):
+        """
+        Start listening, dispatching and matching in background threads.
+        """
+        self._listener = wire.listen(self.address)
+        self.running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="detect")
+        self._threads = [
+            threading.Thread(target=self._accept, name="detect-accept", daemon=True),
+            threading.Thread(target=self._dispatch, name="detect-dispatch", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        self.logger.info(
+            f"Detection server listening on {self.address} "
+            f"(match strategy: {self.matcher.name}, workers: {self.workers})"
+        )
+
+    def stop(self):
+        """
+        Close the listener and every client, then stop the worker pool.
+        """
+        if not self.running:
+            return
+        self.running = False
+        try:
+            self._listener.close()
+        except OSError:
+            pass
+        with self._sessions_lock:
+            sessions = list(self._sessions)
+        for session in sessions:
+            if session._job is not None:
+                session._job.cancelled = True
+            try:
+                session.sock.shutdown(2)
+            except OSError:
+                pass
+        for thread in self._threads:
+            thread.join(1.0)
+        self._executor.shutdown(wait=True)
+        family, sockaddr = wire.parse_address(self.address)
+        if family != socket.AF_INET and os.path.exists(sockaddr):
+            os.unlink(sockaddr)
+        self.logger.info(f"Detection server stopped: {self.stats()}")
+
+
+def main(argv=None):
+    import signal
+    from .__main__ import parse_overrides
+
+    parser = argparse.ArgumentParser(prog="python -m modules.detection_server",
+                                     description="Serve template matching to btnSprite clients")
+    parser.add_argument("--config", help="config file (default: config.json in the program directory)")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a config value (repeatable)")
+    parser.add_argument("--listen", help="address to listen on (default: detection_listen)")
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger('key_wizard')
+    config = load_config(args.config, parse_overrides(args.set))
+    server = DetectionServer(config, args.listen)
+    try:
+        server.start()
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot start detection server: {str(e)}")
+        return 1
+
+    stopping = []
+    # 訊號處理只設定旗標，由主執行緒關閉伺服器
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    while not stopping:
+        time.sleep(0.2)
+    server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,755 @@
+"""
+Fleet coordinator: status, statistics and notifications of many nodes.
+
+``python -m modules.fleet`` listens on ``fleet_listen``. Every KeyWizard
+with ``fleet_coordinator`` set runs a FleetReporter that keeps one
+connection open and sends, every ``fleet_report_interval`` seconds, one
+zlib-compressed batch holding its heartbeat, the scan statistics
+aggregated since the previous batch and any events (state changes, stop
+reasons, errors). Stop events are sent immediately.
+
+The coordinator keeps the latest state of every node, marks nodes that
+stopped reporting as lost and nodes that report but no longer scan as
+stuck, and serves the summary at ``http://127.0.0.1:<fleet_status_port>/status``.
+Stop notifications of all nodes go through one NotificationGate: the same
+node and reason is only reported once per ``fleet_notify_dedupe`` seconds,
+nodes stopping for the same reason within ``fleet_notify_window`` are
+merged into one message, and at most ``fleet_notify_limit`` LINE messages
+are sent per ``fleet_notify_period``; what is held back is merged into the
+next message.
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import socket
+import logging
+import argparse
+import threading
+import collections
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import wire
+from .config import load_config
+
+
+class FleetReporter:
+    """
+    Node side: batches heartbeats, scan statistics and events to the coordinator.
+    """
+    def __init__(self, address, node, interval=2.0, timeout=5.0, retry_delay=5.0, max_pending=10000, metrics=None):
+        """
+        Args:
+            address (str): Coordinator address ("tcp:host:port" or "unix:/path")
+            node (str): Name of this node
+            interval (float): Seconds between batches (also the heartbeat period)
+            timeout (float): Connect and acknowledgement timeout (seconds)
+            retry_delay (float): Wait before reconnecting after a failure (seconds)
+            max_pending (int): Events kept while the coordinator is unreachable (oldest dropped first)
+            metrics (Metrics, optional): Receives batch timings and counters
+        """
+        wire.parse_address(address)
+        self.address = address
+        self.node = node
+        self.interval = interval
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.metrics = metrics
+        self.logger = logging.getLogger('key_wizard')
+        # 行程每次啟動不同，協調器據此重設序號
+        self.session = f"{os.getpid()}-{int(time.time() * 1000)}"
+
+        self.state = "idle"
+        self.sock = None
+        self.reader = None
+        self._events = collections.deque(maxlen=max_pending)
+        self._stats = self._empty_stats()
+        self._unacked = None  # (序號, 壓縮後的批次, 筆數)，重新連線後原樣重送
+        self._unacked_stop = False  # 未確認的批次含停止事件
+        self.stop_delivered = False  # 協調器已確認收到停止事件
+        self._seq = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closing = threading.Event()
+        self._worker = None
+
+        # 統計
+        self.batches = 0
+        self.bytes_sent = 0
+        self.dropped = 0
+
+    @staticmethod
+    def _empty_stats():
+        return {"cycles": 0, "actions": 0, "scan_time": 0.0, "scan_max": 0.0}
+
+    @property
+    def connected(self):
+        return self.sock is not None
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="fleet-report", daemon=True)
+                self._worker.start()
+
+    def event(self, kind, urgent=False, **data):
+        """
+        Queue an event for the next batch.
+
+        Args:
+            kind (str): Event type, e.g. "state", "stop" or "error"
+            urgent (bool): Send now instead of with the next periodic batch
+            **data: Event fields
+        """
+        if self._closing.is_set():
+            return
+        with self._lock:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(dict(data, kind=kind, time=time.time()))
+        self._ensure_worker()
+        if urgent:
+            self._wake.set()
+
+    def set_state(self, state, **data):
+        """
+        Report a state change ("scanning", "stopped", ...); sent immediately.
+        """
+        self.state = state
+        self.event("state", urgent=True, state=state, **data)
+
+    def stop_event(self, reason):
+        """
+        Report that the wizard stopped; the coordinator sends the LINE notification.
+
+        ``stop_delivered`` becomes True once the coordinator acknowledged it;
+        otherwise the caller has to notify by itself.
+        """
+        self.event("stop", urgent=True, reason=reason)
+
+    def cycle(self, seconds, acted=False):
+        """
+        Add one scan cycle to the statistics of the next batch.
+
+        Args:
+            seconds (float): Wall time of the cycle
+            acted (bool): An action was queued
+        """
+        with self._lock:
+            stats = self._stats
+            stats["cycles"] += 1
+            stats["actions"] += int(acted)
+            stats["scan_time"] += seconds
+            stats["scan_max"] = max(stats["scan_max"], seconds)
+        self._ensure_worker()
+
+    def _connect(self):
+        if self.sock is not None:
+            return
+        if time.monotonic() < self._retry_at:
+            raise ConnectionError("Fleet coordinator unavailable")
+        try:
+            self.sock = wire.connect(self.address, self.timeout)
+            self.reader = wire.MessageReader(self.sock)
+        except OSError as e:
+            self._disconnect(f"Cannot connect to fleet coordinator {self.address}: {str(e)}")
+            raise
+        self.logger.info(f"Connected to fleet coordinator {self.address} as {self.node}")
+
+    def _disconnect(self, reason=None):
+        if reason:
+            self.logger.warning(reason)
+            self._retry_at = time.monotonic() + self.retry_delay
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.reader = None
+
+    def _take(self):
+        """
+        Build the next batch: heartbeat, aggregated statistics and queued events.
+        """
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+            stats = self._stats
+            self._stats = self._empty_stats()
+        records = [{"kind": "heartbeat", "time": time.time(), "state": self.state}]
+        if stats["cycles"]:
+            records.append(dict(stats, kind="stats", time=time.time()))
+        records.extend(events)
+        return records
+
+    def _transmit(self, seq, payload, count):
+        self._connect()
+        wire.send_message(self.sock, {
+            "type": "batch",
+            "node": self.node,
+            "session": self.session,
+            "seq": seq,
+            "count": count,
+            "encoding": "zlib",
+        }, payload)
+        message = self.reader.read()
+        if message is None:
+            raise ConnectionError("Fleet coordinator closed the connection")
+        reply = message[0]
+        if reply.get("type") != "ack" or reply.get("seq") != seq:
+            raise wire.ProtocolError(f"Unexpected reply from fleet coordinator: {reply.get('type')}")
+
+    def flush(self):
+        """
+        Send the pending batch now.
+
+        Returns:
+            bool: True if the coordinator acknowledged everything pending
+        """
+        with self._send_lock:
+            started = time.perf_counter()
+            try:
+                # 未確認的批次先原樣重送 (協調器依序號略過已收到的)
+                if self._unacked is not None:
+                    self._transmit(*self._unacked)
+                    self._unacked = None
+                    self.stop_delivered = self.stop_delivered or self._unacked_stop
+                records = self._take()
+                self._seq += 1
+                payload = zlib.compress(json.dumps(records, separators=(",", ":")).encode("utf-8"))
+                self._unacked = (self._seq, payload, len(records))
+                self._unacked_stop = any(record["kind"] == "stop" for record in records)
+                self._transmit(*self._unacked)
+                self._unacked = None
+                self.stop_delivered = self.stop_delivered or self._unacked_stop
+            except (OSError, wire.ProtocolError) as e:
+                if self.sock is not None:
+                    self._disconnect(f"Fleet coordinator connection lost: {str(e)}")
+                return False
+            self.batches += 1
+            self.bytes_sent += len(payload)
+            if self.metrics is not None:
+                self.metrics.observe("fleet_report", time.perf_counter() - started)
+            return True
+
+    def _run(self):
+        while not self._closing.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._closing.is_set():
+                break
+            self.flush()
+
+    def close(self, timeout=5.0):
+        """
+        Send what is pending (within a deadline), then disconnect.
+
+        Args:
+            timeout (float): Deadline for the last batch (seconds)
+
+        Returns:
+            bool: True if the last batch was delivered
+        """
+        self._closing.set()
+        self._wake.set()
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout)
+        self._retry_at = 0.0
+        if self.sock is not None:
+            self.sock.settimeout(timeout)
+        delivered = self.flush()
+        self._disconnect()
+        return delivered
+
+
+class NotificationGate:
+    """
+    Deduplicates, merges and rate-limits notifications before they are sent.
+    """
+    def __init__(self, send, window=10.0, dedupe_window=300.0, limit=5, period=600.0, format_message=None):
+        """
+        Args:
+            send (callable): send(text) delivers one message
+            window (float): Notifications with the same reason within this time are merged (seconds)
+            dedupe_window (float): The same node and reason is only reported once in this time (seconds)
+            limit (int): Maximum messages per period (0 = unlimited)
+            period (float): Rate-limit period (seconds)
+            format_message (callable, optional): format_message(reason) -> text for one reason
+        """
+        self.send = send
+        self.window = window
+        self.dedupe_window = dedupe_window
+        self.limit = limit
+        self.period = period
+        self.format_message = format_message or (lambda reason: reason)
+        self._lock = threading.Lock()
+        self._notified = {}  # (節點, 原因) -> 上次通知時間
+        self._pending = {}  # 原因 -> [最早時間, [節點]]
+        self._sent = collections.deque()  # 最近一個週期內送出的時間
+
+        # 統計
+        self.offered = 0
+        self.sent = 0
+        self.deduplicated = 0
+        self.limited = 0
+
+    def offer(self, node, reason, now=None):
+        """
+        Queue a notification.
+
+        Returns:
+            bool: False if it duplicates one reported within dedupe_window
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.offered += 1
+            key = (node, reason)
+            if now - self._notified.get(key, float("-inf")) < self.dedupe_window:
+                self.deduplicated += 1
+                return False
+            self._notified[key] = now
+            entry = self._pending.setdefault(reason, [now, []])
+            if node not in entry[1]:
+                entry[1].append(node)
+            return True
+
+    def _text(self, groups):
+        parts = []
+        for reason, nodes in groups:
+            parts.append(f"{self.format_message(reason)}\n機器 ({len(nodes)}): {', '.join(nodes)}")
+        if len(parts) == 1:
+            return parts[0]
+        return f"btnSprite 通知摘要 ({len(parts)} 則)\n\n" + "\n\n".join(parts)
+
+    def tick(self, now=None):
+        """
+        Send the merged notifications whose window has passed, if the rate limit allows.
+
+        Returns:
+            bool: True if a message was sent
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            while self._sent and now - self._sent[0] >= self.period:
+                self._sent.popleft()
+            for key in [key for key, at in self._notified.items() if now - at >= self.dedupe_window]:
+                del self._notified[key]
+
+            ready = [reason for reason, (first, _) in self._pending.items() if now - first >= self.window]
+            if not ready:
+                return False
+            if self.limit and len(self._sent) >= self.limit:
+                # 超過頻率上限: 保留到下一次可發送時合併送出
+                self.limited += 1
+                return False
+            groups = [(reason, self._pending.pop(reason)[1]) for reason in ready]
+            self._sent.append(now)
+            self.sent += 1
+        self.send(self._text(groups))
+        return True
+
+    def stats(self):
+        with self._lock:
+            pending = sum(len(nodes) for _, nodes in self._pending.values())
+        return {
+            "offered": self.offered,
+            "sent": self.sent,
+            "deduplicated": self.deduplicated,
+            "limited": self.limited,
+            "pending": pending,
+        }
+
+
+class NodeStatus:
+    """
+    Latest known state of one node.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.address = None
+        self.session = None
+        self.last_seq = 0
+        self.connected = False
+        self.state = "idle"
+        self.first_seen = time.time()
+        self.last_seen = 0.0
+        self.last_cycle = None
+        self.cycles = 0
+        self.actions = 0
+        self.errors = 0
+        self.scan_mean = 0.0
+        self.scan_max = 0.0
+        self.cycle_rate = 0.0
+        self.last_stop = None
+        self.last_error = None
+        self.reported = None  # 已通知過的異常狀態 (lost / stuck)
+
+    def health(self, now, lost_after, stuck_after):
+        """
+        Returns:
+            str: "lost", "stuck" or the reported state
+        """
+        if self.state in ("stopped", "idle"):
+            # 正常停止的節點不再回報
+            return self.state
+        if now - self.last_seen > lost_after:
+            return "lost"
+        if self.state == "scanning" and now - (self.last_cycle or self.last_seen) > stuck_after:
+            return "stuck"
+        return self.state
+
+    def apply(self, record):
+        kind = record.get("kind")
+        at = record.get("time", time.time())
+        self.last_seen = time.time()
+        if kind == "heartbeat":
+            self.state = record.get("state", self.state)
+        elif kind == "state":
+            self.state = record.get("state", self.state)
+            if self.state == "scanning":
+                self.last_cycle = self.last_seen
+        elif kind == "stats":
+            cycles = record.get("cycles", 0)
+            if cycles:
+                # 以協調器收到的時間計算，不受各節點時鐘誤差影響
+                elapsed = self.last_seen - self.last_cycle if self.last_cycle else 0.0
+                self.cycle_rate = cycles / elapsed if elapsed > 0 else 0.0
+                self.last_cycle = self.last_seen
+                self.scan_mean = record.get("scan_time", 0.0) / cycles
+            self.cycles += cycles
+            self.actions += record.get("actions", 0)
+            self.scan_max = record.get("scan_max", 0.0)
+        elif kind == "stop":
+            self.last_stop = {"reason": record.get("reason"), "time": at}
+        elif kind == "error":
+            self.errors += 1
+            self.last_error = {"error": record.get("error"), "time": at}
+
+    def to_dict(self, now, lost_after, stuck_after):
+        return {
+            "name": self.name,
+            "address": self.address,
+            "health": self.health(now, lost_after, stuck_after),
+            "state": self.state,
+            "connected": self.connected,
+            "last_seen": self.last_seen,
+            "cycles": self.cycles,
+            "actions": self.actions,
+            "errors": self.errors,
+            "cycles_per_second": round(self.cycle_rate, 3),
+            "scan_mean_ms": round(self.scan_mean * 1000, 2),
+            "scan_max_ms": round(self.scan_max * 1000, 2),
+            "last_stop": self.last_stop,
+            "last_error": self.last_error,
+        }
+
+
+class FleetCoordinator:
+    """
+    Collects node reports, serves the fleet status and sends gated notifications.
+    """
+    def __init__(self, config, address=None, status_port=None, notifications=None):
+        """
+        Args:
+            config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+            address (str, optional): Listen address; fleet_listen if omitted
+            status_port (int, optional): HTTP status port; fleet_status_port if omitted (None = off)
+            notifications (NotificationQueue, optional): Where messages go; a LINE queue
+                built from the configuration if omitted
+        """
+        self.config = config
+        self.address = address or config.get("fleet_listen", "tcp:127.0.0.1:8767")
+        self.status_port = status_port if status_port is not None else config.get("fleet_status_port")
+        self.lost_after = config.get("fleet_lost_after", 30.0)
+        self.stuck_after = config.get("fleet_stuck_after", 60.0)
+        self.logger = logging.getLogger('key_wizard')
+
+        if notifications is None:
+            from .line_notifier import LineNotifier
+            from .notify_queue import create_notification_queue
+
+            notifier = LineNotifier(
+                channel_access_token=config.get("line_channel_access_token"),
+                user_id=config.get("line_user_id"),
+                endpoint=config.get("line_endpoint"),
+            )
+            notifications = create_notification_queue(notifier, config)
+        self.notifications = notifications
+        self.gate = NotificationGate(
+            self.notifications.submit,
+            window=config.get("fleet_notify_window", 10.0),
+            dedupe_window=config.get("fleet_notify_dedupe", 300.0),
+            limit=config.get("fleet_notify_limit", 5),
+            period=config.get("fleet_notify_period", 600.0),
+            format_message=self.notifications.notifier.format_program_stopped,
+        )
+
+        self.nodes = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._listener = None
+        self._http = None
+        self._threads = []
+
+        # 統計
+        self.batches = 0
+        self.records = 0
+        self.bytes_received = 0
+        self.duplicates = 0
+
+    def _node(self, name):
+        node = self.nodes.get(name)
+        if node is None:
+            node = self.nodes[name] = NodeStatus(name)
+        return node
+
+    def handle_batch(self, header, payload, peer=None):
+        """
+        Apply one batch from a node.
+
+        Args:
+            header (dict): Batch header (node, session, seq, encoding)
+            payload (memoryview): Encoded records
+            peer (str, optional): Address of the node's connection
+
+        Returns:
+            bool: False if the batch was a duplicate
+        """
+        data = bytes(payload)
+        if header.get("encoding") == "zlib":
+            data = zlib.decompress(data)
+        records = json.loads(data.decode("utf-8")) if data else []
+
+        with self._lock:
+            node = self._node(str(header["node"]))
+            node.connected = True
+            node.address = peer or node.address
+            if node.session != header.get("session"):
+                node.session = header.get("session")
+                node.last_seq = 0
+            seq = header.get("seq", 0)
+            if seq <= node.last_seq:
+                # 確認訊息遺失後重送的批次
+                self.duplicates += 1
+                return False
+            node.last_seq = seq
+            self.batches += 1
+            self.records += len(records)
+            self.bytes_received += len(payload)
+            for record in records:
+                node.apply(record)
+                if record.get("kind") == "stop":
+                    self.gate.offer(node.name, record.get("reason") or "停止")
+                elif record.get("kind") == "error":
+                    self.gate.offer(node.name, f"發生錯誤 ({record.get('error')})")
+        return True
+
+    def _serve(self, sock, peer):
+        reader = wire.MessageReader(sock)
+        names = set()
+        try:
+            while not self._stop.is_set():
+                message = reader.read()
+                if message is None:
+                    break
+                header, payload = message
+                if header.get("type") != "batch":
+                    raise wire.ProtocolError(f"Unknown message type: {header.get('type')}")
+                names.add(str(header.get("node")))
+                self.handle_batch(header, payload, peer)
+                wire.send_message(sock, {"type": "ack", "seq": header.get("seq")})
+        except (OSError, ValueError, KeyError, zlib.error) as e:
+            if not self._stop.is_set():
+                self.logger.warning(f"Fleet node {peer} disconnected: {str(e)}")
+        finally:
+            try:
+                sock.close()
+            except OSError:
+                pass
+            with self._lock:
+                for name in names:
+                    if name in self.nodes:
+                        self.nodes[name].connected = False
+
+    def _accept(self):
+        while not self._stop.is_set():
+            try:
+                sock, peer = self._listener.accept()
+            except OSError:
+                break
+            sock.settimeout(None)
+            peer = f"{peer[0]}:{peer[1]}" if isinstance(peer, tuple) else (peer or "local")
+            threading.Thread(target=self._serve, args=(sock, peer), name="fleet-node", daemon=True).start()
+
+    def check_health(self, now=None):
+        """
+        Report nodes that became lost or stuck (once per incident) and send due notifications.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            for node in self.nodes.values():
+                health = node.health(now, self.lost_after, self.stuck_after)
+                if health not in ("lost", "stuck"):
+                    node.reported = None
+                elif node.reported != health:
+                    node.reported = health
+                    self.logger.warning(f"Fleet node {node.name} is {health}")
+                    self.gate.offer(node.name, "失去連線" if health == "lost" else "停止回應")
+        self.gate.tick()
+
+    def _watch(self):
+        while not self._stop.wait(1.0):
+            try:
+                self.check_health()
+            except Exception as e:
+                self.logger.error(f"Fleet health check error: {str(e)}")
+
+    def summary(self):
+        """
+        Returns:
+            dict: Fleet-wide counts by health, every node's status and the notification counters
+        """
+        now = time.time()
+        with self._lock:
+            nodes = [node.to_dict(now, self.lost_after, self.stuck_after) for node in self.nodes.values()]
+        counts = collections.Counter(node["health"] for node in nodes)
+        return {
+            "time": now,
+            "nodes": sorted(nodes, key=lambda node: node["name"]),
+            "counts": dict(counts),
+            "cycles": sum(node["cycles"] for node in nodes),
+            "actions": sum(node["actions"] for node in nodes),
+            "batches": self.batches,
+            "records": self.records,
+            "bytes_received": self.bytes_received,
+            "duplicates": self.duplicates,
+            "notifications": self.gate.stats(),
+        }
+
+    def _start_http(self):
+        coordinator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if not (self.path == "/" or self.path.startswith("/status")):
+                    self.send_error(404)
+                    return
+                body = json.dumps(coordinator.summary(), ensure_ascii=False, indent=2).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._http = ThreadingHTTPServer(("127.0.0.1", self.status_port), Handler)
+        self._http.daemon_threads = True
+        self.status_port = self._http.server_address[1]
+        threading.Thread(target=self._http.serve_forever, name="fleet-http", daemon=True).start()
+
+    def start(self):
+        self._listener = wire.listen(self.address, backlog=128)
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._accept, name="fleet-accept", daemon=True),
+            threading.Thread(target=self._watch, name="fleet-watch", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        if self.status_port is not None:
+            self._start_http()
+        status = f", status: http://127.0.0.1:{self.status_port}/status" if self._http else ""
+        self.logger.info(f"Fleet coordinator listening on {self.address}{status}")
+
+    def stop(self, timeout=5.0):
+        """
+        Stop listening, send the notifications still held back and close the notification queue.
+        """
+        self._stop.set()
+        try:
+            self._listener.close()
+        except OSError:
+            pass
+        if self._http is not None:
+            self._http.shutdown()
+            self._http.server_close()
+            self._http = None
+        for thread in self._threads:
+            thread.join(1.0)
+        # 結束前不再等待合併與頻率限制
+        self.gate.window = 0
+        self.gate.limit = 0
+        self.gate.tick()
+        self.notifications.close(timeout)
+        family, sockaddr = wire.parse_address(self.address)
+        if family != socket.AF_INET and os.path.exists(sockaddr):
+            os.unlink(sockaddr)
+        self.logger.info(f"Fleet coordinator stopped: {self.summary()['counts']}")
+
+
+def create_fleet_reporter(config, metrics=None):
+    """
+    Build the node's FleetReporter if a coordinator is configured.
+
+    Args:
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+        metrics (Metrics, optional): Receives batch timings
+
+    Returns:
+        FleetReporter or None: None when fleet_coordinator is not set
+    """
+    address = config.get("fleet_coordinator")
+    if not address:
+        return None
+    return FleetReporter(
+        address,
+        config.get("fleet_node_name") or socket.gethostname(),
+        interval=config.get("fleet_report_interval", 2.0),
+        timeout=config.get("fleet_timeout", 5.0),
+        retry_delay=config.get("fleet_retry_delay", 5.0),
+        max_pending=config.get("fleet_max_pending", 10000),
+        metrics=metrics,
+    )
+
+
+def main(argv=None):
+    import signal
+    from .__main__ import parse_overrides
+
+    parser = argparse.ArgumentParser(prog="python -m modules.fleet",
+                                     description="Collect status and notifications from btnSprite nodes")
+    parser.add_argument("--config", help="config file (default: config.json in the program directory)")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a config value (repeatable)")
+    parser.add_argument("--listen", help="address to listen on (default: fleet_listen)")
+    parser.add_argument("--status-port", type=int, help="HTTP status port (default: fleet_status_port)")
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger('key_wizard')
+    config = load_config(args.config, parse_overrides(args.set))
+    coordinator = FleetCoordinator(config, args.listen, args.status_port)
+    try:
+        coordinator.start()
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot start fleet coordinator: {str(e)}")
+        return 1
+
+    stopping = []
+    # 訊號處理只設定旗標，由主執行緒停止
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    while not stopping:
+        time.sleep(0.2)
+    coordinator.stop(config.get("notify_flush_timeout", 5.0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,100 @@
 import os
 import sys
+import collections
 import logging
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, simpledialog
 from PIL import Image, ImageTk
+import queue
 import threading
-import cv2
 
 from .key_wizard import KeyWizard
 from .line_notifier import LineNotifier
+from .notify_queue import create_notification_queue
+from .config import load_config
+from .preview import PreviewSlot
 
-class TextRedirector:
+class LogSink:
     """
-    Redirect console output to a Tkinter Text widget.
+    Thread-safe replacement for sys.stdout that feeds a Tkinter Text widget.
+    
+    Writes from any thread are only queued; the Tk main loop inserts them in
+    batches on an after() timer. Retained history is a bounded ring buffer and
+    the widget is trimmed to a maximum number of lines.
     """
-    def __init__(self, text_widget):
+    def __init__(self, root, text_widget, history_lines=5000, max_lines=2000, interval=100):
+        """
+        Args:
+            root (tk.Tk): Root window (owner of the after() timer)
+            text_widget (tk.Text): Widget to write into
+            history_lines (int): Lines kept in the history ring buffer
+            max_lines (int): Lines kept in the widget
+            interval (int): Milliseconds between flushes to the widget
+        """
+        self.root = root
         self.text_widget = text_widget
-        self.buffer = ""
+        self.max_lines = max_lines
+        self.interval = interval
+        self.history = collections.deque(maxlen=history_lines)
+        # deque 的 append/popleft 可跨執行緒使用
+        self._pending = collections.deque(maxlen=history_lines)
+        self._partial = ""
+        self._after_id = None
+
+    @property
+    def buffer(self):
+        return "\n".join(self.history)
 
     def write(self, string):
-        self.buffer += string
-        self.text_widget.config(state=tk.NORMAL)
-        self.text_widget.insert(tk.END, string)
-        self.text_widget.see(tk.END)
-        self.text_widget.config(state=tk.DISABLED)
+        if string:
+            self._pending.append(string)
+        return len(string)
         
     def flush(self):
         pass
 
+    def start(self):
+        if self._after_id is None:
+            self._after_id = self.root.after(self.interval, self._drain)
+
+    def stop(self):
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        self._drain(reschedule=False)
+
+    def _drain(self, reschedule=True):
+        """
+        Move queued text into the widget (runs on the Tk main loop).
+        """
+        chunks = []
+        try:
+            while True:
+                chunks.append(self._pending.popleft())
+        except IndexError:
+            pass
+
+        if chunks:
+            text = "".join(chunks)
+            lines = (self._partial + text).split("\n")
+            self._partial = lines.pop()
+            self.history.extend(lines)
+
+            try:
+                self.text_widget.config(state=tk.NORMAL)
+                self.text_widget.insert(tk.END, text)
+                # 超過上限的舊行直接刪除，避免介面越來越慢
+                line_count = int(self.text_widget.index("end-1c").split(".")[0])
+                if line_count > self.max_lines:
+                    self.text_widget.delete("1.0", f"{line_count - self.max_lines + 1}.0")
+                self.text_widget.see(tk.END)
+                self.text_widget.config(state=tk.DISABLED)
+            except tk.TclError:
+                return
+
+        if reschedule:
+            self._after_id = self.root.after(self.interval, self._drain)
+
 class KeyWizardGUI:
     """
     Main GUI class for the Key Wizard application.
@@ -56,8 +123,23 @@ class KeyWizardGUI:
         # Script directory
         self.script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         
-        # LINE Notifier
-        self.line_notifier = LineNotifier()
+        # 設定檔
+        self.config = load_config()
+        
+        # LINE Notifier: 訊息由背景佇列送出，不會卡住介面
+        self.line_notifier = LineNotifier(
+            channel_access_token=self.config.get("line_channel_access_token"),
+            user_id=self.config.get("line_user_id"),
+            endpoint=self.config.get("line_endpoint"),
+        )
+        self.notifications = create_notification_queue(self.line_notifier, self.config)
+        self._line_results = queue.Queue()
+        
+        # 命中區域預覽: 工作執行緒產生縮圖，介面以固定頻率取最新的一張
+        self.preview = PreviewSlot(
+            max_fps=self.config.get("preview_fps", 5),
+            size=self.config.get("preview_size", 100),
+        )
         
         # Initialize wizard and thread
         self.wizard = None
@@ -68,8 +150,20 @@ class KeyWizardGUI:
         self._create_widgets()
         self._load_sample_images()
         
-        # Redirect stdout
-        sys.stdout = TextRedirector(self.log_text)
+        # Redirect stdout (任何執行緒的輸出都先排隊，再由主迴圈批次寫入)
+        self.log_sink = LogSink(
+            self.root,
+            self.log_text,
+            history_lines=self.config.get("log_history_lines", 5000),
+            max_lines=self.config.get("log_max_lines", 2000),
+            interval=self.config.get("log_flush_interval", 100),
+        )
+        sys.stdout = self.log_sink
+        self.log_sink.start()
+        
+        # 定期處理背景送出的LINE訊息結果
+        self.root.after(200, self._poll_line_results)
+        self.root.after(self._preview_interval(), self._refresh_previews)
     
     def _on_closing(self):
         """
@@ -84,8 +178,12 @@ class KeyWizardGUI:
         if self.wizard_thread and self.wizard_thread.is_alive():
             self.wizard_thread.join(1.0)
         
+        # 在期限內送出尚未送出的LINE通知
+        self.notifications.close(self.config.get("notify_flush_timeout", 5.0))
+        
         # 恢復標準輸出
         sys.stdout = sys.__stdout__
+        self.log_sink.stop()
         
         # 銷毀主窗口
         self.root.destroy()
@@ -123,6 +221,9 @@ class KeyWizardGUI:
         self.stop_button = ttk.Button(button_frame, text="停止精靈", command=self._stop_wizard, state=tk.DISABLED)
         self.stop_button.pack(side=tk.TOP, padx=5, pady=2)
         
+        self.profile_button = ttk.Button(button_frame, text="開始效能分析", command=self._toggle_profiling, state=tk.DISABLED)
+        self.profile_button.pack(side=tk.TOP, padx=5, pady=2)
+        
         # 功能設定組
         settings_frame = ttk.LabelFrame(control_frame, text="設定")
         settings_frame.pack(side=tk.LEFT, padx=10, fill=tk.Y)
@@ -205,8 +306,9 @@ class KeyWizardGUI:
             # 將設定傳遞給精靈
             self.wizard = KeyWizard(
                 gui=self, 
-                line_notifier=self.line_notifier,
-                direct_click_mode=self.direct_click_var.get()
+                line_notifier=self.notifications,
+                direct_click_mode=self.direct_click_var.get(),
+                config=self.config
             )
             self.wizard_thread = threading.Thread(target=self.wizard.start)
             self.wizard_thread.daemon = True
@@ -214,6 +316,7 @@ class KeyWizardGUI:
             
             self.start_button.config(state=tk.DISABLED)
             self.stop_button.config(state=tk.NORMAL)
+            self.profile_button.config(state=tk.NORMAL, text="開始效能分析")
             self.direct_click_check.config(state=tk.DISABLED)  # 啟動時禁用設定選項
             self.status_var.set("精靈運行中...")
     
@@ -229,9 +332,18 @@ class KeyWizardGUI:
             
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
+        self.profile_button.config(state=tk.DISABLED, text="開始效能分析")
         self.direct_click_check.config(state=tk.NORMAL)  # 停止時允許設定
         self.status_var.set("已停止")
     
+    def _toggle_profiling(self):
+        """
+        Start or stop profiling of the scanning thread.
+        """
+        if self.wizard and self.wizard_thread and self.wizard_thread.is_alive():
+            requested = self.wizard.toggle_profiling()
+            self.profile_button.config(text="停止效能分析" if requested else "開始效能分析")
+    
     def _send_line_message(self):
         """
         Open a dialog to send a Line message
@@ -245,22 +357,34 @@ class KeyWizardGUI:
             )
             
             if message:
-                # 發送訊息
-                result = self.line_notifier.send_message(message)
-                
-                if result:
-                    messagebox.showinfo("Line 訊息", "訊息發送成功！")
-                    self.log_text.config(state=tk.NORMAL)
-                    self.log_text.insert(tk.END, f"Line訊息已發送: {message}\n")
-                    self.log_text.see(tk.END)
-                    self.log_text.config(state=tk.DISABLED)
-                else:
+                # 交給背景佇列發送，結果於 _poll_line_results 顯示
+                queued = self.line_notifier.configured and self.notifications.send_message(
+                    message, callback=lambda result: self._line_results.put((message, result))
+                )
+                if not queued:
                     messagebox.showerror("Line 訊息", "訊息發送失敗，請檢查 Line Notify 設定")
         
         except Exception as e:
             messagebox.showerror("錯誤", f"發送訊息時發生錯誤: {str(e)}")
             self.logger.error(f"Line message send error: {e}")
     
+    def _poll_line_results(self):
+        """
+        Show the results of LINE messages sent in the background.
+        """
+        try:
+            while True:
+                message, result = self._line_results.get_nowait()
+                if result:
+                    messagebox.showinfo("Line 訊息", "訊息發送成功！")
+                    self.log_sink.write(f"Line訊息已發送: {message}\n")
+                else:
+                    messagebox.showerror("Line 訊息", "訊息發送失敗，請檢查 Line Notify 設定")
+        except queue.Empty:
+            pass
+        
+        self.root.after(200, self._poll_line_results)
+    
     def _load_sample_images(self):
         """
         Load and display sample images.
@@ -296,24 +420,36 @@ class KeyWizardGUI:
         """
         Update image display.
         
+        Safe to call from any thread; the image is shrunk by the caller's
+        thread and shown at the next preview refresh.
+        
         Args:
             name (str): Image label name
             image (np.ndarray): OpenCV image
         """
         if image is not None:
             try:
-                # Convert OpenCV image to PIL format
-                image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                pil_img = Image.fromarray(image_rgb)
-                
-                # Resize for display
-                pil_img.thumbnail((100, 100))
-                
-                # Convert to Tkinter format
-                tk_img = ImageTk.PhotoImage(pil_img)
-                
-                # Update image
-                self.img_labels[name].configure(image=tk_img)
-                self.img_labels[name].image = tk_img
+                self.preview.publish(name, image)
+            except Exception as e:
+                self.logger.error(f"Error updating image: {str(e)}")
+    
+    def _preview_interval(self):
+        fps = self.config.get("preview_fps", 5)
+        return int(1000 / fps) if fps > 0 else 200
+    
+    def _refresh_previews(self):
+        """
+        Show the newest preview thumbnails (runs on the Tk main loop).
+        """
+        for name, thumbnail in self.preview.take().items():
+            label = self.img_labels.get(name)
+            if label is None:
+                continue
+            try:
+                tk_img = ImageTk.PhotoImage(Image.fromarray(thumbnail))
+                label.configure(image=tk_img)
+                label.image = tk_img
             except Exception as e:
                 self.logger.error(f"Error updating image: {str(e)}")
+        
+        self.root.after(self._preview_interval(), self._refresh_previews)
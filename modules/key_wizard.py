@@ -1,13 +1,26 @@
 import cv2
-import numpy as np
-import pyautogui
 import time
 import os
 import logging
-from datetime import datetime
 import threading
 
 from .line_notifier import LineNotifier
+from .notify_queue import NotificationQueue, create_notification_queue
+from .capture import Frame, CaptureExhausted, create_capture_backend, convert_order
+from .config import load_config
+from .matcher import SearchRequest, create_matcher, search
+from .roi import create_region_trackers, result_region
+from .change_detector import ChangeDetector
+from .match_engine import MatchEngine
+from .detection_client import create_remote_engine
+from .scheduler import ScanScheduler
+from .metrics import Metrics, MetricsServer, SnapshotWriter
+from .profiler import create_profiler, profile_path
+from .rules import load_rules, compile_rules
+from .template_cache import create_template_cache
+from .actions import Action, create_action_executor, order_positions
+from .fleet import create_fleet_reporter
+from .recorder import create_session_recorder
 
 # LineNotifier is now imported from line_notifier module
 
@@ -16,53 +29,159 @@ class KeyWizard:
     The main class for key wizard functionality.
     Handles screen scanning, image recognition, and automated actions.
     """
-    def __init__(self, gui=None, line_notifier=None, direct_click_mode=True):
+    def __init__(self, gui=None, line_notifier=None, direct_click_mode=True, config=None, input_device=None,
+                 started_at=None, template_cache=None):
         """
         Initialize the Key Wizard with default configuration.
         
         Args:
             gui (object, optional): Optional GUI interface for status updates.
+            config (dict, optional): Configuration; loaded from config.json if omitted
+            input_device (object, optional): Object with pyautogui's click/hotkey/typewrite;
+                defaults to pyautogui
+            started_at (float, optional): time.perf_counter() at process start; the
+                startup time to the first scan is measured from it
+            template_cache (TemplateCache, optional): Template loader/cache; built from
+                the configuration if omitted (a supervisor passes one with shared templates)
         """
+        self.started_at = started_at if started_at is not None else time.perf_counter()
         self.gui = gui
+        self.preview = getattr(gui, "preview", None)  # 命中區域預覽 (PreviewSlot)
+        self.config = config if config is not None else load_config()
         
         # Get current script directory
         self.script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         
-        # Path to template images
-        self.template_path = os.path.join(self.script_dir, "keep.png")
-        self.btn_path = os.path.join(self.script_dir, "btn.png")
-        self.approved_path = os.path.join(self.script_dir, "approved.png")
-        self.stop_path = os.path.join(self.script_dir, "stop.png")
-        
         # 初始化日誌
         self.logger = logging.getLogger('key_wizard')
+        self.press_logger = logging.getLogger('key_wizard.press')
         
-        # Line notifier
-        self.line_notifier = line_notifier or LineNotifier()
+        # Line notifier: 通知經由背景佇列送出，不會卡住掃描執行緒
+        if isinstance(line_notifier, NotificationQueue):
+            self.notifications = line_notifier
+            self.line_notifier = line_notifier.notifier
+            self._owns_notifications = False
+        else:
+            self.line_notifier = line_notifier or LineNotifier(
+                channel_access_token=self.config.get("line_channel_access_token"),
+                user_id=self.config.get("line_user_id"),
+                endpoint=self.config.get("line_endpoint"),
+            )
+            self.notifications = create_notification_queue(self.line_notifier, self.config)
+            self._owns_notifications = True
         
         # 輸入文字
         self.input_text = "keep"
         self.alt_input_text = "KEEP"  # 大寫替代選項
         self.direct_click_mode = direct_click_mode  # 如果為真，則直接點擊而不輸入文字
         self.confidence_threshold = 0.8
-        self.scan_interval = 2  # Seconds between scans
+        self.scan_interval = self.config.get("scan_interval", 2)  # 閒置時最長的掃描間隔 (秒)
         self.running = False
+        self.error = None  # 掃描迴圈因錯誤結束時的錯誤訊息
+        self.frame_count = 0  # 已擷取的畫面數
+        self.capture = None  # 螢幕擷取後端，於第一次擷取時建立
+        self.matcher = create_matcher(self.config)
+        
+        # 偵測規則: 編譯成每輪共用畫面、合併重複比對、依優先順序短路的執行計畫
+        self.template_dir = self.config.get("template_dir") or self.script_dir
+        self.rules = load_rules(self.config, self.script_dir)
+        self.plan = compile_rules(
+            self.rules,
+            self.template_dir,
+            self.confidence_threshold,
+            default_color=self.config.get("match_color", "bgr"),
+            default_scale=self.config.get("match_scale", 1),
+            default_max_hits=self.config.get("match_max_hits", 1),
+        )
+        self.match_order = self.config.get("match_order", "score")
+        self.all_gray = all(check.color == "gray" for check in self.plan.checks)
+        self._formats = {check.name: check for check in self.plan.checks}
+        self.template_cache = template_cache or create_template_cache(self.config, self.script_dir)
+        
+        # 規則內指定的搜尋範圍優先於 roi_regions / roi_windows
+        roi_config = dict(self.config)
+        roi_config["roi_regions"] = dict(self.config.get("roi_regions") or {})
+        roi_config["roi_windows"] = dict(self.config.get("roi_windows") or {})
+        for check in self.plan.checks:
+            if check.roi:
+                roi_config["roi_regions"][check.name] = list(check.roi)
+            if check.window:
+                roi_config["roi_windows"][check.name] = check.window
+        self.trackers = create_region_trackers(roi_config, [check.name for check in self.plan.checks])
+        for check in self.plan.checks:
+            if check.max_hits > 1:
+                # 要找出所有命中時不能只搜尋上次命中位置的附近
+                self.trackers[check.name].adaptive = False
+        
+        # 畫面變化偵測: 沒變化的區域沿用上次結果
+        self.change_detector = None
+        if self.config.get("change_detection", True):
+            self.change_detector = ChangeDetector(
+                tile_size=self.config.get("change_tile_size", 64),
+                downscale=self.config.get("change_downscale", 4),
+                threshold=self.config.get("change_threshold", 12),
+            )
+        self._match_cache = {}  # name -> (搜尋範圍, 結果, 畫面編號)
+        self._cache_base = None  # 變化偵測比較的上一張畫面編號
+        self.checks_total = 0
+        self.checks_skipped = 0
+        self._stats_lock = threading.Lock()
+        
+        # 掃描排程: 有動作或畫面變化時加快，閒置時逐步放慢
+        self.scheduler = ScanScheduler(
+            min_interval=self.config.get("scan_min_interval", 0.1),
+            max_interval=self.scan_interval,
+            backoff=self.config.get("scan_backoff", 1.5),
+            cpu_budget=self.config.get("cpu_budget", 0.25),
+        )
+        self.last_frame = None
+        
+        # 效能統計: 各階段耗時與事件次數
+        self.metrics = Metrics()
+        self._metrics_server = None
+        self._snapshot_writer = None
+        
+        # 效能分析: 於掃描執行緒的下一輪開始/結束
+        self.profile_mode = self.config.get("profile_mode", "sampling")
+        self.profile_dir = self.config.get("profile_dir") or os.path.join(self.script_dir, "profiles")
+        self._profile_requested = bool(self.config.get("profile_on_start", False))
+        self._profiler = None
+        
+        # 多個模板可在執行緒池上同時比對；設定 detection_server 時比對交給偵測伺服器
+        if self.config.get("detection_server"):
+            self.match_engine = create_remote_engine(
+                self.config, self._plan_search, self._finish_search, self._run_search, self.metrics
+            )
+        else:
+            self.match_engine = MatchEngine(self._locate_on_screen, workers=self.config.get("match_workers"))
+        
+        # 滑鼠/鍵盤輸入裝置
+        if input_device is None:
+            import pyautogui as input_device
+        self.input = input_device
+        
+        # 點擊與輸入交給背景執行緒，掃描不必等待輸入完成
+        self.actions = create_action_executor(self.input, self.config, self.metrics)
+        
+        # 設定 fleet_coordinator 時定期回報狀態與統計，停止通知由協調器合併發送
+        self.fleet = create_fleet_reporter(self.config, self.metrics)
+        self._fleet_stop_reason = None  # 交給協調器通知的停止原因
         
-        # Safety pause after startup
-        pyautogui.PAUSE = 0.5
+        # record_sessions: 每次啟動把分析過的畫面與判斷結果錄成一個檔案
+        self.recorder = None
         
-        self.logger.info("Key Wizard initialized")
+        self.logger.info(f"Key Wizard initialized (match strategy: {self.matcher.name})")
     
     def _log_button_press(self):
         """
         Log the button press with timestamp.
+        
+        The record goes through the logging queue to button_press.log, so
+        this never waits on disk.
         """
         try:
-            button_log_path = os.path.join(self.script_dir, "button_press.log")
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            with open(button_log_path, "a", encoding="utf-8") as log_file:
-                log_file.write(f"{current_time} - Button pressed\n")
-            self.logger.info(f"Button press logged at {current_time}")
+            self.press_logger.info("Button pressed")
+            self.logger.info("Button press logged")
         except Exception as e:
             self.logger.error(f"Error logging button press: {str(e)}")
     
@@ -74,177 +193,649 @@ class KeyWizard:
             reason (str): Reason for sending notification
         """
         try:
-            # Send notification through LineNotifier
-            result = self.line_notifier.notify_program_stopped(reason)
-            
-            # Log the attempt
-            if result:
-                self.logger.info(f"LINE notification sent: {reason}")
-                print(f"已發送LINE通知: {reason}")
-            else:
-                self.logger.warning("LINE notification not sent (check configuration)")
-                print("無法發送LINE通知，請檢查Line Notify設定")
+            # 交給背景佇列送出，結果由 callback 回報
+            queued = self.notifications.notify_program_stopped(
+                reason, callback=lambda result: self._on_line_notification_result(reason, result)
+            )
+            if not queued:
+                self.logger.warning("LINE notification not queued")
             
         except Exception as e:
             self.logger.error(f"Error sending LINE notification: {str(e)}")
             print(f"發送LINE通知時發生錯誤: {str(e)}")
     
+    def _on_line_notification_result(self, reason, result):
+        """
+        Report the outcome of a queued LINE notification (called from the notifier thread).
+        
+        Args:
+            reason (str): Reason the notification was sent
+            result (bool): True if delivered
+        """
+        if result:
+            self.logger.info(f"LINE notification sent: {reason}")
+            print(f"已發送LINE通知: {reason}")
+        else:
+            self.logger.warning("LINE notification not sent (check configuration)")
+            print("無法發送LINE通知，請檢查Line Notify設定")
+    
     def _load_templates(self):
         """
-        Load template images for matching.
+        Load the template images of every check in the rule plan.
+        
+        Missing images of optional rules disable those rules.
         
         Returns:
             bool: True if templates loaded successfully, False otherwise.
         """
-        required_images = {
-            "template": self.template_path,
-            "button": self.btn_path
-        }
-        
-        for name, path in required_images.items():
-            if not os.path.exists(path):
-                self.logger.error(f"{name.capitalize()} image not found: {path}")
+        for check in self.plan.checks:
+            if not os.path.exists(check.path) and not check.optional:
+                self.logger.error(f"{check.name.capitalize()} image not found: {check.path}")
                 return False
         
         try:
-            self.template_img = cv2.imread(self.template_path)
-            self.btn_img = cv2.imread(self.btn_path)
+            load_start = time.perf_counter()
+            for check in self.plan.checks:
+                image = self.template_cache.load(check.path) if os.path.exists(check.path) else None
+                if image is None:
+                    if not check.optional:
+                        self.logger.error(f"Cannot read {check.name} image: {check.path}")
+                        return False
+                    check.template = None
+                    continue
+                check.size = (image.shape[1], image.shape[0])
+                # 模板只在載入時轉成比對格式一次
+                check.template = self._match_template(image, check.color, check.scale)
             
-            # Optional images
-            self.approved_img = cv2.imread(self.approved_path) if os.path.exists(self.approved_path) else None
-            self.stop_img = cv2.imread(self.stop_path) if os.path.exists(self.stop_path) else None
+            # 預先計算比對器需要的模板資料 (例如 FFT 頻譜、縮小的模板)
+            frame_shape = self.capture.frame_shape() if self.capture is not None else None
+            self.matcher.prepare(
+                [check.template for check in self.plan.checks],
+                frame_shape,
+                cache=self.template_cache,
+            )
+            self.template_cache.save_index()
             
+            loaded = sum(check.template is not None for check in self.plan.checks)
+            self.logger.info(
+                f"Loaded {loaded}/{len(self.plan.checks)} templates for {len(self.rules)} rules "
+                f"in {time.perf_counter() - load_start:.3f}s "
+                f"(cache hits={self.template_cache.hits} misses={self.template_cache.misses})"
+            )
             return True
             
         except Exception as e:
             self.logger.error(f"Error loading templates: {str(e)}")
             return False
     
-    def _locate_on_screen(self, template, confidence=0.8):
+    def _match_template(self, image, color, scale):
+        """
+        Convert a BGR template to the matching format (cached by file hash).
+        
+        Color templates are stored in the capture's channel order, so frames
+        never need converting for them.
+        
+        Args:
+            image (np.ndarray): BGR template from the template cache
+            color (str): "bgr" or "gray"
+            scale (int): Downscale factor
+        
+        Returns:
+            np.ndarray: Converted template
+        """
+        order = "gray" if color == "gray" else (self.capture.order if self.capture is not None else "bgr")
+        if order == "bgr" and scale == 1:
+            return image
+        
+        def convert():
+            h, w = image.shape[:2]
+            converted = image
+            if scale > 1:
+                converted = cv2.resize(image, (max(1, w // scale), max(1, h // scale)), interpolation=cv2.INTER_AREA)
+            return convert_order(converted, "bgr", order)
+        
+        return self.template_cache.derived(image, f"{order}{scale}", convert)
+    
+    def _ensure_capture(self, capture=None):
+        """
+        Create the capture backend selected by the configuration, once.
+        
+        Args:
+            capture (CaptureBackend, optional): Backend to use instead (e.g. the benchmark's)
+        """
+        if self.capture is None or capture is not None:
+            self.capture = capture or create_capture_backend(self.config)
+            # 全部灰階比對時擷取後直接轉灰階；capture_native_order 保留擷取來源的排列 (模板改成同樣排列)
+            if self.all_gray:
+                self.capture.order = "gray"
+            elif self.config.get("capture_native_order", False):
+                self.capture.order = self.capture.native_order
+            else:
+                self.capture.order = "bgr"
+            self.logger.info(f"Capture backend: {self.capture.describe()} ({self.capture.order})")
+    
+    def _capture_frame(self):
+        """
+        Capture one frame for the current scan cycle.
+        
+        Returns:
+            Frame: Captured BGR frame
+        """
+        self._ensure_capture()
+        self.frame_count += 1
+        with self.metrics.stage("capture"):
+            frame = self.capture.grab(index=self.frame_count)
+        capture_time, convert_time = self.capture.timings
+        self.metrics.observe("capture", capture_time)
+        self.metrics.observe("convert", convert_time)
+        return frame
+    
+    def _locate_on_screen(self, template, confidence=0.8, frame=None, name=None, generation=None):
         """
         Locate template image on screen.
         
         Args:
             template: Template image to find
             confidence: Matching confidence threshold
+            frame (Frame, optional): Frame to search; a new one is captured if omitted
+            name (str, optional): Template name; enables its region-of-interest tracker
+            generation (int, optional): MatchEngine submission the check belongs to
             
         Returns:
-            tuple or None: Location of matched template
+            list or None: (center_x, center_y, w, h) of every occurrence (up to the
+                check's max_hits), best score first; None if not found
         """
         try:
-            screenshot = pyautogui.screenshot()
-            screenshot = cv2.cvtColor(np.array(screenshot), cv2.COLOR_RGB2BGR)
-            
-            result = cv2.matchTemplate(screenshot, template, cv2.TM_CCOEFF_NORMED)
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+            if frame is None:
+                frame = self._capture_frame()
             
-            if max_val >= confidence:
-                h, w = template.shape[:2]
-                center_x = max_loc[0] + w // 2
-                center_y = max_loc[1] + h // 2
-                return (center_x, center_y, w, h)
-            return None
+            request, cached = self._plan_search(template, confidence, frame, name, generation)
+            if request is None:
+                return cached
                 
         except Exception as e:
+            self.metrics.inc("errors", stage="match")
             self.logger.error(f"Image recognition error: {str(e)}")
             return None
+        return self._run_search(frame, template, request, generation)
     
-    def _process_action(self):
+    def _run_search(self, frame, template, request, generation=None):
         """
-        Process screen actions based on image recognition.
+        Run a planned search in this process.
+        
+        Also used for the searches of a detection server client while the
+        server is unavailable.
+        
+        Args:
+            frame (Frame): Frame to search
+            template: Template image in its matching format
+            request (SearchRequest): Search returned by _plan_search()
+            generation (int, optional): MatchEngine submission the search belongs to
         
         Returns:
-            bool: True if an action was performed, False otherwise.
+            list or None: (center_x, center_y, w, h) of every occurrence; None if not found
         """
-        # Check stop image
-        if self.stop_img is not None:
-            stop_pos = self._locate_on_screen(self.stop_img, self.confidence_threshold)
-            if stop_pos:
-                self.logger.info("Stop image found")
-                self.logger.info("Stop image found, stopping wizard")
-                print("找到停止圖片，正在停止程序...")
-                self.stop("偵測到停止圖片")
-                return True
-        
-        # Check approved image
-        if self.approved_img is not None:
-            approved_pos = self._locate_on_screen(self.approved_img, self.confidence_threshold)
-            if approved_pos:
-                x, y, w, h = approved_pos
-                pyautogui.click(x, y)
-                time.sleep(1)
-                return True
-                    
-        # Find target and button
-        target_pos = self._locate_on_screen(self.template_img, self.confidence_threshold)
-        
-        if target_pos:
-            btn_result = self._locate_on_screen(self.btn_img, self.confidence_threshold)
+        try:
+            label = f"match:{request.name or 'template'}"
+            match_start = time.perf_counter()
+            with self.metrics.stage(label):
+                matches = search(self.matcher, frame, template, request)
+            self.metrics.observe(label, time.perf_counter() - match_start)
+            return self._finish_search(frame, request, matches, generation)
             
-            if btn_result:
-                btn_x, btn_y, btn_w, btn_h = btn_result
-                # 直接點擊按鈕模式
-                if self.direct_click_mode:
-                    print(f"直接點擊按鈕，位置: ({btn_x}, {btn_y})")
-                    pyautogui.click(btn_x, btn_y)
-                    logging.info(f"Clicked button at ({btn_x}, {btn_y})")
-                else:
-                    # 先將輸入法切換為英文模式
-                    print(f"將嘗試輸入文字: {self.input_text}")
-                    
-                    # 點擊輸入框
-                    pyautogui.click(btn_x, btn_y)
-                    time.sleep(0.5)
-                    
-                    # 檢查當前輸入法
-                    pyautogui.hotkey('alt', 'shift')  # 嘗試切換輸入法為英文
-                    time.sleep(0.2)
-                    
-                    # 輸入文字
-                    pyautogui.typewrite(self.input_text)
-                    time.sleep(0.2)
-                    
-                    # 如果第一次失敗，嘗試使用替代文字
-                    pyautogui.typewrite(['backspace'] * len(self.input_text))  # 清除可能的錯誤輸入
-                    pyautogui.typewrite(self.alt_input_text)
-                    time.sleep(0.2)
-                    
-                    # 點擊確認按鈕
-                    pyautogui.click(btn_x, btn_y)
-                
-                pyautogui.click(btn_x, btn_y)
-                self._log_button_press()
+        except Exception as e:
+            self.metrics.inc("errors", stage="match")
+            self.logger.error(f"Image recognition error: {str(e)}")
+            return None
+    
+    def _plan_search(self, template, confidence, frame, name=None, generation=None):
+        """
+        Decide where and how to search for a template in this frame.
+        
+        Args:
+            template: Template image in its matching format
+            confidence: Matching confidence threshold
+            frame (Frame): Frame to search
+            name (str, optional): Template name; enables its region-of-interest tracker
+            generation (int, optional): MatchEngine submission the check belongs to
+        
+        Returns:
+            tuple: (request, cached); request is None when the previous result
+                can be reused (nothing changed in the search region), cached is that result
+        """
+        # 比對格式 (色彩、縮小倍數) 與原始模板尺寸
+        check = self._formats.get(name)
+        color, scale = (check.color, check.scale) if check else (frame.color, 1)
+        max_hits = check.max_hits if check else 1
+        w, h = check.size if check and check.size else (template.shape[1] * scale, template.shape[0] * scale)
+        tracker = self.trackers.get(name)
+        region, fallback = tracker.search_region(frame, (w, h)) if tracker else ((0, 0, frame.width, frame.height), None)
+        
+        if name:
+            cached = self._match_cache.get(name)
+            # 只有上一張畫面算出的結果能以這張畫面的變化判斷是否仍然有效；
+            # cached[0] 是結果所依據的範圍 (縮小範圍的命中，或整個基本範圍)
+            skip = (cached is not None and cached[0] in (region, fallback) and cached[2] == self._cache_base
+                    and frame.changes is not None and not frame.changes.region_changed(cached[0]))
+            with self._stats_lock:
+                self.checks_total += 1
+                if skip:
+                    self.checks_skipped += 1
+            if skip:
+                # 搜尋範圍內畫面沒有變化，沿用上次結果 (視為這張畫面的結果)
+                with self.match_engine.completing(generation) as current:
+                    if current:
+                        self._match_cache[name] = (cached[0], cached[1], frame.index)
+                return None, cached[1]
+        
+        return SearchRequest(name, region, confidence, color, scale, max_hits, size=(w, h), fallback=fallback), None
+    
+    def _finish_search(self, frame, request, matches, generation=None):
+        """
+        Turn the matches of a search into screen positions and update trackers, caches and previews.
+        
+        Args:
+            frame (Frame): Frame that was searched
+            request (SearchRequest): The search
+            matches (list): (x, y, score) relative to the search region, best score first
+            generation (int, optional): MatchEngine submission the search belongs to
+        
+        Returns:
+            list or None: (center_x, center_y, w, h) of every match; None if there is none
+        """
+        name = request.name
+        region = request.region
+        w, h = request.size
+        
+        positions = None
+        if matches:
+            positions = [
+                (frame.origin[0] + region[0] + x + w // 2, frame.origin[1] + region[1] + y + h // 2, w, h)
+                for x, y, score in matches
+            ]
+        
+        with self.match_engine.completing(generation) as current:
+            if not current:
+                # 這一輪已被取消或有更新的一輪: 不能覆蓋較新的追蹤範圍與快取
+                return positions
+            
+            # 範圍追蹤以分數最高的命中為準
+            rect = (region[0] + matches[0][0], region[1] + matches[0][1], w, h) if matches else None
+            tracker = self.trackers.get(name)
+            if tracker:
+                tracker.record(frame, region, rect, request.fallback)
+            
+            if matches:
+                self.metrics.inc("matches", amount=len(matches), template=name or "template")
                 
-                time.sleep(1)
-                return True
+                # 在工作執行緒裁切縮小命中區域，交給介面顯示
+                if self.preview is not None and name:
+                    x, y, score = matches[0]
+                    self.preview.publish(name, frame.image, (region[0] + x, region[1] + y, w, h), order=frame.order)
+            
+            if name:
+                # 縮小範圍落空時，結果來自整個基本範圍
+                basis = result_region(region, rect, request.fallback)
+                self._match_cache[name] = (basis, positions, frame.index)
+        return positions
+    
+    def _prune_match_cache(self, frame):
+        """
+        Drop cached results that were not computed (or reused) for this frame.
+        
+        A check the rules did not need, or that was cancelled, keeps the result
+        of an older frame; the next frame's changes say nothing about it.
+        
+        Args:
+            frame (Frame): Frame of the cycle that just ended
+        """
+        for name, cached in list(self._match_cache.items()):
+            if cached[2] != frame.index:
+                del self._match_cache[name]
+        self._cache_base = frame.index
+    
+    def _detect_changes(self, frame):
+        """
+        Compare the frame with the previous one so unchanged checks can be skipped.
         
-        return False
+        Args:
+            frame (Frame): Frame of the current cycle
+        """
+        if self.change_detector is not None and frame.changes is None:
+            frame.changes = self.change_detector.update(frame)
+    
+    def _start_metrics_export(self):
+        """
+        Start the optional localhost metrics endpoint and JSON snapshot writer.
+        """
+        port = self.config.get("metrics_port")
+        if port is not None and self._metrics_server is None:
+            try:
+                self._metrics_server = MetricsServer(self.metrics, port)
+                self._metrics_server.start()
+                self.logger.info(f"Metrics endpoint: http://127.0.0.1:{self._metrics_server.port}/metrics")
+            except Exception as e:
+                self._metrics_server = None
+                self.logger.error(f"Failed to start metrics endpoint: {str(e)}")
+        
+        path = self.config.get("metrics_snapshot_path")
+        if path and self._snapshot_writer is None:
+            self._snapshot_writer = SnapshotWriter(
+                self.metrics, path, interval=self.config.get("metrics_snapshot_interval", 60)
+            )
+            self._snapshot_writer.start()
+    
+    def _stop_metrics_export(self):
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+        if self._snapshot_writer is not None:
+            self._snapshot_writer.stop()
+            self._snapshot_writer = None
+    
+    @property
+    def profiling(self):
+        return self._profiler is not None
+    
+    def start_profiling(self):
+        """
+        Request profiling of the scanning thread (starts with the next scan cycle).
+        """
+        self._profile_requested = True
+        self.logger.info(f"Profiling requested ({self.profile_mode})")
+    
+    def stop_profiling(self):
+        """
+        Request the end of profiling; the report is written when the current cycle ends.
+        """
+        self._profile_requested = False
+    
+    def toggle_profiling(self):
+        """
+        Returns:
+            bool: True if profiling is now requested
+        """
+        if self._profile_requested:
+            self.stop_profiling()
+        else:
+            self.start_profiling()
+        return self._profile_requested
+    
+    def _sync_profiler(self):
+        """
+        Start or stop the profiler on the scanning thread to match the request.
+        """
+        if self._profile_requested and self._profiler is None:
+            try:
+                self._profiler = create_profiler(
+                    self.profile_mode,
+                    threading.get_ident(),
+                    interval=self.config.get("profile_interval", 0.005),
+                    stage_of=self.metrics.current_stage,
+                )
+                self._profiler.start()
+                self.logger.info("Profiling started")
+                print("效能分析已開始")
+            except Exception as e:
+                self._profiler = None
+                self._profile_requested = False
+                self.logger.error(f"Failed to start profiler: {str(e)}")
+        elif not self._profile_requested and self._profiler is not None:
+            self._finish_profiler()
+    
+    def _finish_profiler(self):
+        """
+        Stop the profiler, write its output and log a top-N summary.
+        """
+        profiler, self._profiler = self._profiler, None
+        if profiler is None:
+            return
+        profiler.stop()
+        try:
+            path = profiler.write(profile_path(self.profile_dir))
+            self.logger.info(f"Profile written: {path}")
+            for line in profiler.summary(self.config.get("profile_top", 15)):
+                self.logger.info(f"Profile: {line}")
+            print(f"效能分析已結束，結果: {path}")
+        except Exception as e:
+            self.logger.error(f"Error writing profile: {str(e)}")
+    
+    def _log_scan_stats(self):
+        """
+        Log how much scanning the region-of-interest trackers and change detection avoided.
+        """
+        if self.checks_total:
+            static = self.change_detector.static_frames if self.change_detector else 0
+            self.logger.info(
+                f"Change detection: skipped {self.checks_skipped}/{self.checks_total} checks "
+                f"({self.checks_skipped / self.checks_total:.1%}), static frames={static}"
+            )
+        for name, tracker in self.trackers.items():
+            stats = tracker.stats()
+            if stats["hits"] or stats["misses"]:
+                self.logger.info(
+                    f"ROI {name}: hits={stats['hits']} misses={stats['misses']} "
+                    f"full_scans={stats['full_scans']} skipped={stats['saved_ratio']:.1%}"
+                )
+    
+    def _process_action(self, frame=None):
+        """
+        Process screen actions based on image recognition.
+        
+        All template checks share one frame per cycle.
+        
+        Args:
+            frame (Frame, optional): Frame to analyse (e.g. a saved screenshot);
+                a new one is captured if omitted
+        
+        Returns:
+            bool: True if an action was performed, False otherwise.
+        """
+        if frame is None:
+            try:
+                frame = self._capture_frame()
+            except CaptureExhausted:
+                raise
+            except Exception as e:
+                self.metrics.inc("errors", stage="capture")
+                self.logger.error(f"Screen capture error: {str(e)}")
+                return False
+        
+        with self.metrics.timer("change_detection"):
+            self._detect_changes(frame)
+        self.last_frame = frame
+        
+        # 依規則優先順序提交比對，第一條成立的規則執行動作
+        results = self.match_engine.submit(frame, self.plan.submissions())
+        rule, positions = self.plan.evaluate(results)
+        self._prune_match_cache(frame)
+        if self.recorder is not None:
+            self.recorder.record(frame, {
+                "results": results.resolved(),
+                "rule": rule.name if rule else None,
+                "action": rule.action if rule else None,
+                "positions": positions,
+            })
+        if rule is None:
+            return False
+        return self._perform(rule, positions)
+    
+    def _perform(self, rule, positions):
+        """
+        Carry out the action of a rule that fired, on every occurrence found.
+        
+        Args:
+            rule (Rule): Rule that fired
+            positions (list): (x, y, w, h) of its matches, best score first
+        
+        Returns:
+            bool: True if an action was performed or queued
+        """
+        self.metrics.inc("rule_fired", rule=rule.name)
+        
+        if rule.action == "stop":
+            self.logger.info(f"{rule.name.capitalize()} image found, stopping wizard")
+            print("找到停止圖片，正在停止程序...")
+            self.stop(rule.reason or f"偵測到{rule.name}圖片")
+            return True
+        
+        if rule.action not in ("click", "press"):
+            return False
+        
+        # 同一輪找到的所有命中依設定的順序一次排入，只在最後一個之後等待
+        positions = order_positions(positions, rule.order or self.match_order, self.actions.cursor())
+        queued = False
+        for index, (x, y, w, h) in enumerate(positions):
+            final = index == len(positions) - 1
+            if rule.action == "click":
+                action = Action("click", x, y, target=rule.name, after=rule.pause, final=final)
+                queued = self.actions.submit(action) or queued
+            else:
+                queued = self._press(x, y, rule, final) or queued
+        return queued
+    
+    def _press(self, btn_x, btn_y, rule, final=True):
+        """
+        Queue a button press: a direct click, or typing the text in typing mode.
+        
+        Args:
+            btn_x (int): Button centre x
+            btn_y (int): Button centre y
+            rule (Rule): Rule that fired
+            final (bool): Last press queued this cycle (waits rule.pause afterwards)
+        
+        Returns:
+            bool: True if the press was queued (False if debounced or dropped)
+        """
+        if self.direct_click_mode:
+            # 直接點擊按鈕模式
+            action = Action("press", btn_x, btn_y, target=rule.name, after=rule.pause, final=final,
+                            on_done=self._on_pressed)
+        else:
+            # 點擊輸入框後輸入文字 (失敗時改用大寫替代文字)，再點擊確認
+            action = Action("type", btn_x, btn_y, target=rule.name, after=rule.pause, final=final,
+                            text=(self.input_text, self.alt_input_text), on_done=self._on_pressed)
+        
+        queued = self.actions.submit(action)
+        if queued:
+            if self.direct_click_mode:
+                print(f"直接點擊按鈕，位置: ({btn_x}, {btn_y})")
+            else:
+                print(f"將嘗試輸入文字: {self.input_text}")
+        return queued
+    
+    def _on_pressed(self, action):
+        """
+        Log a completed button press (called from the action thread).
+        
+        Args:
+            action (Action): The press that completed
+        """
+        self.logger.info(f"Clicked button at ({action.x}, {action.y})")
+        self._log_button_press()
     
     def start(self):
         """
         Start the key wizard scanning loop.
         """
+        try:
+            self._ensure_capture()
+        except Exception as e:
+            self.logger.error(f"Failed to create capture backend: {str(e)}")
+            self.scheduler.rearm()
+            return
+        
         if not self._load_templates():
             self.logger.error("Failed to load templates")
+            self.scheduler.rearm()
             return
             
-        self.running = True
+        self._start_metrics_export()
+        self.recorder = create_session_recorder(self.config, self.script_dir, {
+            "origin": self.capture.origin,
+            "capture": self.capture.describe(),
+            "matcher": self.matcher.name,
+            "rules": [rule.name for rule in self.rules],
+            "direct_click_mode": self.direct_click_mode,
+        })
+        self.scheduler.max_interval = max(self.scheduler.min_interval, self.scan_interval)
+        self.scheduler.reset()
+        # stop() 可能在載入模板時就已呼叫，此時不開始掃描
+        self.running = not self.scheduler.stopped
+        if not self.running:
+            self.logger.info("Key Wizard stopped before scanning started")
         scan_count = 0
+        if self.fleet is not None:
+            self.fleet.set_state("scanning")
         
         try:
             while self.running:
                 scan_count += 1
-                if self._process_action():
-                    self.logger.info("Action completed successfully")
+                self._sync_profiler()
+                wall_start = time.perf_counter()
+                cpu_start = time.process_time()
+                
+                acted = self._process_action()
+                if acted:
+                    self.logger.info("Action queued")
+                if scan_count == 1:
+                    startup_time = time.perf_counter() - self.started_at
+                    self.metrics.observe("startup", startup_time)
+                    self.logger.info(f"First scan completed {startup_time:.3f}s after start")
                 
-                time.sleep(self.scan_interval)
+                changes = self.last_frame.changes if self.last_frame is not None else None
+                changed = changes is not None and changes.any_changed
+                wall_time = time.perf_counter() - wall_start
+                interval = self.scheduler.next_interval(
+                    acted or changed,
+                    cpu_time=time.process_time() - cpu_start,
+                    wall_time=wall_time,
+                )
+                if self.fleet is not None:
+                    self.fleet.cycle(wall_time, acted)
+                self.metrics.inc("cycles")
+                with self.metrics.timer("sleep"):
+                    stopped = self.scheduler.wait(interval)
+                if stopped:
+                    break
                 
+        except CaptureExhausted:
+            self.logger.info("Replay source exhausted, stopping wizard")
         except KeyboardInterrupt:
             self.logger.info("Key Wizard stopped by user")
         except Exception as e:
+            self.metrics.inc("errors", stage="loop")
+            self.error = str(e)
             self.logger.error(f"Unexpected error: {str(e)}")
         finally:
             self.running = False
+            # 重播結束時完成已排入的動作；手動停止時已在 stop() 取消
+            self.actions.close()
+            self._finish_profiler()
+            self._stop_metrics_export()
+            self.match_engine.shutdown()
+            self._log_scan_stats()
+            if self.recorder is not None:
+                self.recorder.close()
+                self.recorder = None
+            if self.fleet is not None:
+                if self.error:
+                    self.fleet.event("error", urgent=True, error=self.error)
+                self.fleet.set_state("stopped", frames=self.frame_count)
+                delivered = self.fleet.close(self.config.get("notify_flush_timeout", 5.0))
+                if self._fleet_stop_reason is not None and not (delivered or self.fleet.stop_delivered):
+                    # 協調器沒有確認收到停止事件，改由本機直接發送 LINE 通知
+                    self.logger.warning("Fleet coordinator did not acknowledge the stop event, notifying directly")
+                    self._send_line_notification(self._fleet_stop_reason)
+                self._fleet_stop_reason = None
+            if self._owns_notifications:
+                # 在期限內送出剩餘的通知
+                self.notifications.close(self.config.get("notify_flush_timeout", 5.0))
+            if self.capture is not None:
+                self.capture.close()
+                self.capture = None
+            # 這次執行已結束，之後的 start() 重新等待新的停止要求
+            self.scheduler.rearm()
     
     def stop(self, reason="手動停止"):
         """
@@ -253,13 +844,22 @@ class KeyWizard:
         Args:
             reason (str): Reason for stopping
         """
+        # 立即喚醒等待中的掃描迴圈，並取消尚未完成的輸入動作
+        self.scheduler.stop()
+        self.actions.cancel()
+        
         if self.running:
             self.running = False
             self.logger.info(f"Key Wizard stopping: {reason}")
             print(f"按鍵精靈正在停止: {reason}")
             
-            # Send Line notification about stopping
-            self._send_line_notification(reason)
+            if self.fleet is not None and self.fleet.connected and self.config.get("fleet_notify", True):
+                # 由協調器去除重複、合併後發送 LINE 通知 (沒有確認收到時於結束前改由本機發送)
+                self._fleet_stop_reason = reason
+                self.fleet.stop_event(reason)
+            else:
+                # Send Line notification about stopping
+                self._send_line_notification(reason)
 
 # Export both classes at the end of the file
-__all__ = ['KeyWizard', 'LineNotifier']
\ No newline at end of file
+__all__ = ['KeyWizard', 'LineNotifier', 'Frame']
\ No newline at end of file
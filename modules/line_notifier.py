@@ -1,43 +1,80 @@
 import logging
 from datetime import datetime
-from linebot import LineBotApi
-from linebot.models import TextSendMessage
-from linebot.exceptions import LineBotApiError
 
 class LineNotifier:
     """
     Line messaging API notifier
     """
-    def __init__(self, channel_access_token=None, user_id=None):
-        self.channel_access_token = "LINE_NOTIFY_TOKEN"  # 替換為您的LINE Notify令牌
-        self.default_user_id = "USER_ID"  # 替換為您的LINE用戶ID
-        
-        # 初始化Line Bot API
-        self.line_bot_api = LineBotApi(self.channel_access_token)
+    def __init__(self, channel_access_token=None, user_id=None, endpoint=None, timeout=5):
+        self.channel_access_token = channel_access_token or "LINE_NOTIFY_TOKEN"  # 替換為您的LINE Notify令牌
+        self.default_user_id = user_id or "USER_ID"  # 替換為您的LINE用戶ID
+
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._line_bot_api = None
         self.logger = logging.getLogger('key_wizard')
-    
+
+    @property
+    def line_bot_api(self):
+        # LINE SDK 與 requests 在第一次發送時才載入，縮短啟動時間
+        if self._line_bot_api is None:
+            from linebot import LineBotApi
+            from .line_http import SessionHttpClient
+
+            # 初始化Line Bot API (連線池共用、保持連線)
+            api_options = {"timeout": self.timeout, "http_client": SessionHttpClient}
+            if self.endpoint:
+                api_options["endpoint"] = self.endpoint
+            self._line_bot_api = LineBotApi(self.channel_access_token, **api_options)
+        return self._line_bot_api
+
+    @property
+    def configured(self):
+        return self.channel_access_token != "LINE_NOTIFY_TOKEN"
+
+    def push(self, message, user_id=None):
+        """
+        Push a message, raising on failure.
+
+        Raises:
+            LineBotApiError: If the API rejects the message
+            requests.RequestException: On connection errors or timeouts
+        """
+        from linebot.models import TextSendMessage
+
+        recipient = user_id or self.default_user_id
+        self.line_bot_api.push_message(recipient, TextSendMessage(text=message))
+        self.logger.info(f"已發送LINE訊息: {message}")
+
     def send_message(self, message, user_id=None):
         try:
-            recipient = user_id or self.default_user_id
-            
             # 檢查是否有有效的令牌和用戶ID
-            if self.channel_access_token == "LINE_NOTIFY_TOKEN":
+            if not self.configured:
                 self.logger.warning("Line通知未配置:缺少有效的令牌")
                 return False
-            
+
             # 發送訊息
-            messages = TextSendMessage(text=message)
-            self.line_bot_api.push_message(recipient, messages)
-            
-            self.logger.info(f"已發送LINE訊息: {message}")
+            self.push(message, user_id)
             return True
-            
+
         except Exception as e:
             self.logger.error(f"發送LINE訊息時發生錯誤: {e}")
             return False
-    
-    def notify_program_stopped(self, reason="自動停止"):
+
+    def format_program_stopped(self, reason="自動停止"):
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        message = f"btnSprite 程序通知\n時間: {current_time}\n狀態: 程序已{reason}。"
-        
-        return self.send_message(message)
\ No newline at end of file
+        return f"btnSprite 程序通知\n時間: {current_time}\n狀態: 程序已{reason}。"
+
+    def notify_program_stopped(self, reason="自動停止"):
+        return self.send_message(self.format_program_stopped(reason))
+
+def is_retryable(error):
+    """
+    Whether a failed push is worth retrying (network problems, rate limits, server errors).
+    """
+    import requests
+    from linebot.exceptions import LineBotApiError
+
+    if isinstance(error, LineBotApiError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, requests.RequestException)
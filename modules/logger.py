@@ -1,44 +1,204 @@
 """
 Logging configuration for the btnSprite application.
+
+Log calls only put records on a queue; a background listener thread writes
+them out in batches, so the scanning loop never waits on disk. Both
+key_wizard.log and button_press.log stay open, are flushed periodically and
+rotate by size.
 """
 
 import os
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
+
+# 日誌輪替大小與保留份數
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+# 批次寫入間隔 (秒)
+FLUSH_INTERVAL = 1.0
+# button_press.log 同步到磁碟的間隔 (秒)
+FSYNC_INTERVAL = 5.0
+
+_listener = None
+
+
+class BufferedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Size-rotating file handler that keeps the file open and flushes in batches.
+    """
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT,
+                 flush_interval=FLUSH_INTERVAL, fsync_interval=None, delay=False):
+        """
+        Args:
+            filename (str): Log file path
+            max_bytes (int): Rotate when the file would exceed this size
+            backup_count (int): Rotated files to keep
+            flush_interval (float): Seconds between flushes of buffered records
+            fsync_interval (float, optional): Seconds between fsyncs; None disables fsync
+            delay (bool): Open the file on the first record
+        """
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=delay)
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self._last_flush = time.monotonic()
+        self._last_fsync = self._last_flush
+
+    def flush(self):
+        # StreamHandler.emit 每筆都會呼叫 flush，這裡只在間隔到了才真正寫出
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.force_flush()
+
+    def force_flush(self):
+        self.acquire()
+        try:
+            if self.stream and not self.stream.closed:
+                self.stream.flush()
+                now = time.monotonic()
+                self._last_flush = now
+                if self.fsync_interval is not None and now - self._last_fsync >= self.fsync_interval:
+                    os.fsync(self.stream.fileno())
+                    self._last_fsync = now
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream and not self.stream.closed:
+                self.stream.flush()
+                if self.fsync_interval is not None:
+                    os.fsync(self.stream.fileno())
+        finally:
+            self.release()
+        super().close()
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    Queue listener that also flushes idle handlers every ``flush_interval`` seconds.
+    """
+    def __init__(self, log_queue, *handlers, flush_interval=FLUSH_INTERVAL):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, self.flush_interval)
+            except queue.Empty:
+                # 沒有新紀錄時把緩衝中的紀錄寫出
+                for handler in self.handlers:
+                    if hasattr(handler, "force_flush"):
+                        handler.force_flush()
+                if not block:
+                    raise
+
 
 def setup_logging():
     """設置全局日誌配置"""
+    global _listener
+
     # 獲取腳本目錄
     script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    
+
     # 日誌文件路徑
     log_path = os.path.join(script_dir, "key_wizard.log")
-    
+    press_log_path = os.path.join(script_dir, "button_press.log")
+
     # 配置日誌
     logger = logging.getLogger('key_wizard')
-    
+    press_logger = logging.getLogger('key_wizard.press')
+
     # 避免重複添加處理器
     if not logger.handlers:
         logger.setLevel(logging.INFO)
-        
-        # 文件處理器
-        file_handler = logging.FileHandler(log_path, encoding='utf-8')
+
+        # 文件處理器 (批次寫入、依大小輪替)
+        file_handler = BufferedRotatingFileHandler(log_path)
         file_handler.setLevel(logging.INFO)
-        
+
         # 控制台處理器
         console_handler = logging.StreamHandler()
         console_handler.setLevel(logging.INFO)
-        
+
+        # 按鍵紀錄: 保持開啟，定期 fsync
+        press_handler = BufferedRotatingFileHandler(press_log_path, fsync_interval=FSYNC_INTERVAL, delay=True)
+        press_handler.addFilter(lambda record: record.name == 'key_wizard.press')
+        press_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+
         # 格式化器
         formatter = logging.Formatter(
             '%(asctime)s - %(levelname)s - %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
-        
+
         file_handler.setFormatter(formatter)
         console_handler.setFormatter(formatter)
-        
-        # 添加處理器
-        logger.addHandler(file_handler)
-        logger.addHandler(console_handler)
-    
-    return logger
\ No newline at end of file
+        file_handler.addFilter(lambda record: record.name != 'key_wizard.press')
+        console_handler.addFilter(lambda record: record.name != 'key_wizard.press')
+
+        # 記錄只放進佇列，由背景執行緒寫出
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        logger.addHandler(queue_handler)
+
+        press_logger.setLevel(logging.INFO)
+        press_logger.propagate = False
+        press_logger.addHandler(queue_handler)
+
+        _listener = BatchingQueueListener(log_queue, file_handler, console_handler, press_handler)
+        _listener.start()
+        atexit.register(stop_logging)
+
+    return logger
+
+
+class ForwardingHandler(logging.Handler):
+    """
+    Hands records received from worker processes to this process's loggers.
+    """
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def setup_worker_logging(log_queue, prefix):
+    """
+    Send this process's log records to a supervisor instead of the log files.
+
+    Only the supervisor writes key_wizard.log and button_press.log, so
+    worker processes never rotate the same file concurrently.
+
+    Args:
+        log_queue (multiprocessing.Queue): Queue read by the supervisor's ForwardingHandler
+        prefix (str): Worker name added in front of every message
+    """
+    stop_logging()
+
+    def add_prefix(record):
+        record.msg = f"[{prefix}] {record.getMessage()}"
+        record.args = None
+        return True
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(add_prefix)
+    for name in ('key_wizard', 'key_wizard.press'):
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(queue_handler)
+
+
+def stop_logging():
+    """
+    Write out queued records and close the log files.
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
@@ -0,0 +1,164 @@
+"""
+Parallel template matching for one scan cycle.
+
+OpenCV releases the GIL inside ``matchTemplate``, so the checks of a cycle can
+run on a thread pool against the shared frame. Results are read back by name
+in priority order, so the caller's decision order does not depend on which
+check finishes first.
+
+Each submission is numbered. A check still running when its cycle was
+cancelled or a newer cycle was submitted must not apply its result (ROI
+trackers, result cache) over the newer one; ``MatchEngine.completing``
+tells it whether its generation is still current.
+
+On a single CPU the pool only adds overhead, so unless ``match_workers``
+is set the checks run sequentially there.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+
+def default_workers():
+    """
+    Returns:
+        int: Thread-pool size when match_workers is not set (0 = sequential on a single CPU)
+    """
+    return 4 if (os.cpu_count() or 1) > 1 else 0
+
+
+class MatchResults:
+    """
+    Results of the checks submitted for one frame.
+    """
+    def __init__(self, locate, frame, checks, executor=None, generation=None, on_cancel=None):
+        """
+        Args:
+            locate (callable): locate(template, confidence, frame, name, generation) -> positions or None
+            frame (Frame): Frame shared by all checks
+            checks (list): (name, template, confidence) tuples in priority order
+            executor (ThreadPoolExecutor, optional): Pool to run the checks on;
+                without one each check runs lazily on first access
+            generation (int, optional): Submission number passed to locate
+            on_cancel (callable, optional): on_cancel(generation) when the checks are cancelled
+        """
+        self._locate = locate
+        self._frame = frame
+        self._checks = {name: (template, confidence) for name, template, confidence in checks}
+        self._futures = {}
+        self._results = {}
+        self.generation = generation
+        self._on_cancel = on_cancel
+
+        if executor is not None:
+            for name, template, confidence in checks:
+                self._futures[name] = executor.submit(locate, template, confidence, frame, name, generation)
+
+    def get(self, name):
+        """
+        Get the result of one check, waiting for it if necessary.
+
+        Args:
+            name (str): Check name
+
+        Returns:
+            list or None: Positions returned by locate, None if not found or not submitted
+        """
+        if name in self._results:
+            return self._results[name]
+        if name not in self._checks:
+            return None
+
+        future = self._futures.get(name)
+        if future is not None:
+            result = future.result()
+        else:
+            template, confidence = self._checks[name]
+            result = self._locate(template, confidence, self._frame, name, self.generation)
+
+        self._results[name] = result
+        return result
+
+    def resolved(self):
+        """
+        Returns:
+            dict: name -> result of the checks read so far
+        """
+        return dict(self._results)
+
+    def cancel(self):
+        """
+        Cancel checks that have not started yet (a higher-priority check already decided).
+
+        Checks already running finish, but their results are dropped.
+        """
+        if self._on_cancel is not None:
+            self._on_cancel(self.generation)
+        for future in self._futures.values():
+            future.cancel()
+
+
+class MatchEngine:
+    """
+    Runs the template checks of a cycle, in parallel when workers > 1.
+    """
+    def __init__(self, locate, workers=None):
+        """
+        Args:
+            locate (callable): locate(template, confidence, frame, name, generation) -> positions or None
+            workers (int, optional): Thread-pool size; 0 or 1 keeps the checks sequential and lazy
+                (None = default_workers())
+        """
+        self.locate = locate
+        self.workers = default_workers() if workers is None else workers
+        self._executor = None
+        self.generation = 0
+        self._cancelled = None
+        self._lock = threading.Lock()
+
+    @property
+    def parallel(self):
+        return self.workers > 1
+
+    def submit(self, frame, checks):
+        """
+        Start the checks for one frame.
+
+        Args:
+            frame (Frame): Frame shared by all checks
+            checks (list): (name, template, confidence) tuples in priority order
+
+        Returns:
+            MatchResults: Results to read back by name
+        """
+        if self.parallel and self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="match")
+        with self._lock:
+            self.generation += 1
+            generation = self.generation
+        return MatchResults(self.locate, frame, checks, self._executor, generation, self._cancel)
+
+    def _cancel(self, generation):
+        with self._lock:
+            self._cancelled = generation
+
+    @contextmanager
+    def completing(self, generation):
+        """
+        Hold while applying a check's result to shared state.
+
+        Args:
+            generation (int or None): Submission the check belongs to (None = always current)
+
+        Yields:
+            bool: False if the submission was cancelled or superseded (drop the result)
+        """
+        with self._lock:
+            yield generation is None or (generation == self.generation and generation != self._cancelled)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
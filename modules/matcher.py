@@ -0,0 +1,648 @@
+"""
+Template matching strategies for the btnSprite application.
+
+All matchers share one interface, ``match(frame, template, confidence)``,
+and report scores on the same ``cv2.TM_CCOEFF_NORMED`` scale, so the
+strategy can be switched in config.json without retuning thresholds.
+``match_all`` returns every occurrence above the threshold instead of
+only the best one.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+# 超過門檻的候選點上限 (只保留分數最高的部分再做非極大值抑制)
+MAX_CANDIDATES = 4096
+
+
+def non_max_suppression(xs, ys, scores, w, h, max_hits, overlap=0.3):
+    """
+    Keep the best of every group of overlapping hits.
+
+    All boxes have the template's size, so the overlap of one box with all
+    remaining boxes is computed in a single vectorized step per kept hit.
+
+    Args:
+        xs (np.ndarray): Left edges of the candidates
+        ys (np.ndarray): Top edges of the candidates
+        scores (np.ndarray): Candidate scores
+        w (int): Box width
+        h (int): Box height
+        max_hits (int): Maximum number of hits to keep
+        overlap (float): Boxes overlapping a kept box by more than this (IoU) are dropped
+
+    Returns:
+        list: (x, y, score) tuples, best score first
+    """
+    order = np.argsort(-scores, kind="stable")
+    xs, ys, scores = xs[order], ys[order], scores[order]
+    area = float(w * h)
+    hits = []
+    remaining = np.arange(len(scores))
+    while remaining.size and len(hits) < max_hits:
+        best = remaining[0]
+        hits.append((int(xs[best]), int(ys[best]), float(scores[best])))
+        inter_w = np.maximum(0, w - np.abs(xs[remaining] - xs[best]))
+        inter_h = np.maximum(0, h - np.abs(ys[remaining] - ys[best]))
+        inter = inter_w * inter_h
+        remaining = remaining[inter / (2 * area - inter) <= overlap]
+    return hits
+
+
+def find_peaks(result, threshold, w, h, max_hits, overlap=0.3):
+    """
+    Every separate occurrence in a score map.
+
+    Args:
+        result (np.ndarray): Score map (e.g. from cv2.matchTemplate)
+        threshold (float): Minimum score
+        w (int): Template width
+        h (int): Template height
+        max_hits (int): Maximum number of hits
+        overlap (float): IoU above which two hits are the same occurrence
+
+    Returns:
+        list: (x, y, score) tuples, best score first
+    """
+    ys, xs = np.nonzero(result >= threshold)
+    if not len(xs):
+        return []
+    scores = result[ys, xs]
+    if len(scores) > MAX_CANDIDATES:
+        top = np.argpartition(-scores, MAX_CANDIDATES)[:MAX_CANDIDATES]
+        xs, ys, scores = xs[top], ys[top], scores[top]
+    return non_max_suppression(xs, ys, scores, w, h, max_hits, overlap)
+
+
+class ExhaustiveMatcher:
+    """
+    Full-resolution matchTemplate over the whole frame (the original behaviour).
+    """
+    name = "exhaustive"
+    template_cache = None
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def prepare(self, templates, frame_shape=None, cache=None):
+        """
+        Precompute per-template data when the templates are loaded.
+
+        Args:
+            templates (list): Template images
+            frame_shape (tuple, optional): (height, width) of the captured frames
+            cache (TemplateCache, optional): On-disk cache for derived template data
+        """
+        self.template_cache = cache
+
+    def forget(self, templates):
+        """
+        Drop the data prepared for templates that are no longer used.
+
+        Args:
+            templates (list): Template images passed to prepare() or matched before
+        """
+
+    def prepared_nbytes(self, template):
+        """
+        Returns:
+            int: Bytes of prepared data the matcher keeps for a template
+        """
+        return 0
+
+    def _derived(self, template, kind, compute, keep=True):
+        if self.template_cache is None:
+            return compute()
+        return self.template_cache.derived(template, kind, compute, keep)
+
+    def _scores(self, image, template):
+        """
+        matchTemplate into a per-thread buffer that is reused between calls.
+
+        The score map of a full-screen search is as large as the frame in
+        float32; every match worker keeps one buffer that only grows.
+        """
+        local = self._local
+        shape = (image.shape[0] - template.shape[0] + 1, image.shape[1] - template.shape[1] + 1)
+        size = shape[0] * shape[1]
+        buffer = getattr(local, "scores", None)
+        if buffer is None or buffer.size < size:
+            buffer = local.scores = np.empty(size, np.float32)
+        return cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED, result=buffer[:size].reshape(shape))
+
+    def match(self, frame, template, confidence):
+        """
+        Find the best match of a template in a frame.
+
+        Args:
+            frame (Frame): Frame to search
+            template (np.ndarray): Template image
+            confidence (float): Matching confidence threshold
+
+        Returns:
+            tuple or None: (x, y, score) of the top-left corner in frame pixels
+        """
+        image = frame.image
+        if image.shape[0] < template.shape[0] or image.shape[1] < template.shape[1]:
+            return None
+
+        result = self._scores(image, template)
+        _, max_val, _, max_loc = cv2.minMaxLoc(result)
+
+        if max_val >= confidence:
+            return (max_loc[0], max_loc[1], max_val)
+        return None
+
+    def match_all(self, frame, template, confidence, max_hits=10):
+        """
+        Find every occurrence of a template in a frame.
+
+        Args:
+            frame (Frame): Frame to search
+            template (np.ndarray): Template image
+            confidence (float): Matching confidence threshold
+            max_hits (int): Maximum number of occurrences
+
+        Returns:
+            list: (x, y, score) of the top-left corners in frame pixels, best score first
+        """
+        image = frame.image
+        if image.shape[0] < template.shape[0] or image.shape[1] < template.shape[1]:
+            return []
+        result = self._scores(image, template)
+        return find_peaks(result, confidence, template.shape[1], template.shape[0], max_hits)
+
+
+class PyramidMatcher(ExhaustiveMatcher):
+    """
+    Coarse-to-fine matching.
+
+    The frame and template are downscaled by ``2 ** levels``; candidate peaks
+    found on the small frame are then re-scored with full-resolution
+    matchTemplate in a small window around each candidate. The returned score
+    is always the full-resolution score, so ``confidence`` keeps its meaning.
+    """
+    name = "pyramid"
+
+    def __init__(self, levels=2, margin=0.2, candidates=3, min_template_size=8):
+        """
+        Args:
+            levels (int): Number of pyrDown steps for the coarse search
+            margin (float): How far below ``confidence`` a coarse peak may score
+            candidates (int): Maximum number of coarse peaks to refine
+            min_template_size (int): Smallest template side allowed at the coarse level
+        """
+        super().__init__()
+        self.levels = levels
+        self.margin = margin
+        self.candidates = candidates
+        self.min_template_size = min_template_size
+        self._template_cache = {}
+
+    def prepare(self, templates, frame_shape=None, cache=None):
+        """
+        Precompute the downscaled templates (read from the template cache when available).
+        """
+        super().prepare(templates, frame_shape, cache)
+        for template in templates:
+            if template is not None:
+                self._coarse_template(template, self._levels_for(template))
+
+    def forget(self, templates):
+        by_id = {id(template): template for template in templates}
+        for key, cached in list(self._template_cache.items()):
+            if by_id.get(key[0]) is cached[0]:
+                del self._template_cache[key]
+
+    def prepared_nbytes(self, template):
+        return sum(cached[1].nbytes for key, cached in list(self._template_cache.items())
+                   if key[0] == id(template) and cached[0] is template)
+
+    def _downscale(self, image, levels):
+        for _ in range(levels):
+            image = cv2.pyrDown(image)
+        return image
+
+    def _levels_for(self, template):
+        # 模板太小時減少縮放層數，避免縮到無法辨識
+        h, w = template.shape[:2]
+        levels = self.levels
+        while levels > 0 and min(h, w) >> levels < self.min_template_size:
+            levels -= 1
+        return levels
+
+    def _coarse_template(self, template, levels):
+        key = (id(template), levels)
+        cached = self._template_cache.get(key)
+        if cached is None or cached[0] is not template:
+            cached = (template, self._derived(template, f"pyr{levels}", lambda: self._downscale(template, levels)))
+            self._template_cache[key] = cached
+        return cached[1]
+
+    def _coarse_frame(self, frame, levels):
+        key = ("pyramid", levels)
+        small = frame.cache.get(key)
+        if small is None:
+            small = self._downscale(frame.image, levels)
+            frame.cache[key] = small
+        return small
+
+    def _peaks(self, result, threshold, suppress_w, suppress_h):
+        peaks = []
+        result = result.copy()
+        for _ in range(self.candidates):
+            _, max_val, _, max_loc = cv2.minMaxLoc(result)
+            if max_val < threshold:
+                break
+            peaks.append(max_loc)
+            x, y = max_loc
+            result[max(0, y - suppress_h):y + suppress_h + 1,
+                   max(0, x - suppress_w):x + suppress_w + 1] = -1.0
+        return peaks
+
+    def match(self, frame, template, confidence):
+        levels = self._levels_for(template)
+        if levels == 0:
+            return super().match(frame, template, confidence)
+
+        image = frame.image
+        h, w = template.shape[:2]
+        if image.shape[0] < h or image.shape[1] < w:
+            return None
+
+        small_frame = self._coarse_frame(frame, levels)
+        small_template = self._coarse_template(template, levels)
+        if small_frame.shape[0] < small_template.shape[0] or small_frame.shape[1] < small_template.shape[1]:
+            return super().match(frame, template, confidence)
+
+        coarse = cv2.matchTemplate(small_frame, small_template, cv2.TM_CCOEFF_NORMED)
+        sh, sw = small_template.shape[:2]
+        peaks = self._peaks(coarse, confidence - self.margin, sw // 2, sh // 2)
+
+        scale = 1 << levels
+        pad = scale * 2
+        best = None
+        for px, py in peaks:
+            # 在原始解析度下只比對候選點附近的小區域
+            x0 = max(0, px * scale - pad)
+            y0 = max(0, py * scale - pad)
+            x1 = min(image.shape[1], px * scale + w + pad)
+            y1 = min(image.shape[0], py * scale + h + pad)
+            window = image[y0:y1, x0:x1]
+            if window.shape[0] < h or window.shape[1] < w:
+                continue
+
+            result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, max_loc = cv2.minMaxLoc(result)
+            if best is None or max_val > best[2]:
+                best = (x0 + max_loc[0], y0 + max_loc[1], max_val)
+
+        if best is not None and best[2] >= confidence:
+            return best
+        return None
+
+    def match_all(self, frame, template, confidence, max_hits=10):
+        levels = self._levels_for(template)
+        if levels == 0:
+            return super().match_all(frame, template, confidence, max_hits)
+
+        image = frame.image
+        h, w = template.shape[:2]
+        if image.shape[0] < h or image.shape[1] < w:
+            return []
+
+        small_frame = self._coarse_frame(frame, levels)
+        small_template = self._coarse_template(template, levels)
+        if small_frame.shape[0] < small_template.shape[0] or small_frame.shape[1] < small_template.shape[1]:
+            return super().match_all(frame, template, confidence, max_hits)
+
+        coarse = cv2.matchTemplate(small_frame, small_template, cv2.TM_CCOEFF_NORMED)
+        sh, sw = small_template.shape[:2]
+        peaks = find_peaks(coarse, confidence - self.margin, sw, sh, max(self.candidates, max_hits * 2))
+
+        scale = 1 << levels
+        pad = scale * 2
+        xs, ys, scores = [], [], []
+        for px, py, _ in peaks:
+            x0 = max(0, px * scale - pad)
+            y0 = max(0, py * scale - pad)
+            x1 = min(image.shape[1], px * scale + w + pad)
+            y1 = min(image.shape[0], py * scale + h + pad)
+            window = image[y0:y1, x0:x1]
+            if window.shape[0] < h or window.shape[1] < w:
+                continue
+            _, max_val, _, max_loc = cv2.minMaxLoc(cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED))
+            if max_val >= confidence:
+                xs.append(x0 + max_loc[0])
+                ys.append(y0 + max_loc[1])
+                scores.append(max_val)
+
+        if not scores:
+            return []
+        return non_max_suppression(np.array(xs), np.array(ys), np.array(scores), w, h, max_hits)
+
+
+class FFTMatcher(ExhaustiveMatcher):
+    """
+    Batched spectral matching.
+
+    The frame is transformed once per cycle (cached on the Frame; region
+    crops use the transform of the frame they were cut from) and every
+    template is matched with one spectral multiply and one inverse transform.
+    Zero-mean template spectra are prepared when the templates are loaded.
+    Scores reproduce ``cv2.TM_CCOEFF_NORMED``, including its handling of flat
+    windows and flat templates, so ``confidence`` keeps its meaning.
+    """
+    name = "fft"
+
+    def __init__(self, min_pixels=256 * 256, max_cached_shapes=8):
+        """
+        Args:
+            min_pixels (int): Smaller search areas (e.g. ROI crops) use direct matchTemplate
+            max_cached_shapes (int): Spectra kept per template for different frame sizes
+        """
+        super().__init__()
+        self.min_pixels = min_pixels
+        self.max_cached_shapes = max_cached_shapes
+        self._templates = {}  # id(template) -> (template, zero-mean float64, norm²)
+        self._spectra = {}  # (id(template), fft shape) -> spectrum
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fft_shape(image_shape):
+        return (cv2.getOptimalDFTSize(image_shape[0]), cv2.getOptimalDFTSize(image_shape[1]))
+
+    def _template_data(self, template):
+        data = self._templates.get(id(template))
+        if data is None or data[0] is not template:
+            t = template.astype(np.float64)
+            if t.ndim == 2:
+                t = t[:, :, None]
+            t -= t.mean(axis=(0, 1))
+            data = (template, t, float((t * t).sum()))
+            self._templates[id(template)] = data
+        return data
+
+    def _template_spectrum(self, template, fft_shape):
+        key = (id(template), fft_shape)
+        spectrum = self._spectra.get(key)
+        if spectrum is None:
+            def compute():
+                _, zero_mean, _ = self._template_data(template)
+                # complex64 佔一半空間，分數誤差仍遠小於 1e-4
+                return np.conj(np.fft.rfft2(zero_mean, s=fft_shape, axes=(0, 1))).astype(np.complex64)
+
+            # 頻譜依畫面尺寸存在模板快取 (記憶體內只保留在這裡)
+            spectrum = self._derived(template, f"fft{fft_shape[0]}x{fft_shape[1]}", compute, keep=False)
+            with self._lock:
+                if len(self._spectra) >= self.max_cached_shapes * max(1, len(self._templates)):
+                    self._spectra.pop(next(iter(self._spectra)))
+                self._spectra[key] = spectrum
+        return spectrum
+
+    def prepare(self, templates, frame_shape=None, cache=None):
+        """
+        Precompute zero-mean templates and, if the frame size is known, their spectra.
+
+        Args:
+            templates (list): Template images
+            frame_shape (tuple, optional): (height, width) of the captured frames
+            cache (TemplateCache, optional): On-disk cache for derived template data
+        """
+        super().prepare(templates, frame_shape, cache)
+        for template in templates:
+            if template is None:
+                continue
+            self._template_data(template)
+            if frame_shape is not None:
+                self._template_spectrum(template, self._fft_shape(frame_shape))
+
+    def forget(self, templates):
+        with self._lock:
+            for template in templates:
+                data = self._templates.get(id(template))
+                if data is None or data[0] is not template:
+                    continue
+                del self._templates[id(template)]
+                for key in [key for key in self._spectra if key[0] == id(template)]:
+                    del self._spectra[key]
+
+    def prepared_nbytes(self, template):
+        with self._lock:
+            data = self._templates.get(id(template))
+            if data is None or data[0] is not template:
+                return 0
+            return data[1].nbytes + sum(spectrum.nbytes for key, spectrum in self._spectra.items()
+                                        if key[0] == id(template))
+
+    def _frame_data(self, frame):
+        """
+        Frame spectrum and integral images, computed once per frame.
+
+        Call with the parent frame of a crop (see scores()).
+        """
+        data = frame.cache.get("fft")
+        if data is not None:
+            return data
+
+        with self._lock:
+            data = frame.cache.get("fft")
+            if data is None:
+                image = frame.image
+                if image.ndim == 2:
+                    image = image[:, :, None]
+                fft_shape = self._fft_shape(image.shape)
+                spectrum = np.fft.rfft2(image.astype(np.float64), s=fft_shape, axes=(0, 1))
+                sums, sqsums = cv2.integral2(frame.image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+                if sums.ndim == 2:
+                    sums, sqsums = sums[:, :, None], sqsums[:, :, None]
+                data = (fft_shape, spectrum, sums, sqsums)
+                frame.cache["fft"] = data
+        return data
+
+    @staticmethod
+    def _window_sum(integral, h, w):
+        return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+    def scores(self, frame, template):
+        """
+        Full TM_CCOEFF_NORMED response map of a template over a frame.
+
+        Args:
+            frame (Frame): Frame to search
+            template (np.ndarray): Template image
+
+        Returns:
+            np.ndarray: Score map of shape (H - h + 1, W - w + 1)
+        """
+        _, _, template_norm2 = self._template_data(template)
+        h, w = template.shape[:2]
+        out_h = frame.height - h + 1
+        out_w = frame.width - w + 1
+        if template_norm2 < np.finfo(np.float64).eps * h * w:
+            # 與 OpenCV 相同: 平坦的模板在任何位置的分數都是 1
+            return np.ones((out_h, out_w))
+
+        # 搜尋範圍的裁切共用整張畫面的頻譜，再取出範圍內的分數
+        base = frame.parent or frame
+        x, y = frame.offset
+        fft_shape, spectrum, sums, sqsums = self._frame_data(base)
+
+        # 各通道的頻譜相乘後相加，只需一次反轉換
+        product = (spectrum * self._template_spectrum(template, fft_shape)).sum(axis=2)
+        numerator = np.fft.irfft2(product, s=fft_shape)[y:y + out_h, x:x + out_w]
+
+        sums = sums[y:y + frame.height + 1, x:x + frame.width + 1]
+        sqsums = sqsums[y:y + frame.height + 1, x:x + frame.width + 1]
+        window_sum = self._window_sum(sums, h, w)
+        window_sqsum = self._window_sum(sqsums, h, w)
+        variance = (window_sqsum - window_sum * window_sum / (h * w)).sum(axis=2)
+        denominator = np.sqrt(np.maximum(variance, 0) * template_norm2)
+
+        # 與 OpenCV 相同: 平坦區域 (分母約為 0) 的分數為 0
+        abs_num = np.abs(numerator)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = np.where(abs_num < denominator, numerator / denominator,
+                              np.where(abs_num < denominator * 1.125, np.sign(numerator), 0.0))
+        return result
+
+    def match(self, frame, template, confidence):
+        image = frame.image
+        if image.shape[0] < template.shape[0] or image.shape[1] < template.shape[1]:
+            return None
+        if image.shape[0] * image.shape[1] < self.min_pixels:
+            return super().match(frame, template, confidence)
+
+        result = self.scores(frame, template)
+        index = int(np.argmax(result))
+        y, x = divmod(index, result.shape[1])
+        max_val = float(result[y, x])
+
+        if max_val >= confidence:
+            return (x, y, max_val)
+        return None
+
+    def match_all(self, frame, template, confidence, max_hits=10):
+        image = frame.image
+        if image.shape[0] < template.shape[0] or image.shape[1] < template.shape[1]:
+            return []
+        if image.shape[0] * image.shape[1] < self.min_pixels:
+            return super().match_all(frame, template, confidence, max_hits)
+        return find_peaks(self.scores(frame, template), confidence, template.shape[1], template.shape[0], max_hits)
+
+
+class SearchRequest:
+    """
+    One template search of a scan cycle: where to look and in which format.
+
+    Plain data, so it can be run locally or sent to a detection server.
+    """
+    FIELDS = ("name", "region", "confidence", "color", "scale", "max_hits", "fallback")
+
+    def __init__(self, name, region, confidence, color="bgr", scale=1, max_hits=1, size=None, fallback=None):
+        """
+        Args:
+            name (str): Check name
+            region (tuple): (x, y, w, h) search region in frame coordinates
+            confidence (float): Matching confidence threshold
+            color (str): "bgr" or "gray" matching
+            scale (int): Downscale factor for matching
+            max_hits (int): Occurrences to return (1 = best match only)
+            size (tuple, optional): (w, h) of the original template; kept by the caller, not sent
+            fallback (tuple, optional): (x, y, w, h) region searched when ``region`` has no match
+        """
+        self.name = name
+        self.region = tuple(region)
+        self.confidence = confidence
+        self.color = color
+        self.scale = scale
+        self.max_hits = max_hits
+        self.size = size
+        self.fallback = tuple(fallback) if fallback else None
+
+    def to_dict(self):
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data["region"] = list(self.region)
+        if self.fallback:
+            data["fallback"] = list(self.fallback)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{field: data[field] for field in cls.FIELDS if field in data})
+
+
+def search(matcher, frame, template, request):
+    """
+    Run one search request on a frame.
+
+    If nothing is found in the request region and the request has a fallback
+    region, the fallback region is searched as well.
+
+    Args:
+        matcher (ExhaustiveMatcher): Matcher to use
+        frame (Frame): Full frame
+        template (np.ndarray): Template in the request's matching format
+        request (SearchRequest): What to search
+
+    Returns:
+        list: (x, y, score) in full-resolution pixels relative to the request region, best score first
+    """
+    matches = _search_region(matcher, frame, template, request, request.region)
+    if matches or not request.fallback:
+        return matches
+    # 縮小的範圍沒有找到: 同一輪改搜尋整個基本範圍 (座標仍相對於 request.region)
+    dx = request.fallback[0] - request.region[0]
+    dy = request.fallback[1] - request.region[1]
+    return [(x + dx, y + dy, score)
+            for x, y, score in _search_region(matcher, frame, template, request, request.fallback)]
+
+
+def _search_region(matcher, frame, template, request, region):
+    """
+    Search one region of a frame in the request's format.
+
+    Returns:
+        list: (x, y, score) in full-resolution pixels relative to ``region``
+    """
+    scale = request.scale
+    rx, ry = region[0] // scale, region[1] // scale
+    view = frame.variant(request.color, scale).crop(rx, ry, region[2] // scale, region[3] // scale)
+    if request.max_hits > 1:
+        matches = matcher.match_all(view, template, request.confidence, request.max_hits)
+    else:
+        match = matcher.match(view, template, request.confidence)
+        matches = [match] if match else []
+    # 換算回原始解析度、相對於搜尋範圍的座標
+    return [((rx + mx) * scale - region[0], (ry + my) * scale - region[1], score) for mx, my, score in matches]
+
+
+def create_matcher(config):
+    """
+    Create the matcher selected by the configuration.
+
+    Args:
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+
+    Returns:
+        ExhaustiveMatcher: Matcher instance
+
+    Raises:
+        ValueError: If the strategy name is unknown
+    """
+    strategy = config.get("match_strategy", "exhaustive")
+
+    if strategy == "exhaustive":
+        return ExhaustiveMatcher()
+    if strategy == "fft":
+        return FFTMatcher(min_pixels=config.get("fft_min_pixels", 256 * 256))
+    if strategy == "pyramid":
+        return PyramidMatcher(
+            levels=config.get("pyramid_levels", 2),
+            margin=config.get("pyramid_margin", 0.2),
+            candidates=config.get("pyramid_candidates", 3),
+        )
+
+    raise ValueError(f"Unknown match strategy: {strategy}")
@@ -0,0 +1,264 @@
+"""
+Low-overhead metrics for the scanning loop.
+
+Stage timings are aggregated into fixed-bucket histograms and events into
+counters. They can be served on localhost in Prometheus text format and
+written periodically as a JSON snapshot.
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 直方圖的區間上限 (秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = "btnsprite"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram (cumulative on export, like Prometheus).
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q):
+        """
+        Estimate a quantile from the buckets (upper bound of the bucket holding it).
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound if bound != float("inf") else self.buckets[-1]
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Registry of stage histograms and labelled counters.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.stages = {}
+        self.counters = {}
+        self.active = {}  # thread id -> 正在執行的階段 (供效能分析取樣)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        """
+        Record the duration of a stage.
+
+        Args:
+            stage (str): Stage name (capture, convert, match:<template>, action, sleep, ...)
+            seconds (float): Duration
+        """
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Mark the stage the calling thread is in, without timing it.
+        """
+        thread_id = threading.get_ident()
+        previous = self.active.get(thread_id)
+        self.active[thread_id] = stage
+        try:
+            yield
+        finally:
+            if previous is None:
+                self.active.pop(thread_id, None)
+            else:
+                self.active[thread_id] = previous
+
+    def current_stage(self, thread_id):
+        return self.active.get(thread_id)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            with self.stage(stage):
+                yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Increase a counter.
+
+        Args:
+            name (str): Counter name (cycles, matches, clicks, errors, ...)
+            amount (int): Increment
+            **labels: Label values, e.g. template="button"
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: JSON-serialisable view of all metrics
+        """
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": h.count,
+                    "sum": h.sum,
+                    "mean": h.sum / h.count if h.count else 0.0,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                }
+                for stage, h in self.stages.items()
+            }
+            counters = {}
+            for (name, labels), value in self.counters.items():
+                label_text = ",".join(f"{k}={v}" for k, v in labels)
+                counters[f"{name}{{{label_text}}}" if label_text else name] = value
+
+        return {
+            "timestamp": time.time(),
+            "uptime": time.time() - self.started,
+            "stages": stages,
+            "counters": counters,
+        }
+
+    def render_prometheus(self):
+        """
+        Returns:
+            str: Metrics in Prometheus text exposition format
+        """
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds Time spent in each scan-cycle stage.",
+            f"# TYPE {PREFIX}_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.stages.items()):
+                for bound, total in histogram.cumulative():
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {total}')
+                lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                    typed.add(name)
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{PREFIX}_{name}_total{label_text} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    Localhost HTTP endpoint serving /metrics (Prometheus) and /metrics.json.
+    """
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(metrics.snapshot()).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path.startswith("/metrics"):
+                    body = metrics.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class SnapshotWriter:
+    """
+    Writes the JSON snapshot to a file every ``interval`` seconds.
+    """
+    def __init__(self, metrics, path, interval=60.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self.logger = logging.getLogger('key_wizard')
+
+    def write(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as snapshot_file:
+                json.dump(self.metrics.snapshot(), snapshot_file, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self.logger.error(f"Error writing metrics snapshot: {str(e)}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-snapshot", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+        self.write()
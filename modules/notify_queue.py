@@ -0,0 +1,239 @@
+"""
+Non-blocking outbound notification queue.
+
+Messages are handed to a background worker, so neither the scanning thread
+nor the Tk main loop waits on the LINE API. The worker coalesces bursts into
+a single digest, retries transient failures with exponential backoff and can
+be flushed with a deadline on exit.
+"""
+
+import queue
+import time
+import logging
+import threading
+
+from .line_notifier import is_retryable
+
+
+class NotificationQueue:
+    """
+    Background sender in front of a LineNotifier.
+    """
+    def __init__(self, notifier, retries=3, backoff=1.0, coalesce_window=2.0, max_batch=20, max_pending=100):
+        """
+        Args:
+            notifier (LineNotifier): Notifier used to push messages
+            retries (int): Retries after a failed push
+            backoff (float): Delay before the first retry, doubled on each retry (seconds)
+            coalesce_window (float): Messages arriving within this window are merged (seconds)
+            max_batch (int): Maximum messages merged into one digest
+            max_pending (int): Queue size; further messages are dropped
+        """
+        self.notifier = notifier
+        self.retries = retries
+        self.backoff = backoff
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closing = threading.Event()
+        self._deadline = None
+        self._worker = None
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger('key_wizard')
+
+        # 統計
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="line-notify", daemon=True)
+                self._worker.start()
+
+    def submit(self, message, user_id=None, callback=None):
+        """
+        Queue a message without waiting for it to be sent.
+
+        Args:
+            message (str): Message text
+            user_id (str, optional): Recipient; the notifier's default if omitted
+            callback (callable, optional): callback(success) called from the worker thread
+
+        Returns:
+            bool: True if queued, False if the queue is closed or full
+        """
+        if self._closing.is_set():
+            return False
+        try:
+            self._queue.put_nowait((message, user_id, callback))
+        except queue.Full:
+            self.dropped += 1
+            self.logger.warning("LINE notification queue full, message dropped")
+            return False
+        self._ensure_worker()
+        return True
+
+    def send_message(self, message, user_id=None, callback=None):
+        return self.submit(message, user_id, callback)
+
+    def notify_program_stopped(self, reason="自動停止", callback=None):
+        return self.submit(self.notifier.format_program_stopped(reason), callback=callback)
+
+    def _remaining(self):
+        if self._deadline is None:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+    def _collect(self, first):
+        """
+        Gather messages that arrive within the coalescing window.
+        """
+        batch = [first]
+        window_end = time.monotonic() + self.coalesce_window
+        while len(batch) < self.max_batch:
+            timeout = window_end - time.monotonic()
+            if self._closing.is_set():
+                timeout = 0
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _digest(self, batch):
+        """
+        Merge a batch into one message per recipient.
+        """
+        groups = {}
+        for message, user_id, callback in batch:
+            groups.setdefault(user_id, ([], []))
+            groups[user_id][0].append(message)
+            if callback is not None:
+                groups[user_id][1].append(callback)
+
+        for user_id, (messages, callbacks) in groups.items():
+            if len(messages) == 1:
+                text = messages[0]
+            else:
+                text = f"btnSprite 通知摘要 ({len(messages)} 則)\n\n" + "\n\n".join(messages)
+            yield text, user_id, callbacks
+
+    def _push(self, text, user_id):
+        """
+        Push with retries.
+
+        Returns:
+            bool: True if delivered
+        """
+        if not self.notifier.configured:
+            self.logger.warning("Line通知未配置:缺少有效的令牌")
+            return False
+
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                self.notifier.push(text, user_id)
+                return True
+            except Exception as e:
+                remaining = self._remaining()
+                if attempt >= self.retries or not is_retryable(e) or (remaining is not None and remaining < delay):
+                    self.logger.error(f"發送LINE訊息時發生錯誤: {e}")
+                    return False
+                self.logger.warning(f"LINE push failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                delay *= 2
+        return False
+
+    def _run(self):
+        while True:
+            remaining = self._remaining()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                first = self._queue.get(timeout=0.2)
+            except queue.Empty:
+                if self._closing.is_set():
+                    break
+                continue
+
+            batch = self._collect(first)
+            for text, user_id, callbacks in self._digest(batch):
+                success = self._push(text, user_id)
+                if success:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                for callback in callbacks:
+                    try:
+                        callback(success)
+                    except Exception as e:
+                        self.logger.error(f"Notification callback error: {e}")
+            for _ in batch:
+                self._queue.task_done()
+
+        # 超過期限仍未送出的訊息
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self.dropped += 1
+            self._queue.task_done()
+        if self.dropped:
+            self.logger.warning(f"{self.dropped} LINE notification(s) not sent before exit")
+
+    def flush(self, timeout=5.0):
+        """
+        Wait until every queued message has been handled.
+
+        Args:
+            timeout (float): Maximum wait (seconds)
+
+        Returns:
+            bool: True if the queue drained in time
+        """
+        end = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= end:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=5.0):
+        """
+        Stop accepting messages and send what is queued, within a deadline.
+
+        Args:
+            timeout (float): Deadline for sending the remaining messages (seconds)
+
+        Returns:
+            bool: True if everything was handled before the deadline
+        """
+        self._deadline = time.monotonic() + timeout
+        self._closing.set()
+        worker = self._worker
+        if worker is not None:
+            worker.join(timeout + 0.5)
+        return not self._queue.unfinished_tasks
+
+
+def create_notification_queue(notifier, config):
+    """
+    Build a NotificationQueue from the configuration.
+
+    Args:
+        notifier (LineNotifier): Notifier used to push messages
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+
+    Returns:
+        NotificationQueue: Queue in front of the notifier
+    """
+    return NotificationQueue(
+        notifier,
+        retries=config.get("notify_retries", 3),
+        backoff=config.get("notify_backoff", 1.0),
+        coalesce_window=config.get("notify_coalesce_window", 2.0),
+    )
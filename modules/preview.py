@@ -0,0 +1,97 @@
+"""
+Preview hand-off between the scanning thread and the GUI.
+
+The worker crops and downsizes matched regions itself and publishes them
+into a ``PreviewSlot``. The GUI takes only the newest thumbnail per label at
+a capped frame rate; anything older is overwritten and dropped, never queued.
+"""
+
+import time
+import threading
+
+import cv2
+import numpy as np
+
+from .capture import convert_order, order_of
+
+
+def make_thumbnail(image, rect=None, size=100, order=None):
+    """
+    Crop a region and shrink it to fit a square box, as contiguous RGB.
+
+    Args:
+        image (np.ndarray): BGR image (or the order given)
+        rect (tuple, optional): (x, y, w, h) to crop; the whole image if omitted
+        size (int): Longest side of the thumbnail
+        order (str, optional): Channel order of the image; guessed if omitted
+
+    Returns:
+        np.ndarray: RGB thumbnail
+    """
+    if rect is not None:
+        x, y, w, h = rect
+        image = image[max(0, y):y + h, max(0, x):x + w]
+
+    h, w = image.shape[:2]
+    scale = min(1.0, size / max(h, w))
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    order = order or order_of(image)
+    if order == "rgb":
+        return np.ascontiguousarray(image)
+    return convert_order(image, order, "rgb")
+
+
+class PreviewSlot:
+    """
+    Latest-value-wins slot of preview thumbnails, keyed by label name.
+    """
+    def __init__(self, max_fps=5, size=100):
+        """
+        Args:
+            max_fps (float): Maximum thumbnails per second per label
+            size (int): Longest side of the thumbnails
+        """
+        self.min_period = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.size = size
+        self._lock = threading.Lock()
+        self._items = {}
+        self._published = {}
+        self.dropped = 0
+
+    def wants(self, name):
+        """
+        Whether a new thumbnail for this label would be shown (rate limit).
+        """
+        return time.monotonic() - self._published.get(name, 0.0) >= self.min_period
+
+    def publish(self, name, image, rect=None, order=None):
+        """
+        Crop, shrink and store a thumbnail, replacing any that was not shown yet.
+
+        Args:
+            name (str): Label name
+            image (np.ndarray): BGR image (or the order given)
+            rect (tuple, optional): (x, y, w, h) to crop
+            order (str, optional): Channel order of the image
+        """
+        if not self.wants(name):
+            return
+        thumbnail = make_thumbnail(image, rect, self.size, order)
+        with self._lock:
+            if name in self._items:
+                self.dropped += 1
+            self._items[name] = thumbnail
+            self._published[name] = time.monotonic()
+
+    def take(self):
+        """
+        Take the newest thumbnails (called by the GUI).
+
+        Returns:
+            dict: name -> RGB thumbnail
+        """
+        with self._lock:
+            items, self._items = self._items, {}
+        return items
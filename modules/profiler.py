@@ -0,0 +1,207 @@
+"""
+Profiling mode for the scanning thread.
+
+Two profilers are available:
+
+- ``sampling`` (default): a background thread samples the stacks of the
+  scanning thread and its match workers every few milliseconds. Each stack is
+  prefixed with the ``_process_action`` stage running at that moment, and the
+  result is written as collapsed stacks (flamegraph.pl / speedscope format).
+- ``cprofile``: deterministic cProfile of the scanning thread, written as a
+  ``.prof`` file (pstats / snakeviz).
+
+Both log a top-N summary when stopped.
+"""
+
+import os
+import io
+import sys
+import time
+import pstats
+import signal
+import logging
+import cProfile
+import threading
+from collections import Counter
+from datetime import datetime
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Periodically samples the stacks of selected threads.
+    """
+    def __init__(self, thread_id, interval=0.005, stage_of=None, worker_prefix="match", max_depth=64):
+        """
+        Args:
+            thread_id (int): Ident of the scanning thread
+            interval (float): Seconds between samples
+            stage_of (callable, optional): stage_of(thread_id) -> current stage name or None
+            worker_prefix (str): Name prefix of helper threads that are sampled too
+            max_depth (int): Frames kept per stack
+        """
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stage_of = stage_of
+        self.worker_prefix = worker_prefix
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._targets = {thread_id}
+        self._targets_checked = 0.0
+
+    def _refresh_targets(self):
+        now = time.monotonic()
+        if now - self._targets_checked >= 1.0:
+            self._targets = {self.thread_id} | {
+                t.ident for t in threading.enumerate() if t.name.startswith(self.worker_prefix)
+            }
+            self._targets_checked = now
+
+    def _sample(self):
+        self._refresh_targets()
+        frames = sys._current_frames()
+        for thread_id in self._targets:
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stage = self.stage_of(thread_id) if self.stage_of else None
+            if stage is None and thread_id != self.thread_id:
+                # 閒置的比對執行緒不計入
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            if stage:
+                stack.insert(0, f"stage:{stage}")
+            self.stacks[";".join(stack)] += 1
+        self.samples += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+
+    def write(self, path):
+        """
+        Write collapsed stacks ("frame;frame;frame count" per line).
+
+        Returns:
+            str: Output path
+        """
+        path += ".folded"
+        with open(path, "w", encoding="utf-8") as output_file:
+            for stack, count in self.stacks.most_common():
+                output_file.write(f"{stack} {count}\n")
+        return path
+
+    def summary(self, top=15):
+        """
+        Returns:
+            list: Summary lines (self time per function and time per stage)
+        """
+        total = sum(self.stacks.values()) or 1
+        self_counts = Counter()
+        stage_counts = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            self_counts[frames[-1]] += count
+            if frames[0].startswith("stage:"):
+                stage_counts[frames[0][6:]] += count
+
+        lines = [f"{self.samples} samples, {total} stacks"]
+        lines += [f"  stage {stage}: {count / total:.1%}" for stage, count in stage_counts.most_common()]
+        lines += [f"  {count / total:6.1%}  {label}" for label, count in self_counts.most_common(top)]
+        return lines
+
+
+class CProfileSession:
+    """
+    cProfile of the thread that calls start() and stop().
+    """
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path):
+        path += ".prof"
+        self.profile.dump_stats(path)
+        return path
+
+    def summary(self, top=15):
+        stream = io.StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats("cumulative").print_stats(top)
+        return [line for line in stream.getvalue().splitlines() if line.strip()]
+
+
+def create_profiler(mode, thread_id, interval=0.005, stage_of=None):
+    """
+    Create a profiler session for the scanning thread.
+
+    Args:
+        mode (str): "sampling" or "cprofile"
+        thread_id (int): Ident of the scanning thread
+        interval (float): Sampling interval (sampling mode)
+        stage_of (callable, optional): stage_of(thread_id) -> current stage name
+
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    if mode == "sampling":
+        return SamplingProfiler(thread_id, interval=interval, stage_of=stage_of)
+    if mode == "cprofile":
+        return CProfileSession()
+    raise ValueError(f"Unknown profiler: {mode}")
+
+
+def profile_path(directory):
+    """
+    Base path (without extension) for a new profile file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, datetime.now().strftime("profile_%Y%m%d_%H%M%S"))
+
+
+def install_signal_toggle(get_wizard):
+    """
+    Toggle profiling with SIGUSR1 (POSIX only).
+
+    Args:
+        get_wizard (callable): Returns the running KeyWizard or None
+
+    Returns:
+        bool: True if the handler was installed
+    """
+    if not hasattr(signal, "SIGUSR1"):
+        return False
+
+    def handler(signum, frame):
+        wizard = get_wizard()
+        if wizard is not None:
+            wizard.toggle_profiling()
+
+    signal.signal(signal.SIGUSR1, handler)
+    logging.getLogger('key_wizard').info("Send SIGUSR1 to toggle profiling")
+    return True
@@ -0,0 +1,442 @@
+"""
+Session recorder: the frames KeyWizard analysed, with its decisions.
+
+A recording is one append-only file (``.bsrec``). Frames are stored as
+zlib-compressed keyframes every ``record_keyframe_interval`` frames and
+otherwise as the tiles that differ from the previously written frame, so
+a static screen costs a few dozen bytes per frame. The match results and
+the rule that fired are stored as a JSON event after each frame.
+
+The scan thread only copies the frame into one of a few preallocated
+slots; diffing, compression and writing happen on a background thread.
+When the writer falls behind, frames are dropped (and counted) instead of
+slowing the scan down; the next written frame is diffed against the last
+written one, so the file stays consistent.
+
+SessionReader memory-maps a recording, indexes its records and rebuilds
+any frame from the nearest keyframe. ReplayCapture accepts a recording as
+``capture_source``, so a session can be re-run through another matcher or
+configuration (``python -m modules.benchmark --source session.bsrec``
+scores the new clicks against the recorded ones).
+
+File layout (little-endian): an 8-byte magic and a u32 version, then
+records of a RECORD header (kind, channel order, payload length, frame
+index, timestamp) followed by the payload.
+"""
+
+import os
+import mmap
+import json
+import time
+import zlib
+import queue
+import struct
+import logging
+import threading
+from datetime import datetime
+
+import numpy as np
+
+MAGIC = b"BSREC\x00\x00\x01"
+VERSION = 1
+RECORDING_EXTENSION = ".bsrec"
+
+FILE_HEADER = struct.Struct("<8sI")
+# kind, 色彩排列, 保留, payload 長度, 畫面編號, 時間
+RECORD = struct.Struct("<BBHIqd")
+# 高, 寬, 通道數
+KEYFRAME = struct.Struct("<HHB")
+# 高, 寬, 通道數, tile 大小, tile 數
+DELTA = struct.Struct("<HHBHI")
+
+KEYFRAME_RECORD = 1
+DELTA_RECORD = 2
+EVENT_RECORD = 3
+META_RECORD = 4
+
+ORDERS = ("bgr", "bgra", "rgb", "gray")
+
+
+def is_recording(path):
+    """
+    Whether a path is a session recording (by extension).
+    """
+    return bool(path) and path.lower().endswith(RECORDING_EXTENSION) and os.path.isfile(path)
+
+
+def _json_default(value):
+    # numpy 數值轉成 Python 數值
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+def tile_grid(shape, tile_size):
+    return -(-shape[0] // tile_size), -(-shape[1] // tile_size)
+
+
+class SessionRecorder:
+    """
+    Writes analysed frames and events to a recording on a background thread.
+    """
+    def __init__(self, path, keyframe_interval=300, tile_size=64, compression=1, max_pending=4, meta=None):
+        """
+        Args:
+            path (str): Recording file to create
+            keyframe_interval (int): Frames between keyframes
+            tile_size (int): Tile size of deltas (pixels)
+            compression (int): zlib level (1 = fastest)
+            max_pending (int): Frames waiting for the writer; further frames are dropped
+            meta (dict, optional): Session information stored at the start (origin, config, ...)
+        """
+        self.path = path
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.tile_size = max(8, tile_size)
+        self.compression = compression
+        self.max_pending = max(1, max_pending)
+        self.logger = logging.getLogger('key_wizard')
+
+        # 統計
+        self.frames = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.dropped = 0
+        self.bytes_written = FILE_HEADER.size
+
+        self._file = open(path, "wb")
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION))
+        self._write(META_RECORD, 0, 0, time.time(), json.dumps(meta or {}, default=_json_default).encode("utf-8"))
+
+        self._queue = queue.Queue()
+        self._free = []  # 可重複使用的畫面複本
+        self._slots = 0
+        self._slots_lock = threading.Lock()
+        self._previous = None
+        self._previous_order = None
+        self._since_keyframe = 0
+        self._padded = None
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._worker.start()
+
+    def _slot(self, image):
+        with self._slots_lock:
+            while self._free:
+                slot = self._free.pop()
+                if slot.shape == image.shape:
+                    return slot
+                self._slots -= 1
+            if self._slots >= self.max_pending:
+                return None
+            self._slots += 1
+        return np.empty(image.shape, np.uint8)
+
+    def _release(self, slot):
+        with self._slots_lock:
+            self._free.append(slot)
+
+    def record(self, frame, event=None):
+        """
+        Queue a frame (and the event describing what was done with it).
+
+        Only copies the pixels; never waits for the writer.
+
+        Args:
+            frame (Frame): Analysed frame
+            event (dict, optional): JSON-serialisable results/actions of this frame
+
+        Returns:
+            bool: False if the frame was dropped
+        """
+        if self._closed:
+            return False
+        slot = self._slot(frame.image)
+        if slot is None:
+            self.dropped += 1
+            return False
+        np.copyto(slot, frame.image)
+        self._queue.put((slot, frame.index, frame.timestamp, frame.order, event))
+        return True
+
+    def _write(self, kind, order, index, timestamp, *parts):
+        length = sum(len(part) for part in parts)
+        self._file.write(RECORD.pack(kind, order, 0, length, index, timestamp))
+        for part in parts:
+            self._file.write(part)
+        self.bytes_written += RECORD.size + length
+
+    def _changed_tiles(self, image):
+        """
+        Tiles that differ from the previous written frame (exact comparison).
+
+        Returns:
+            np.ndarray: (row, column) of every changed tile
+        """
+        t = self.tile_size
+        h, w = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        ny, nx = tile_grid(image.shape, t)
+        # 通道攤平成一列 (h, w * c)，補齊成整數個 tile 後一次比較
+        if self._padded is None or self._padded.shape != (ny * t, nx * t * channels):
+            self._padded = np.zeros((ny * t, nx * t * channels), np.uint8)
+        diff = self._padded
+        np.not_equal(image.reshape(h, w * channels), self._previous.reshape(h, w * channels),
+                     out=diff[:h, :w * channels].view(bool))
+        grid = diff.reshape(ny, t, nx, t * channels).any(axis=(1, 3))
+        return np.argwhere(grid)
+
+    def _write_frame(self, image, index, timestamp, order):
+        code = ORDERS.index(order) if order in ORDERS else 0
+        h, w = image.shape[:2]
+        channels = image.shape[2] if image.ndim == 3 else 1
+        keyframe = (self._previous is None or self._previous.shape != image.shape
+                    or self._previous_order != order or self._since_keyframe >= self.keyframe_interval)
+
+        if not keyframe:
+            tiles = self._changed_tiles(image)
+            ny, nx = tile_grid(image.shape, self.tile_size)
+            # 變化超過一半時改存完整畫面
+            keyframe = len(tiles) * 2 > ny * nx
+
+        if keyframe:
+            data = zlib.compress(np.ascontiguousarray(image).data, self.compression)
+            self._write(KEYFRAME_RECORD, code, index, timestamp, KEYFRAME.pack(h, w, channels), data)
+            self.keyframes += 1
+            self._since_keyframe = 1
+        else:
+            t = self.tile_size
+            pixels = b"".join(image[r * t:(r + 1) * t, c * t:(c + 1) * t].tobytes() for r, c in tiles)
+            self._write(DELTA_RECORD, code, index, timestamp, DELTA.pack(h, w, channels, t, len(tiles)),
+                        tiles.astype("<u2").tobytes(), zlib.compress(pixels, self.compression))
+            self.deltas += 1
+            self._since_keyframe += 1
+
+        if self._previous is None or self._previous.shape != image.shape:
+            self._previous = np.empty_like(image)
+        np.copyto(self._previous, image)
+        self._previous_order = order
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            slot, index, timestamp, order, event = item
+            try:
+                self._write_frame(slot, index, timestamp, order)
+                if event is not None:
+                    data = json.dumps(event, default=_json_default).encode("utf-8")
+                    self._write(EVENT_RECORD, 0, index, timestamp, data)
+                self.frames += 1
+            except Exception as e:
+                self.logger.error(f"Error recording frame {index}: {str(e)}")
+            finally:
+                self._release(slot)
+
+    def close(self, timeout=10.0):
+        """
+        Write the queued frames (within a deadline) and close the file.
+
+        Returns:
+            bool: True if every queued frame was written
+        """
+        if self._closed:
+            return True
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout)
+        finished = not self._worker.is_alive()
+        if finished:
+            self._file.close()
+        self.logger.info(
+            f"Recorded {self.frames} frames to {self.path} "
+            f"({self.keyframes} keyframes, {self.deltas} deltas, {self.dropped} dropped, "
+            f"{self.bytes_written / (1024 * 1024):.1f} MB)"
+        )
+        return finished
+
+
+class SessionReader:
+    """
+    Random access to the frames and events of a recording (memory-mapped).
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Recording file
+
+        Raises:
+            IOError: If the file is not a recording
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            self._file.close()
+            raise IOError(f"Not a session recording: {path}")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = FILE_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise IOError(f"Not a session recording (or unsupported version): {path}")
+
+        self.meta = {}
+        self._shape = None
+        self._frames = []  # (kind, 色彩排列, payload 位置, 長度, 畫面編號, 時間)
+        self._events = {}  # 畫面位置 -> 事件
+        self._index()
+        self._image = None  # 目前重建到的畫面
+        self._position = None
+
+    def _index(self):
+        """
+        Read every record header; a record cut off by a crash ends the recording.
+        """
+        offset = FILE_HEADER.size
+        size = len(self._map)
+        while offset + RECORD.size <= size:
+            kind, order, _, length, index, timestamp = RECORD.unpack_from(self._map, offset)
+            start = offset + RECORD.size
+            if start + length > size:
+                break
+            if kind in (KEYFRAME_RECORD, DELTA_RECORD):
+                if self._shape is None:
+                    self._shape = KEYFRAME.unpack_from(self._map, start)[:2]
+                self._frames.append((kind, order, start, length, index, timestamp))
+            elif kind == EVENT_RECORD and self._frames:
+                self._events[len(self._frames) - 1] = json.loads(bytes(self._map[start:start + length]))
+            elif kind == META_RECORD:
+                self.meta = json.loads(bytes(self._map[start:start + length]))
+            offset = start + length
+
+    def __len__(self):
+        return len(self._frames)
+
+    @property
+    def order(self):
+        return ORDERS[self._frames[0][1]] if self._frames else "bgr"
+
+    def frame_shape(self):
+        return self._shape
+
+    def info(self, position):
+        """
+        Returns:
+            dict: index, timestamp, channel order and keyframe flag of a frame
+        """
+        kind, order, _, _, index, timestamp = self._frames[position]
+        return {"index": index, "timestamp": timestamp, "order": ORDERS[order], "keyframe": kind == KEYFRAME_RECORD}
+
+    def event(self, position):
+        """
+        Returns:
+            dict or None: Results and actions recorded with a frame
+        """
+        return self._events.get(position)
+
+    def _apply(self, position):
+        kind, _, start, length, _, _ = self._frames[position]
+        if kind == KEYFRAME_RECORD:
+            h, w, channels = KEYFRAME.unpack_from(self._map, start)
+            shape = (h, w, channels) if channels > 1 else (h, w)
+            data = zlib.decompress(self._map[start + KEYFRAME.size:start + length])
+            if self._image is None or self._image.shape != shape:
+                self._image = np.empty(shape, np.uint8)
+            self._image[...] = np.frombuffer(data, np.uint8).reshape(shape)
+            return
+
+        h, w, channels, t, count = DELTA.unpack_from(self._map, start)
+        offset = start + DELTA.size
+        tiles = np.frombuffer(self._map, "<u2", count * 2, offset).reshape(count, 2)
+        offset += count * 4
+        data = zlib.decompress(self._map[offset:start + length])
+        position = 0
+        for r, c in tiles:
+            y, x = int(r) * t, int(c) * t
+            tile = self._image[y:y + t, x:x + t]
+            tile[...] = np.frombuffer(data, np.uint8, tile.size, position).reshape(tile.shape)
+            position += tile.size
+
+    def frame(self, position):
+        """
+        Rebuild one frame: the nearest keyframe plus the deltas after it.
+
+        Reading frames in order only applies one record per frame.
+
+        Args:
+            position (int): Frame position (0 = first recorded frame)
+
+        Returns:
+            np.ndarray: The frame, valid until the next call
+        """
+        if not 0 <= position < len(self._frames):
+            raise IndexError(f"Frame {position} not in recording ({len(self._frames)} frames)")
+        start = position
+        while self._frames[start][0] != KEYFRAME_RECORD:
+            start -= 1
+        if self._position is not None and start <= self._position <= position:
+            # 從目前重建到的畫面繼續套用
+            start = self._position + 1
+        for current in range(start, position + 1):
+            self._apply(current)
+        self._position = position
+        return self._image
+
+    def actions(self):
+        """
+        Positions acted on per frame (click and press rules), as the benchmark's expected clicks.
+
+        Returns:
+            list: [(x, y), ...] for every frame
+        """
+        clicks = []
+        for position in range(len(self._frames)):
+            event = self._events.get(position) or {}
+            if event.get("action") in ("click", "press") and event.get("positions"):
+                clicks.append([tuple(p[:2]) for p in event["positions"]])
+            else:
+                clicks.append([])
+        return clicks
+
+    def close(self):
+        if getattr(self, "_map", None) is not None:
+            self._image = None
+            self._position = None
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+def create_session_recorder(config, script_dir, meta=None):
+    """
+    Start a recording if record_sessions is on.
+
+    Args:
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+        script_dir (str): Program directory (default location of the recordings)
+        meta (dict, optional): Session information stored in the recording
+
+    Returns:
+        SessionRecorder or None: None when recording is off or the file cannot be created
+    """
+    if not config.get("record_sessions", False):
+        return None
+    directory = config.get("record_dir") or os.path.join(script_dir, "recordings")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, datetime.now().strftime("session_%Y%m%d_%H%M%S") + RECORDING_EXTENSION)
+        recorder = SessionRecorder(
+            path,
+            keyframe_interval=config.get("record_keyframe_interval", 300),
+            tile_size=config.get("record_tile_size", 64),
+            compression=config.get("record_compression", 1),
+            max_pending=config.get("record_queue_size", 4),
+            meta=meta,
+        )
+    except OSError as e:
+        logging.getLogger('key_wizard').error(f"Cannot start session recording: {str(e)}")
+        return None
+    logging.getLogger('key_wizard').info(f"Recording session to {path}")
+    return recorder
@@ -0,0 +1,239 @@
+"""
+Region-of-interest tracking for template checks.
+
+Each template gets a ``RegionTracker`` that decides which part of the frame
+to search:
+
+1. a base region: a static rectangle from config, the bounds of a named
+   window, or the whole frame;
+2. an adaptive window centred on the last match. When the window misses,
+   the base region is searched in the same cycle, so a template that moved
+   is still found; the window is dropped after ``max_misses`` misses.
+"""
+
+import time
+import logging
+
+
+def _intersect(a, b):
+    """
+    Intersect two (x, y, w, h) rectangles.
+
+    Returns:
+        tuple or None: Intersection, or None if the rectangles do not overlap
+    """
+    x0 = max(a[0], b[0])
+    y0 = max(a[1], b[1])
+    x1 = min(a[0] + a[2], b[0] + b[2])
+    y1 = min(a[1] + a[3], b[1] + b[3])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def _contains(outer, inner):
+    """
+    Check whether the (x, y, w, h) rectangle ``inner`` lies inside ``outer``.
+    """
+    return (outer[0] <= inner[0] and outer[1] <= inner[1]
+            and inner[0] + inner[2] <= outer[0] + outer[2]
+            and inner[1] + inner[3] <= outer[1] + outer[3])
+
+
+def result_region(region, rect, fallback=None):
+    """
+    Region whose content decided the result of a search.
+
+    Args:
+        region (tuple): Region that was searched first
+        rect (tuple or None): (x, y, w, h) of the best match, None if not found
+        fallback (tuple, optional): Base region searched when ``region`` had no match
+
+    Returns:
+        tuple: ``region``, or ``fallback`` if the search went on to the base region
+    """
+    if fallback is not None and (rect is None or not _contains(region, rect)):
+        return fallback
+    return region
+
+
+def find_window_region(title):
+    """
+    Get the screen bounds of the first window whose title contains ``title``.
+
+    Args:
+        title (str): Window title (substring)
+
+    Returns:
+        tuple or None: (x, y, w, h) in screen coordinates, None if not found
+            or the platform has no window lookup
+    """
+    try:
+        import pyautogui
+        windows = pyautogui.getWindowsWithTitle(title)
+    except Exception:
+        return None
+
+    for window in windows:
+        if window.width > 0 and window.height > 0:
+            return (window.left, window.top, window.width, window.height)
+    return None
+
+
+class RegionTracker:
+    """
+    Chooses the search region for one template and counts how much scanning it saved.
+    """
+    def __init__(self, name, static_region=None, window_title=None, adaptive=True,
+                 margin=40, max_misses=3, window_refresh=2.0):
+        """
+        Args:
+            name (str): Template name
+            static_region (tuple, optional): (x, y, w, h) in screen coordinates
+            window_title (str, optional): Restrict the search to this window
+            adaptive (bool): Search around the last match first
+            margin (int): Pixels added around the last match
+            max_misses (int): Misses before the adaptive window is dropped
+            window_refresh (float): Seconds between window-bounds lookups
+        """
+        self.name = name
+        self.static_region = tuple(static_region) if static_region else None
+        self.window_title = window_title
+        self.adaptive = adaptive
+        self.margin = margin
+        self.max_misses = max_misses
+        self.window_refresh = window_refresh
+
+        self.last_rect = None  # 上次命中的位置 (畫面座標)
+        self.misses = 0
+        self._window_region = None
+        self._window_checked = 0.0
+
+        # 統計
+        self.hits = 0
+        self.miss_count = 0
+        self.full_scans = 0
+        self.pixels_scanned = 0
+        self.pixels_total = 0
+
+        self.logger = logging.getLogger('key_wizard')
+
+    def _base_region(self, frame):
+        """
+        Static / window region in frame coordinates, or the whole frame.
+        """
+        full = (0, 0, frame.width, frame.height)
+        region = self.static_region
+
+        if self.window_title:
+            now = time.time()
+            if now - self._window_checked >= self.window_refresh:
+                self._window_region = find_window_region(self.window_title)
+                self._window_checked = now
+            region = self._window_region or region
+
+        if region is None:
+            return full
+
+        ox, oy = frame.origin
+        region = (region[0] - ox, region[1] - oy, region[2], region[3])
+        return _intersect(region, full) or full
+
+    def search_region(self, frame, template_size):
+        """
+        Region of the frame to search in this cycle.
+
+        Args:
+            frame (Frame): Current frame
+            template_size (tuple): (w, h) of the template
+
+        Returns:
+            tuple: (region, fallback); region is (x, y, w, h) in frame coordinates,
+                fallback is the base region to search in the same cycle if nothing
+                is found in a narrowed region (None when region is the base region)
+        """
+        base = self._base_region(frame)
+
+        if self.adaptive and self.last_rect is not None:
+            x, y, w, h = self.last_rect
+            window = (x - self.margin, y - self.margin, w + 2 * self.margin, h + 2 * self.margin)
+            region = _intersect(window, base)
+            if (region is not None and region != base
+                    and region[2] >= template_size[0] and region[3] >= template_size[1]):
+                return region, base
+
+        return base, None
+
+    def record(self, frame, region, rect, fallback=None):
+        """
+        Record the outcome of a check.
+
+        Args:
+            frame (Frame): Frame that was searched
+            region (tuple): Region that was searched first
+            rect (tuple or None): (x, y, w, h) of the match in frame coordinates
+            fallback (tuple, optional): Base region searched when ``region`` had no match
+        """
+        searched = [region]
+        if result_region(region, rect, fallback) is not region:
+            # 縮小範圍落空，同一輪又搜尋了整個基本範圍
+            searched.append(fallback)
+        total = frame.width * frame.height
+        for area in (r[2] * r[3] for r in searched):
+            self.pixels_scanned += area
+            if area >= total:
+                self.full_scans += 1
+        self.pixels_total += total
+
+        if rect is not None:
+            self.hits += 1
+            self.last_rect = rect
+            self.misses = 0
+            return
+
+        self.miss_count += 1
+        if self.last_rect is not None:
+            self.misses += 1
+            if self.misses >= self.max_misses:
+                # 連續落空，之後直接搜尋基本範圍
+                self.last_rect = None
+                self.misses = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss counters and the share of pixels not scanned
+        """
+        saved = 1.0 - self.pixels_scanned / self.pixels_total if self.pixels_total else 0.0
+        return {
+            "hits": self.hits,
+            "misses": self.miss_count,
+            "full_scans": self.full_scans,
+            "saved_ratio": saved,
+        }
+
+
+def create_region_trackers(config, names):
+    """
+    Build one RegionTracker per template name from the configuration.
+
+    Args:
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+        names (iterable): Template names
+
+    Returns:
+        dict: name -> RegionTracker
+    """
+    regions = config.get("roi_regions") or {}
+    windows = config.get("roi_windows") or {}
+    return {
+        name: RegionTracker(
+            name,
+            static_region=regions.get(name),
+            window_title=windows.get(name),
+            adaptive=config.get("roi_adaptive", True),
+            margin=config.get("roi_margin", 40),
+            max_misses=config.get("roi_max_misses", 3),
+        )
+        for name in names
+    }
@@ -0,0 +1,264 @@
+"""
+Declarative detection rules.
+
+A rule names a template, where to look for it, the score threshold, a
+priority and the action to take when it is found. ``requires`` lists other
+rules whose templates must be visible in the same frame, e.g. the button is
+only pressed while the target text is shown.
+
+``compile_rules`` turns a rule set into an ``EvaluationPlan``: identical
+checks are merged, checks are submitted in the order the highest-priority
+rules need them, and evaluation stops at the first rule that fires.
+"""
+
+import os
+import json
+
+# stop: 停止精靈 / click: 點擊命中位置 / press: 按下按鈕 (直接點擊或輸入文字模式) / none: 只作為其他規則的條件
+ACTIONS = ("stop", "click", "press", "none")
+# 比對用的色彩格式
+COLORS = ("bgr", "gray")
+# 多個命中時的執行順序: score (分數高的先) / top (由上而下) / nearest (從游標位置依序找最近的)
+ORDERS = ("score", "top", "nearest")
+
+# 原本的四張圖片與判斷順序: 停止 > 核准 > 目標+按鈕
+DEFAULT_RULES = [
+    {"name": "stop", "template": "stop.png", "action": "stop", "priority": 30, "optional": True,
+     "reason": "偵測到停止圖片"},
+    {"name": "approved", "template": "approved.png", "action": "click", "priority": 20, "optional": True},
+    {"name": "target", "template": "keep.png", "action": "none"},
+    {"name": "button", "template": "btn.png", "action": "press", "priority": 10, "requires": ["target"]},
+]
+
+
+class RuleError(ValueError):
+    """
+    Raised when a rule set is invalid.
+    """
+
+
+class Rule:
+    """
+    One template and what to do when it is found.
+    """
+    FIELDS = ("name", "template", "action", "priority", "threshold", "roi", "window",
+              "requires", "optional", "pause", "reason", "color", "scale", "max_hits", "order")
+
+    def __init__(self, name, template, action="click", priority=0, threshold=None, roi=None, window=None,
+                 requires=(), optional=False, pause=1.0, reason=None, color=None, scale=None, max_hits=None,
+                 order=None):
+        """
+        Args:
+            name (str): Unique rule name (also used for previews, ROI trackers and metrics)
+            template (str): Image file, relative to the template directory
+            action (str): One of ACTIONS
+            priority (int): Higher priorities are evaluated first
+            threshold (float, optional): Match threshold; the wizard's default if omitted
+            roi (list, optional): Fixed search region [x, y, w, h] in screen coordinates
+            window (str, optional): Only search inside the window with this title
+            requires (list): Rules whose templates must be visible in the same frame
+            optional (bool): Disable the rule instead of failing when the image is missing
+            pause (float): Wait after the action (seconds, scaled by input_pause_scale)
+            reason (str, optional): Stop reason for "stop" rules
+            color (str, optional): "bgr" or "gray" matching; the match_color setting if omitted
+            scale (int, optional): Downscale factor for matching; the match_scale setting if omitted
+            max_hits (int, optional): Act on up to this many occurrences per frame; the match_max_hits
+                setting if omitted
+            order (str, optional): One of ORDERS, the order in which occurrences are acted on;
+                the match_order setting if omitted
+        """
+        if action not in ACTIONS:
+            raise RuleError(f"Rule '{name}': unknown action '{action}'")
+        if color not in (None,) + COLORS:
+            raise RuleError(f"Rule '{name}': unknown color '{color}'")
+        if scale is not None and (not isinstance(scale, int) or scale < 1):
+            raise RuleError(f"Rule '{name}': scale must be a positive integer")
+        if max_hits is not None and (not isinstance(max_hits, int) or max_hits < 1):
+            raise RuleError(f"Rule '{name}': max_hits must be a positive integer")
+        if order not in (None,) + ORDERS:
+            raise RuleError(f"Rule '{name}': unknown order '{order}'")
+        self.name = name
+        self.template = template
+        self.action = action
+        self.priority = priority
+        self.threshold = threshold
+        self.roi = tuple(roi) if roi else None
+        self.window = window
+        self.requires = tuple(requires)
+        self.optional = optional
+        self.pause = pause
+        self.reason = reason
+        self.color = color
+        self.scale = scale
+        self.max_hits = max_hits
+        self.order = order
+
+    @classmethod
+    def from_dict(cls, data):
+        unknown = set(data) - set(cls.FIELDS)
+        if unknown:
+            raise RuleError(f"Rule '{data.get('name')}': unknown field(s) {', '.join(sorted(unknown))}")
+        if "name" not in data or "template" not in data:
+            raise RuleError(f"Rule needs 'name' and 'template': {data}")
+        return cls(**data)
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, {self.template!r}, action={self.action!r}, priority={self.priority})"
+
+
+class Check:
+    """
+    One template match shared by every rule that needs it.
+    """
+    def __init__(self, name, path, threshold, roi=None, window=None, color="bgr", scale=1, max_hits=1):
+        self.name = name
+        self.path = path
+        self.threshold = threshold
+        self.roi = roi
+        self.window = window
+        self.color = color
+        self.scale = scale
+        self.max_hits = max_hits
+        self.optional = True
+        self.template = None  # 轉成比對格式的圖片
+        self.size = None  # 原始圖片的 (寬, 高)
+
+    @property
+    def key(self):
+        return (self.path, self.threshold, self.roi, self.window, self.color, self.scale, self.max_hits)
+
+
+class EvaluationPlan:
+    """
+    Compiled rule set: checks in submission order and rules in priority order.
+    """
+    def __init__(self, rules, checks, check_of):
+        """
+        Args:
+            rules (list): Rules that act, highest priority first
+            checks (list): Deduplicated checks in submission order
+            check_of (dict): Rule name -> Check
+        """
+        self.rules = rules
+        self.checks = checks
+        self.check_of = check_of
+
+    def submissions(self):
+        """
+        Returns:
+            list: (name, template, threshold) of every loaded check, in priority order
+        """
+        return [(check.name, check.template, check.threshold) for check in self.checks if check.template is not None]
+
+    def evaluate(self, results):
+        """
+        Find the highest-priority rule that fires.
+
+        Checks are read lazily, so lower-priority checks are never waited
+        for once a rule fires, and a rule whose preconditions fail does not
+        read its own check.
+
+        Args:
+            results (MatchResults): Results of the submitted checks
+
+        Returns:
+            tuple: (rule, positions) or (None, None); positions holds every
+                occurrence found, best score first
+        """
+        for rule in self.rules:
+            if any(not results.get(self.check_of[name].name) for name in rule.requires):
+                continue
+            positions = results.get(self.check_of[rule.name].name)
+            if positions:
+                results.cancel()
+                return rule, positions
+        return None, None
+
+
+def load_rules(config, script_dir=None):
+    """
+    Read the rule set from the configuration.
+
+    ``rules`` (a list of rule objects) takes precedence over ``rules_file``
+    (a JSON file holding such a list); without either the default rules are used.
+
+    Args:
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+        script_dir (str, optional): Base directory for a relative rules_file
+
+    Returns:
+        list: Rule objects
+
+    Raises:
+        RuleError: If the rule set is invalid
+    """
+    data = config.get("rules")
+    if data is None and config.get("rules_file"):
+        path = config["rules_file"]
+        if script_dir and not os.path.isabs(path):
+            path = os.path.join(script_dir, path)
+        with open(path, "r", encoding="utf-8") as rules_file:
+            data = json.load(rules_file)
+        if isinstance(data, dict):
+            data = data.get("rules", [])
+    if data is None:
+        data = DEFAULT_RULES
+
+    rules = [Rule.from_dict(item) for item in data]
+    names = [rule.name for rule in rules]
+    if len(set(names)) != len(names):
+        raise RuleError("Rule names must be unique")
+    for rule in rules:
+        for name in rule.requires:
+            if name not in names:
+                raise RuleError(f"Rule '{rule.name}' requires unknown rule '{name}'")
+    return rules
+
+
+def compile_rules(rules, template_dir, default_threshold=0.8, default_color="bgr", default_scale=1,
+                  default_max_hits=1):
+    """
+    Compile rules into an evaluation plan.
+
+    Args:
+        rules (list): Rule objects
+        template_dir (str): Directory of the template images
+        default_threshold (float): Threshold of rules that do not set one
+        default_color (str): Matching color of rules that do not set one
+        default_scale (int): Matching downscale factor of rules that do not set one
+        default_max_hits (int): Occurrences per frame of acting rules that do not set max_hits
+
+    Returns:
+        EvaluationPlan: Plan for one scan cycle
+    """
+    by_name = {rule.name: rule for rule in rules}
+    # 依優先順序排列 (同優先順序依宣告順序)
+    acting = sorted((rule for rule in rules if rule.action != "none"), key=lambda rule: -rule.priority)
+
+    checks = []
+    by_key = {}
+    check_of = {}
+
+    def add(rule):
+        if rule.name in check_of:
+            return
+        threshold = rule.threshold if rule.threshold is not None else default_threshold
+        # 停止與只作為條件的規則找到一個就夠了
+        max_hits = rule.max_hits or (default_max_hits if rule.action in ("click", "press") else 1)
+        check = Check(
+            rule.name, os.path.join(template_dir, rule.template), threshold, rule.roi, rule.window,
+            color=rule.color or default_color, scale=rule.scale or default_scale, max_hits=max_hits,
+        )
+        # 相同圖片、範圍與門檻的比對只做一次
+        check = by_key.setdefault(check.key, check)
+        if check.name == rule.name:
+            checks.append(check)
+        check.optional = check.optional and rule.optional
+        check_of[rule.name] = check
+
+    for rule in acting:
+        for name in rule.requires:
+            add(by_name[name])
+        add(rule)
+
+    return EvaluationPlan(acting, checks, check_of)
@@ -0,0 +1,86 @@
+"""
+Adaptive scan scheduling for the scanning loop.
+
+The interval drops to ``min_interval`` right after an action or a screen
+change and backs off exponentially towards ``max_interval`` while the screen
+stays idle. A CPU budget puts a floor under the interval so that scanning
+never uses more than the configured share of CPU time.
+"""
+
+import threading
+
+
+class ScanScheduler:
+    """
+    Decides how long to wait between scan cycles and performs the wait.
+    """
+    def __init__(self, min_interval=0.1, max_interval=2.0, backoff=1.5, cpu_budget=0.25):
+        """
+        Args:
+            min_interval (float): Interval right after activity (seconds)
+            max_interval (float): Longest interval while idle (seconds)
+            backoff (float): Multiplier applied to the interval on every idle cycle
+            cpu_budget (float): Maximum share of CPU time per cycle (0-1, 0 = unlimited)
+        """
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = max(1.0, backoff)
+        self.cpu_budget = cpu_budget
+        self.interval = min_interval
+        self.stop_event = threading.Event()
+
+    def next_interval(self, active, cpu_time=0.0, wall_time=0.0):
+        """
+        Compute the wait before the next cycle.
+
+        Args:
+            active (bool): An action ran or the screen changed in this cycle
+            cpu_time (float): CPU seconds used by the cycle
+            wall_time (float): Wall-clock seconds the cycle took
+
+        Returns:
+            float: Seconds to wait
+        """
+        if active:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+        interval = self.interval
+        if self.cpu_budget > 0 and cpu_time > 0:
+            # cpu_time / (wall_time + interval) <= cpu_budget
+            interval = max(interval, cpu_time / self.cpu_budget - wall_time)
+        return interval
+
+    def wait(self, seconds):
+        """
+        Sleep until the timeout or until stop() is called.
+
+        Args:
+            seconds (float): Maximum time to wait
+
+        Returns:
+            bool: True if stopped while waiting
+        """
+        return self.stop_event.wait(max(0.0, seconds))
+
+    def stop(self):
+        self.stop_event.set()
+
+    def reset(self):
+        """
+        Return to the shortest interval at the start of a run.
+
+        A stop() that arrived before the run started is kept.
+        """
+        self.interval = self.min_interval
+
+    def rearm(self):
+        """
+        Clear the stop request once a run has ended, so the next run can wait again.
+        """
+        self.stop_event.clear()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
@@ -0,0 +1,479 @@
+"""
+Supervisor that runs one KeyWizard process per display.
+
+``python -m modules.supervisor`` starts a worker process for every entry of
+``supervisor_workers`` (an mss monitor, an X display such as an Xvfb
+session, or a screen region). The templates are decoded once and shared
+with the workers as read-only shared memory, worker logs are written by the
+supervisor, crashed workers are restarted with backoff, and the whole set
+is controlled from this one process:
+
+- SIGINT / SIGTERM: stop every worker and exit
+- SIGHUP: share the templates again and restart every worker (e.g. after
+  changing templates)
+- SIGUSR1: log the status of every worker
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+import logging.handlers
+
+from .config import load_config
+from .logger import ForwardingHandler
+from .rules import load_rules, compile_rules
+from .match_engine import default_workers
+from .template_cache import SharedTemplates
+
+# 工作行程結束代碼: 0 = 正常結束 (偵測到停止圖片、重播結束或收到停止要求)，其他 = 異常，會重新啟動
+EXIT_OK = 0
+EXIT_ERROR = 1
+
+
+def run_worker(name, config, shared_index, log_queue, stop_event, display=None, threads=None,
+               direct_click_mode=True, dry_run=False):
+    """
+    Worker process entry point: run one KeyWizard until it stops or the supervisor asks it to.
+
+    Args:
+        name (str): Worker name (prefixed to its log messages)
+        config (dict): Complete configuration of this worker
+        shared_index (dict): Shared templates (see SharedTemplates.publish)
+        log_queue (multiprocessing.Queue): Log records go to the supervisor through this queue
+        stop_event (multiprocessing.Event): Set by the supervisor to stop the worker
+        display (str, optional): X display to capture and click on, e.g. ":99"
+        threads (int, optional): OpenCV threads and match workers for this process
+        direct_click_mode (bool): Click the button directly instead of typing
+        dry_run (bool): Record input instead of sending it
+
+    Returns:
+        int: Process exit code
+    """
+    # Ctrl+C 由 supervisor 處理，工作行程只依 stop_event 停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if display:
+        # 必須在 mss / pyautogui 連線到 X 之前設定
+        os.environ["DISPLAY"] = display
+
+    from .logger import setup_worker_logging
+    setup_worker_logging(log_queue, name)
+    logger = logging.getLogger('key_wizard')
+
+    import cv2
+    from .key_wizard import KeyWizard
+    from .template_cache import create_template_cache
+
+    if threads:
+        cv2.setNumThreads(threads)
+    if config.get("fleet_coordinator") and not config.get("fleet_node_name"):
+        # 同一台電腦的各工作行程在協調器上分開顯示
+        config = dict(config, fleet_node_name=f"{socket.gethostname()}/{name}")
+
+    shared, blocks = SharedTemplates.attach(shared_index)
+    input_device = None
+    if dry_run:
+        from .benchmark import RecordingInput
+        input_device = RecordingInput()
+
+    try:
+        script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        wizard = KeyWizard(
+            direct_click_mode=direct_click_mode,
+            config=config,
+            input_device=input_device,
+            template_cache=create_template_cache(config, script_dir, shared),
+        )
+    except Exception as e:
+        logger.error(f"Failed to initialise worker: {str(e)}")
+        return EXIT_ERROR
+
+    finished = threading.Event()
+
+    def wait_for_stop():
+        stop_event.wait()
+        # start() 可能還在初始化，重複要求直到掃描迴圈結束
+        while not finished.is_set():
+            wizard.stop("supervisor 停止")
+            finished.wait(0.2)
+
+    threading.Thread(target=wait_for_stop, name="supervisor-stop", daemon=True).start()
+    try:
+        wizard.start()
+    finally:
+        finished.set()
+
+    if stop_event.is_set():
+        return EXIT_OK
+    if wizard.error or not wizard.frame_count:
+        return EXIT_ERROR
+    return EXIT_OK
+
+
+def _worker_main(*args, **kwargs):
+    sys.exit(run_worker(*args, **kwargs))
+
+
+class Worker:
+    """
+    One supervised worker process and its restart state.
+    """
+    def __init__(self, name, config, display=None, threads=None):
+        self.name = name
+        self.config = config
+        self.display = display
+        self.threads = threads
+        self.process = None
+        self.stop_event = None
+        self.enabled = True  # False 之後不再自動重新啟動
+        self.started_at = None
+        self.restarts = 0
+        self.crashes = 0  # 連續異常結束次數 (決定重新啟動的等待時間)
+        self.exitcode = None
+        self.restart_at = None
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def status(self):
+        """
+        Returns:
+            dict: name, pid, state, uptime, restarts and last exit code
+        """
+        if self.alive:
+            state = "running"
+        elif self.restart_at is not None:
+            state = "restarting"
+        elif self.exitcode is None:
+            state = "idle"
+        else:
+            state = "finished" if self.exitcode == EXIT_OK else "failed"
+        return {
+            "name": self.name,
+            "pid": self.process.pid if self.alive else None,
+            "state": state,
+            "display": self.display,
+            "uptime": time.monotonic() - self.started_at if self.alive and self.started_at else 0.0,
+            "restarts": self.restarts,
+            "exitcode": self.exitcode,
+        }
+
+
+def default_worker_specs():
+    """
+    One worker per physical monitor reported by mss.
+
+    Returns:
+        list: Worker specs
+
+    Raises:
+        ValueError: If mss is missing or no monitor is found
+    """
+    try:
+        import mss
+        with mss.mss() as sct:
+            count = len(sct.monitors) - 1
+    except Exception as e:
+        raise ValueError(f"supervisor_workers is empty and monitors cannot be listed: {str(e)}")
+    if count < 1:
+        raise ValueError("supervisor_workers is empty and no monitor was found")
+    return [{"name": f"monitor{index}", "capture_monitor": index} for index in range(1, count + 1)]
+
+
+class Supervisor:
+    """
+    Starts, watches and stops the worker processes.
+    """
+    def __init__(self, config, specs=None, direct_click_mode=True, dry_run=False):
+        """
+        Args:
+            config (dict): Base configuration shared by every worker
+            specs (list, optional): Worker specs; config["supervisor_workers"] if omitted.
+                Each spec has a "name", optionally a "display", and any
+                configuration overrides, e.g. {"name": "left", "capture_monitor": 2}
+            direct_click_mode (bool): Click the button directly instead of typing
+            dry_run (bool): Workers record input instead of sending it
+
+        Raises:
+            ValueError: If a spec has no name or two specs share one
+        """
+        self.config = config
+        self.direct_click_mode = direct_click_mode
+        self.dry_run = dry_run
+        self.restart_delay = config.get("supervisor_restart_delay", 1.0)
+        self.max_restart_delay = config.get("supervisor_max_restart_delay", 60.0)
+        self.script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.logger = logging.getLogger('key_wizard')
+
+        specs = specs if specs is not None else config.get("supervisor_workers") or default_worker_specs()
+        # 每個工作行程分到的執行緒數，避免多個行程同時搶用所有核心
+        threads = config.get("supervisor_threads") or max(1, (os.cpu_count() or 1) // len(specs))
+        self.workers = {}
+        for index, spec in enumerate(specs):
+            spec = dict(spec)
+            name = spec.pop("name", None)
+            if not name or name in self.workers:
+                raise ValueError(f"Worker specs need unique names: {name!r}")
+            display = spec.pop("display", None)
+            self.workers[name] = Worker(name, self._worker_config(name, index, spec, threads), display, threads)
+
+        self._context = multiprocessing.get_context("spawn")
+        self._shared = SharedTemplates()
+        self._log_queue = None
+        self._listener = None
+        self._stopping = False
+        self._restart_all = False
+        self._log_status = False
+
+    def _worker_config(self, name, index, overrides, threads):
+        config = dict(self.config)
+        config.update(overrides)
+        if "match_workers" not in overrides:
+            workers = config.get("match_workers")
+            config["match_workers"] = min(default_workers() if workers is None else workers, threads)
+        # 各工作行程的輸出不能互相覆蓋
+        if config.get("metrics_port") is not None and "metrics_port" not in overrides:
+            config["metrics_port"] = config["metrics_port"] + index
+        if config.get("metrics_snapshot_path") and "metrics_snapshot_path" not in overrides:
+            root, ext = os.path.splitext(config["metrics_snapshot_path"])
+            config["metrics_snapshot_path"] = f"{root}.{name}{ext}"
+        profile_dir = config.get("profile_dir") or os.path.join(self.script_dir, "profiles")
+        config["profile_dir"] = os.path.join(profile_dir, name)
+        return config
+
+    def _template_paths(self):
+        paths = set()
+        for worker in self.workers.values():
+            rules = load_rules(worker.config, self.script_dir)
+            template_dir = worker.config.get("template_dir") or self.script_dir
+            paths.update(check.path for check in compile_rules(rules, template_dir).checks)
+        return sorted(paths)
+
+    def start(self):
+        """
+        Share the templates and start every worker.
+        """
+        index = self._shared.publish(self._template_paths())
+        self.logger.info(
+            f"Supervisor sharing {len(index)} template(s) ({self._shared.nbytes / 1024:.0f} KB) "
+            f"with {len(self.workers)} worker(s)"
+        )
+        self._log_queue = self._context.Queue()
+        self._listener = logging.handlers.QueueListener(self._log_queue, ForwardingHandler())
+        self._listener.start()
+        for worker in self.workers.values():
+            self._spawn(worker)
+
+    def _spawn(self, worker):
+        worker.stop_event = self._context.Event()
+        worker.process = self._context.Process(
+            target=_worker_main,
+            name=f"btnsprite-{worker.name}",
+            args=(worker.name, worker.config, self._shared.index, self._log_queue, worker.stop_event),
+            kwargs={
+                "display": worker.display,
+                "threads": worker.threads,
+                "direct_click_mode": self.direct_click_mode,
+                "dry_run": self.dry_run,
+            },
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.restart_at = None
+        worker.enabled = True
+        self.logger.info(f"Worker {worker.name} started (pid {worker.process.pid})")
+
+    def _stop_process(self, worker, timeout=10.0):
+        if worker.process is None:
+            return
+        worker.stop_event.set()
+        worker.process.join(timeout)
+        if worker.process.is_alive():
+            self.logger.warning(f"Worker {worker.name} did not stop in {timeout:.0f}s, terminating")
+            worker.process.terminate()
+            worker.process.join(2.0)
+        worker.exitcode = worker.process.exitcode
+
+    def start_worker(self, name):
+        """
+        Start a stopped or finished worker.
+        """
+        worker = self.workers[name]
+        if not worker.alive:
+            self._spawn(worker)
+
+    def stop_worker(self, name, timeout=10.0):
+        """
+        Stop one worker without restarting it.
+        """
+        worker = self.workers[name]
+        worker.enabled = False
+        worker.restart_at = None
+        self._stop_process(worker, timeout)
+
+    def restart_worker(self, name, timeout=10.0):
+        """
+        Stop and start one worker.
+        """
+        self.stop_worker(name, timeout)
+        self.workers[name].restarts += 1
+        self._spawn(self.workers[name])
+
+    def restart_all(self, timeout=10.0):
+        """
+        Stop every worker, share the templates again and start the workers.
+
+        Templates are decoded and published anew, so changed or added
+        template files are picked up.
+        """
+        for name in self.workers:
+            self.stop_worker(name, timeout)
+        # 重新解碼模板: 舊的共享記憶體在所有 worker 結束後才釋放
+        self._shared.close()
+        index = self._shared.publish(self._template_paths())
+        self.logger.info(f"Supervisor sharing {len(index)} template(s) ({self._shared.nbytes / 1024:.0f} KB)")
+        for worker in self.workers.values():
+            worker.restarts += 1
+            self._spawn(worker)
+
+    def status(self):
+        """
+        Returns:
+            list: Status dict of every worker (see Worker.status)
+        """
+        return [worker.status() for worker in self.workers.values()]
+
+    def log_status(self):
+        for status in self.status():
+            self.logger.info(
+                f"Worker {status['name']}: {status['state']} pid={status['pid']} "
+                f"uptime={status['uptime']:.0f}s restarts={status['restarts']} exitcode={status['exitcode']}"
+            )
+
+    def poll(self):
+        """
+        Restart workers that crashed; called periodically by run().
+        """
+        now = time.monotonic()
+        for worker in self.workers.values():
+            if worker.process is None or worker.alive or not worker.enabled:
+                continue
+            if worker.restart_at is None:
+                worker.exitcode = worker.process.exitcode
+                if worker.exitcode == EXIT_OK:
+                    # 偵測到停止圖片或重播結束: 不再重新啟動
+                    self.logger.info(f"Worker {worker.name} finished")
+                    worker.enabled = False
+                    continue
+                # 執行夠久才算恢復正常，重新計算等待時間
+                if now - worker.started_at > self.max_restart_delay:
+                    worker.crashes = 0
+                delay = min(self.restart_delay * (2 ** worker.crashes), self.max_restart_delay)
+                worker.crashes += 1
+                worker.restart_at = now + delay
+                self.logger.warning(
+                    f"Worker {worker.name} exited with code {worker.exitcode}, restarting in {delay:.1f}s"
+                )
+            elif now >= worker.restart_at:
+                worker.restarts += 1
+                self._spawn(worker)
+
+    @property
+    def finished(self):
+        return not any(worker.alive or worker.enabled for worker in self.workers.values())
+
+    def run(self, poll_interval=0.5):
+        """
+        Start the workers and supervise them until stop() is called or all have finished.
+        """
+        self.start()
+        try:
+            while not self._stopping and not self.finished:
+                # 訊號處理函式只設定旗標，不能在這裡等待它們也會用到的鎖
+                time.sleep(poll_interval)
+                if self._stopping:
+                    break
+                if self._log_status:
+                    self._log_status = False
+                    self.log_status()
+                if self._restart_all:
+                    self._restart_all = False
+                    self.restart_all()
+                self.poll()
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        """
+        Ask run() to stop every worker and return (safe from signal handlers).
+        """
+        self._stopping = True
+
+    def request_restart(self):
+        self._restart_all = True
+
+    def request_status(self):
+        self._log_status = True
+
+    def shutdown(self, timeout=10.0):
+        """
+        Stop every worker, then release the shared templates and the log listener.
+        """
+        for worker in self.workers.values():
+            worker.enabled = False
+            if worker.stop_event is not None:
+                worker.stop_event.set()
+        for worker in self.workers.values():
+            self._stop_process(worker, timeout)
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        self._shared.close()
+        self.log_status()
+
+
+def install_control_signals(supervisor):
+    """
+    SIGINT/SIGTERM stop, SIGHUP restarts and SIGUSR1 logs the status of the workers.
+    """
+    signal.signal(signal.SIGINT, lambda signum, frame: supervisor.stop())
+    signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.stop())
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: supervisor.request_restart())
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: supervisor.request_status())
+
+
+def main(argv=None):
+    from .__main__ import parse_overrides
+
+    parser = argparse.ArgumentParser(prog="python -m modules.supervisor",
+                                     description="Run one btnSprite worker per display")
+    parser.add_argument("--config", help="config file (default: config.json in the program directory)")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="override a config value (repeatable)")
+    parser.add_argument("--typing-mode", action="store_true", help="type the text instead of clicking directly")
+    parser.add_argument("--dry-run", action="store_true", help="record clicks and keys instead of sending them")
+    args = parser.parse_args(argv)
+
+    logger = logging.getLogger('key_wizard')
+    config = load_config(args.config, parse_overrides(args.set))
+    try:
+        supervisor = Supervisor(config, direct_click_mode=not args.typing_mode, dry_run=args.dry_run)
+    except ValueError as e:
+        logger.error(f"Cannot start supervisor: {str(e)}")
+        return 1
+
+    install_control_signals(supervisor)
+    supervisor.run()
+    failed = [status for status in supervisor.status() if status["state"] == "failed"]
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""
+On-disk cache of preprocessed templates.
+
+Decoded templates and derived template data (grayscale copies, pyramid
+levels, FFT spectra, ...) are stored as ``.npy`` files keyed by the SHA-1
+of the template file, so replacing an image invalidates its entries
+automatically. An index maps each template path to its modification time,
+size and hash; while those match, a restart reads the decoded image from
+the cache instead of decoding and hashing the file again.
+
+``SharedTemplates`` lets a supervisor decode the templates once and hand
+them to its worker processes as read-only shared-memory views.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+
+import cv2
+import numpy as np
+
+# 前處理方式改變時遞增，讓舊的快取失效
+CACHE_VERSION = 1
+INDEX_FILE = f"index.v{CACHE_VERSION}.json"
+
+
+class TemplateCache:
+    """
+    Loads templates and caches data derived from them.
+    """
+    def __init__(self, directory=None, shared=None):
+        """
+        Args:
+            directory (str, optional): Cache folder; None keeps the cache in memory only
+            shared (dict, optional): Absolute path -> (image, digest) of templates
+                decoded by another process (see SharedTemplates.attach)
+        """
+        self.directory = directory
+        self.shared = shared or {}
+        self._digests = {}  # id(template) -> (template, digest)
+        self._memory = {}  # (digest, kind) -> array
+        self._index = None  # 絕對路徑 -> [mtime_ns, 檔案大小, digest]
+        self._index_changed = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.logger = logging.getLogger('key_wizard')
+
+    def load(self, path):
+        """
+        Read and decode a template, remembering its file hash.
+
+        A template whose modification time and size match the index is read
+        from the cache, without decoding or hashing the file.
+
+        Args:
+            path (str): Image path
+
+        Returns:
+            np.ndarray or None: BGR image, None if it cannot be read
+        """
+        path = os.path.abspath(path)
+        entry = self.shared.get(path)
+        if entry is not None:
+            # 由 supervisor 解碼並放在共享記憶體的模板，不再讀檔
+            image, digest = entry
+            with self._lock:
+                self._digests[id(image)] = (image, digest)
+            return image
+
+        stat = os.stat(path)
+        known = self._load_index().get(path) if self.directory else None
+        if known is not None and known[:2] == [stat.st_mtime_ns, stat.st_size]:
+            image = self._read_entry(known[2], "image")
+            if image is not None:
+                self.hits += 1
+                with self._lock:
+                    self._digests[id(image)] = (image, known[2])
+                return image
+
+        with open(path, "rb") as image_file:
+            data = image_file.read()
+        # 以 imdecode 解碼，檔案只讀一次 (也支援非 ASCII 路徑)
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if image is not None:
+            digest = hashlib.sha1(data).hexdigest()
+            with self._lock:
+                self._digests[id(image)] = (image, digest)
+            if self.directory:
+                self.misses += 1
+                self._store(digest, "image", image)
+                self._load_index()[path] = [stat.st_mtime_ns, stat.st_size, digest]
+                self._index_changed = True
+        return image
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            path = os.path.join(self.directory, INDEX_FILE)
+            if os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as index_file:
+                        self._index = json.load(index_file)
+                except (OSError, ValueError) as e:
+                    self.logger.warning(f"Ignoring unreadable template cache index {path}: {str(e)}")
+        return self._index
+
+    def save_index(self):
+        """
+        Write the path -> hash index after loading templates (only if it changed).
+        """
+        if not self.directory or not self._index_changed:
+            return
+        path = os.path.join(self.directory, INDEX_FILE)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as index_file:
+                json.dump(self._index, index_file)
+            os.replace(tmp_path, path)
+            self._index_changed = False
+        except OSError as e:
+            self.logger.warning(f"Failed to write template cache index {path}: {str(e)}")
+
+    def digest(self, template):
+        """
+        Returns:
+            str or None: File hash of a template returned by load()
+        """
+        entry = self._digests.get(id(template))
+        if entry is None or entry[0] is not template:
+            return None
+        return entry[1]
+
+    def _entry_path(self, digest, kind):
+        return os.path.join(self.directory, f"{digest}.{kind}.v{CACHE_VERSION}.npy")
+
+    def _read_entry(self, digest, kind):
+        if not self.directory:
+            return None
+        path = self._entry_path(digest, kind)
+        if not os.path.exists(path):
+            return None
+        try:
+            return np.load(path, allow_pickle=False)
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable template cache entry {path}: {str(e)}")
+            return None
+
+    def derived(self, template, kind, compute, keep=True):
+        """
+        Get data derived from a template, computing and storing it on a miss.
+
+        Args:
+            template (np.ndarray): Template returned by load()
+            kind (str): Name of the derived data, e.g. "pyr2" or "gray"
+            compute (callable): compute() -> np.ndarray
+            keep (bool): Also keep it in memory (False for large data the caller caches itself)
+
+        Returns:
+            np.ndarray: Derived data
+        """
+        digest = self.digest(template)
+        if digest is None:
+            return compute()
+
+        key = (digest, kind)
+        array = self._memory.get(key)
+        if array is not None:
+            self.hits += 1
+            return array
+
+        array = self._read_entry(digest, kind)
+        if array is None:
+            self.misses += 1
+            array = compute()
+            self._store(digest, kind, array)
+        else:
+            self.hits += 1
+
+        if not keep:
+            return array
+        self._memory[key] = array
+        # 衍生資料本身也可再衍生 (例如灰階模板的縮小版本)
+        with self._lock:
+            self._digests[id(array)] = (array, f"{digest}-{kind}")
+        return array
+
+    def _store(self, digest, kind, array):
+        if not self.directory:
+            return
+        path = self._entry_path(digest, kind)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "wb") as cache_file:
+                np.save(cache_file, array, allow_pickle=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            self.logger.warning(f"Failed to write template cache entry {path}: {str(e)}")
+
+
+class SharedTemplates:
+    """
+    Decoded templates published in shared memory for worker processes.
+
+    The publishing process owns the blocks and unlinks them on close();
+    workers attach with ``attach(index)`` and get read-only views.
+    """
+    def __init__(self):
+        self.index = {}  # 絕對路徑 -> (共享記憶體名稱, shape, dtype, digest)
+        self._blocks = []
+        self.logger = logging.getLogger('key_wizard')
+
+    def publish(self, paths):
+        """
+        Decode templates and copy them into shared memory.
+
+        Args:
+            paths (iterable): Template image paths; unreadable ones are skipped
+
+        Returns:
+            dict: The index to pass to attach()
+        """
+        from multiprocessing import shared_memory
+
+        loader = TemplateCache()
+        for path in paths:
+            path = os.path.abspath(path)
+            if path in self.index or not os.path.exists(path):
+                continue
+            try:
+                image = loader.load(path)
+            except OSError as e:
+                self.logger.warning(f"Cannot share template {path}: {str(e)}")
+                continue
+            if image is None:
+                continue
+            block = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+            np.ndarray(image.shape, image.dtype, buffer=block.buf)[...] = image
+            self._blocks.append(block)
+            self.index[path] = (block.name, image.shape, image.dtype.str, loader.digest(image))
+        return self.index
+
+    @staticmethod
+    def attach(index):
+        """
+        Map published templates into this process.
+
+        Args:
+            index (dict): Index returned by publish()
+
+        Returns:
+            tuple: (shared, blocks); shared is the ``shared`` argument of
+                TemplateCache, blocks must stay referenced while it is in use
+        """
+        from multiprocessing import shared_memory
+
+        shared = {}
+        blocks = []
+        for path, (name, shape, dtype, digest) in index.items():
+            block = shared_memory.SharedMemory(name=name)
+            if os.name == "posix":
+                # 共享記憶體屬於 supervisor，不要在本行程結束時被 resource_tracker 刪除
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(block._name, "shared_memory")
+            image = np.ndarray(shape, np.dtype(dtype), buffer=block.buf)
+            image.flags.writeable = False
+            shared[path] = (image, digest)
+            blocks.append(block)
+        return shared, blocks
+
+    @property
+    def nbytes(self):
+        return sum(block.size for block in self._blocks)
+
+    def close(self):
+        """
+        Release and remove the shared-memory blocks.
+        """
+        for block in self._blocks:
+            try:
+                block.close()
+                if os.name == "posix":
+                    # 共用同一個 resource_tracker 的 worker 在 attach() 時已取消登記，
+                    # 先重新登記，unlink() 取消登記時才不會出錯
+                    from multiprocessing import resource_tracker
+                    resource_tracker.register(block._name, "shared_memory")
+                block.unlink()
+            except FileNotFoundError:
+                pass
+        self._blocks = []
+        self.index = {}
+
+
+def create_template_cache(config, script_dir, shared=None):
+    """
+    Build the template cache from the configuration.
+
+    Args:
+        config (dict): Configuration (see modules.config.DEFAULT_CONFIG)
+        script_dir (str): Program directory (default location of the cache)
+        shared (dict, optional): Templates shared by a supervisor (see SharedTemplates.attach)
+
+    Returns:
+        TemplateCache: Cache instance (memory only when disabled)
+    """
+    if not config.get("template_cache", True):
+        return TemplateCache(shared=shared)
+    return TemplateCache(config.get("template_cache_dir") or os.path.join(script_dir, ".template_cache"), shared)
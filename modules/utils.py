@@ -11,13 +11,22 @@ def create_bat_file():
     try:
         script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         bat_path = os.path.join(script_dir, "run_key_wizard.bat")
+        content = (
+            '@echo off\n'
+            'echo 啟動 Key Wizard 視覺化版本...\n'
+            'cd /d "%~dp0"\n'
+            'python "main.py"\n'
+            'pause\n'
+        )
+        
+        # 內容相同時不再重寫
+        if os.path.exists(bat_path):
+            with open(bat_path, "r", encoding='utf-8') as bat_file:
+                if bat_file.read() == content:
+                    return True
         
         with open(bat_path, "w", encoding='utf-8') as bat_file:
-            bat_file.write('@echo off\n')
-            bat_file.write('echo 啟動 Key Wizard 視覺化版本...\n')
-            bat_file.write('cd /d "%~dp0"\n')
-            bat_file.write('python "main.py"\n')
-            bat_file.write('pause\n')
+            bat_file.write(content)
         
         print(f"已創建批次檔: {bat_path}")
         return True
@@ -0,0 +1,274 @@
+"""
+Length-prefixed messages for the detection server.
+
+Every message is an 8-byte prefix (JSON length and payload length, both
+unsigned 32-bit big-endian), a UTF-8 JSON header and an optional binary
+payload. Frame pixels and templates travel in the payload, so they are
+never encoded as JSON and are received straight into a reusable buffer.
+
+Addresses are ``unix:/path/to.sock`` or ``tcp:host:port`` (``host:port``
+is read as TCP).
+"""
+
+import os
+import json
+import socket
+import struct
+
+import numpy as np
+
+PREFIX = struct.Struct("!II")
+PROTOCOL_VERSION = 1
+# 單一訊息的上限 (雙 4K BGRA 畫面約 127 MB)
+MAX_HEADER = 16 * 1024 * 1024
+MAX_PAYLOAD = 512 * 1024 * 1024
+
+
+class ProtocolError(IOError):
+    """
+    Raised when the peer sends something that is not a valid message.
+    """
+
+
+def parse_address(address):
+    """
+    Split an address string into a socket family and socket address.
+
+    Args:
+        address (str): "unix:/path", "tcp:host:port" or "host:port"
+
+    Returns:
+        tuple: (family, sockaddr)
+
+    Raises:
+        ValueError: If the address cannot be parsed
+    """
+    if address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix sockets are not available on this platform")
+        return socket.AF_UNIX, address[len("unix:"):]
+    if address.startswith("tcp:"):
+        address = address[len("tcp:"):]
+    host, separator, port = address.rpartition(":")
+    if not separator or not port.isdigit():
+        raise ValueError(f"Invalid detection server address: {address}")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def is_local(address):
+    """
+    Whether client and server are on the same machine (shared memory can be used).
+    """
+    family, sockaddr = parse_address(address)
+    return family != socket.AF_INET or sockaddr[0] in ("127.0.0.1", "localhost")
+
+
+def _tune(sock):
+    if sock.family == socket.AF_INET:
+        # 小的標頭與大的畫面分開送出，關閉 Nagle 避免延遲
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def connect(address, timeout=None):
+    """
+    Connect to a detection server.
+
+    Args:
+        address (str): Server address
+        timeout (float, optional): Connect and I/O timeout (seconds)
+
+    Returns:
+        socket.socket: Connected socket
+    """
+    family, sockaddr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(sockaddr)
+    except OSError:
+        sock.close()
+        raise
+    return _tune(sock)
+
+
+def listen(address, backlog=16):
+    """
+    Open a listening socket; a stale Unix socket file is replaced.
+
+    Args:
+        address (str): Server address
+        backlog (int): Pending connections
+
+    Returns:
+        socket.socket: Listening socket
+    """
+    family, sockaddr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        if os.path.exists(sockaddr):
+            os.unlink(sockaddr)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(sockaddr)
+    sock.listen(backlog)
+    return sock
+
+
+def accept(sock):
+    conn, _ = sock.accept()
+    conn.settimeout(None)
+    return _tune(conn)
+
+
+def _bytes(part):
+    if isinstance(part, np.ndarray):
+        part = np.ascontiguousarray(part)
+    return memoryview(part).cast("B")
+
+
+def send_message(sock, header, *payloads):
+    """
+    Send one message.
+
+    Args:
+        sock (socket.socket): Connected socket
+        header (dict): JSON-serializable header
+        *payloads: Bytes-like objects or arrays sent back to back as the payload
+    """
+    data = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    parts = [_bytes(part) for part in payloads]
+    size = sum(part.nbytes for part in parts)
+    sock.sendall(PREFIX.pack(len(data), size) + data)
+    for part in parts:
+        if part.nbytes:
+            sock.sendall(part)
+
+
+def recv_exact(sock, size, buffer=None):
+    """
+    Receive exactly ``size`` bytes.
+
+    Args:
+        sock (socket.socket): Connected socket
+        size (int): Bytes to read
+        buffer (bytearray, optional): Reused if large enough
+
+    Returns:
+        memoryview or None: The data, None if the peer closed before sending anything
+    """
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(size)
+    view = memoryview(buffer)[:size]
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            if received == 0:
+                return None
+            raise ProtocolError("Connection closed in the middle of a message")
+        received += count
+    return view
+
+
+class MessageReader:
+    """
+    Reads messages from one socket, reusing the payload buffer.
+
+    The payload returned by read() is only valid until the next call.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = bytearray(0)
+
+    def read(self):
+        """
+        Returns:
+            tuple or None: (header, payload memoryview), None when the peer closed the connection
+
+        Raises:
+            ProtocolError: If the message is malformed
+        """
+        prefix = recv_exact(self.sock, PREFIX.size)
+        if prefix is None:
+            return None
+        header_size, payload_size = PREFIX.unpack(prefix)
+        if header_size > MAX_HEADER or payload_size > MAX_PAYLOAD:
+            raise ProtocolError(f"Message too large ({header_size} + {payload_size} bytes)")
+        header_data = recv_exact(self.sock, header_size)
+        if header_data is None:
+            raise ProtocolError("Connection closed in the middle of a message")
+        try:
+            header = json.loads(bytes(header_data).decode("utf-8"))
+        except ValueError as e:
+            raise ProtocolError(f"Invalid message header: {str(e)}")
+        if not isinstance(header, dict):
+            raise ProtocolError("Message header must be an object")
+
+        if payload_size > len(self._buffer):
+            self._buffer = bytearray(payload_size)
+        payload = recv_exact(self.sock, payload_size, self._buffer) if payload_size else memoryview(b"")
+        if payload is None:
+            raise ProtocolError("Connection closed in the middle of a message")
+        return header, payload
+
+
+def array_meta(array):
+    """
+    Returns:
+        dict: shape and dtype of an array, as sent in message headers
+    """
+    return {"shape": list(array.shape), "dtype": array.dtype.str}
+
+
+def array_from(meta, payload, offset=0):
+    """
+    View of an array inside a payload (no copy).
+
+    Args:
+        meta (dict): Result of array_meta()
+        payload (memoryview): Message payload
+        offset (int): Byte offset of the array in the payload
+
+    Returns:
+        np.ndarray: Read-only view
+    """
+    dtype = np.dtype(meta["dtype"])
+    shape = tuple(meta["shape"])
+    count = int(np.prod(shape)) if shape else 1
+    if offset + count * dtype.itemsize > payload.nbytes:
+        raise ProtocolError("Payload shorter than the declared array")
+    return np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape)
+
+
+def changed_rects(grid, tile_size, width, height):
+    """
+    Rectangles covering the changed tiles of a frame, merged into horizontal runs.
+
+    Args:
+        grid (np.ndarray): Boolean tile grid, True where a tile changed
+        tile_size (int): Tile size in frame pixels
+        width (int): Frame width
+        height (int): Frame height
+
+    Returns:
+        list: [x, y, w, h] rectangles clipped to the frame
+    """
+    t = tile_size
+    rects = []
+    for row in range(grid.shape[0]):
+        cells = np.flatnonzero(grid[row])
+        if not len(cells):
+            continue
+        # 同一列相鄰的 tile 合併成一個矩形
+        breaks = np.flatnonzero(np.diff(cells) > 1)
+        starts = np.concatenate(([cells[0]], cells[breaks + 1]))
+        ends = np.concatenate((cells[breaks], [cells[-1]]))
+        y = row * t
+        h = min(t, height - y)
+        for start, end in zip(starts, ends):
+            x = int(start) * t
+            w = min((int(end) + 1) * t, width) - x
+            if w > 0 and h > 0:
+                rects.append([x, y, w, h])
+    return rects
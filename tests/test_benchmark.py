@@ -0,0 +1,30 @@
+"""
+Accuracy of the detection loop on the synthetic benchmark scenario.
+
+Run with ``python -m unittest discover tests`` (or pytest).
+"""
+
+import unittest
+
+from modules.benchmark import SCENARIO, check_accuracy, find_regressions, run_scenario
+
+
+class SyntheticScenarioTest(unittest.TestCase):
+    def test_recall_and_precision(self):
+        # 一輪完整的合成序列: 目標、核准按鈕與雜訊畫面各至少一次
+        result = run_scenario("1080p", {"template_cache": False}, frames=len(SCENARIO))
+        accuracy = result["accuracy"]
+        self.assertGreater(accuracy["tp"], 0)
+        self.assertTrue(check_accuracy(accuracy, 0.99, 0.99), accuracy)
+
+    def test_compare_regression(self):
+        def result(variant, recall):
+            return {"scenario": "1080p", "variant": variant, "accuracy": {"recall": recall, "precision": 1.0}}
+
+        results = [result("base", 1.0), result("same", 1.0), result("worse", 0.5)]
+        self.assertEqual([r["variant"] for r in find_regressions(results)], ["worse"])
+        self.assertEqual(results[2]["accuracy"]["regression"], "base")
+
+
+if __name__ == "__main__":
+    unittest.main()
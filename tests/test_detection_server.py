@@ -0,0 +1,57 @@
+"""
+Template eviction on the detection server releases the matcher's data.
+
+Run with ``python -m unittest discover tests`` (or pytest).
+"""
+
+import unittest
+
+import numpy as np
+
+from modules import wire
+from modules.capture import Frame
+from modules.config import load_config
+from modules.detection_server import DetectionServer
+
+
+def upload(server, digest, template):
+    server.add_templates([dict(wire.array_meta(template), digest=digest, offset=0)],
+                         memoryview(template.tobytes()))
+    return server.template(digest)
+
+
+class TemplateEvictionTest(unittest.TestCase):
+    def setUp(self):
+        config = load_config(overrides={"match_strategy": "fft", "fft_min_pixels": 0})
+        self.server = DetectionServer(config)
+        self.matcher = self.server.matcher
+        rng = np.random.default_rng(0)
+        self.templates = [rng.integers(0, 256, (20, 30, 3), dtype=np.uint8) for _ in range(3)]
+
+    def test_prepared_data_counted(self):
+        template = upload(self.server, "a", self.templates[0])
+        prepared = self.matcher.prepared_nbytes(template)
+        self.assertGreater(prepared, 0)
+        self.assertEqual(self.server.stats()["template_bytes"], template.nbytes + prepared)
+
+        # 頻譜在第一次比對時建立，也算在用量內
+        self.matcher.scores(Frame(np.zeros((120, 160, 3), np.uint8)), template)
+        self.assertGreater(self.server.stats()["template_bytes"], template.nbytes + prepared)
+
+    def test_eviction_forgets_prepared_data(self):
+        first = upload(self.server, "a", self.templates[0])
+        self.matcher.scores(Frame(np.zeros((120, 160, 3), np.uint8)), first)
+        second = upload(self.server, "b", self.templates[1])
+        # 只容得下兩個還沒有頻譜的模板
+        self.server.template_limit = 2 * self.server._template_size(second)
+        upload(self.server, "c", self.templates[2])
+
+        self.assertIsNone(self.server.template("a"))
+        self.assertEqual(self.matcher.prepared_nbytes(first), 0)
+        self.assertEqual(len(self.matcher._templates), 2)
+        self.assertFalse(any(key[0] == id(first) for key in self.matcher._spectra))
+        self.assertLessEqual(self.server.stats()["template_bytes"], self.server.template_limit)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+"""
+SessionHttpClient and the notification queue against a local HTTP server.
+
+Run with ``python -m unittest discover tests`` (or pytest).
+"""
+
+import json
+import time
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from modules.line_http import SessionHttpClient
+from modules.line_notifier import LineNotifier, is_retryable
+from modules.notify_queue import NotificationQueue
+
+
+class Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1: 同一個連線可以連續處理多個請求
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        with server.lock:
+            server.requests.append((time.monotonic(), self.client_address, self.path, body))
+            status = server.statuses.pop(0) if server.statuses else 200
+        if server.delay:
+            time.sleep(server.delay)
+        payload = json.dumps({} if status == 200 else {"message": f"status {status}"}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LineHttpTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.statuses = []
+        self.server.delay = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        # 每個測試使用新的連線池
+        SessionHttpClient._session = None
+
+    def tearDown(self):
+        session = SessionHttpClient._session
+        if session is not None:
+            session.close()
+        SessionHttpClient._session = None
+        self.server.shutdown()
+        self.server.server_close()
+
+    def make_queue(self, retries=2, backoff=0.05):
+        notifier = LineNotifier("token", "user", endpoint=self.url, timeout=2)
+        return NotificationQueue(notifier, retries=retries, backoff=backoff, coalesce_window=0)
+
+    def test_connection_reuse(self):
+        # 不同的 client 實例共用同一個連線池
+        for _ in range(3):
+            response = SessionHttpClient(timeout=2).post(f"{self.url}/push", data="{}")
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        ports = {client[1] for _, client, _, _ in self.server.requests}
+        self.assertEqual(len(ports), 1)
+
+    def test_retry_with_backoff(self):
+        self.server.statuses = [503, 429]
+        notifications = self.make_queue()
+        results = []
+        notifications.submit("hello", callback=results.append)
+        self.assertTrue(notifications.close(timeout=5))
+
+        self.assertEqual(results, [True])
+        self.assertEqual((notifications.sent, notifications.failed), (1, 0))
+        times = [request[0] for request in self.server.requests]
+        self.assertEqual(len(times), 3)
+        self.assertTrue(all(request[2] == "/v2/bot/message/push" for request in self.server.requests))
+        # 第一次重試等待 backoff，之後每次加倍
+        self.assertGreaterEqual(times[1] - times[0], 0.05)
+        self.assertGreaterEqual(times[2] - times[1], 0.1)
+
+    def test_client_error_not_retried(self):
+        self.server.statuses = [400]
+        notifications = self.make_queue()
+        results = []
+        notifications.submit("hello", callback=results.append)
+        self.assertTrue(notifications.close(timeout=5))
+        self.assertEqual(results, [False])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_timeout(self):
+        self.server.delay = 0.5
+        started = time.monotonic()
+        with self.assertRaises(requests.Timeout) as raised:
+            SessionHttpClient(timeout=0.1).get(f"{self.url}/slow")
+        self.assertLess(time.monotonic() - started, 0.45)
+        self.assertTrue(is_retryable(raised.exception))
+
+        # 每次呼叫可以指定較長的逾時
+        response = SessionHttpClient(timeout=0.1).get(f"{self.url}/slow", timeout=2)
+        self.assertEqual(response.status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
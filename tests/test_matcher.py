@@ -0,0 +1,95 @@
+"""
+Parity of FFTMatcher with cv2.matchTemplate(TM_CCOEFF_NORMED).
+
+Run with ``python -m unittest discover tests`` (or pytest).
+"""
+
+import unittest
+
+import cv2
+import numpy as np
+
+from modules.capture import Frame
+from modules.matcher import ExhaustiveMatcher, FFTMatcher, SearchRequest, search
+
+
+def make_scene(shape, template, at, seed=0):
+    rng = np.random.default_rng(seed)
+    image = cv2.GaussianBlur(rng.integers(0, 256, shape, dtype=np.uint8), (0, 0), 2)
+    x, y = at
+    image[y:y + template.shape[0], x:x + template.shape[1]] = template
+    return image
+
+
+def make_template(shape, seed=1):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, shape, dtype=np.uint8)
+
+
+class FFTParityTest(unittest.TestCase):
+    def setUp(self):
+        # min_pixels=0: 小畫面也走頻譜比對
+        self.fft = FFTMatcher(min_pixels=0)
+        self.exhaustive = ExhaustiveMatcher()
+
+    def assert_scores_match(self, image, template):
+        expected = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+        actual = self.fft.scores(Frame(image), template)
+        self.assertEqual(actual.shape, expected.shape)
+        np.testing.assert_allclose(actual, expected, atol=1e-4)
+
+    def test_color_scores(self):
+        template = make_template((24, 40, 3))
+        self.assert_scores_match(make_scene((240, 320, 3), template, (100, 60)), template)
+
+    def test_gray_scores(self):
+        template = make_template((30, 30))
+        self.assert_scores_match(make_scene((200, 260), template, (17, 133)), template)
+
+    def test_flat_windows(self):
+        template = make_template((20, 20, 3))
+        image = make_scene((160, 200, 3), template, (150, 120))
+        image[:80, :100] = 128
+        self.assert_scores_match(image, template)
+
+    def test_flat_template(self):
+        template = np.full((20, 30, 3), 77, np.uint8)
+        image = make_scene((120, 160, 3), make_template((10, 10, 3)), (5, 5))
+        self.assert_scores_match(image, template)
+        self.assertEqual(self.fft.match(Frame(image), template, 0.9),
+                         self.exhaustive.match(Frame(image), template, 0.9))
+
+    def test_match_and_match_all(self):
+        template = make_template((20, 36, 3))
+        image = make_scene((220, 300, 3), template, (40, 30))
+        # 第二個位置加上雜訊，最佳位置才是唯一的
+        noise = np.random.default_rng(2).integers(-20, 21, template.shape)
+        image[150:170, 200:236] = np.clip(template.astype(int) + noise, 0, 255)
+
+        best = self.fft.match(Frame(image), template, 0.8)
+        expected = self.exhaustive.match(Frame(image), template, 0.8)
+        self.assertEqual(best[:2], expected[:2])
+        self.assertAlmostEqual(best[2], expected[2], places=4)
+
+        hits = self.fft.match_all(Frame(image), template, 0.8, max_hits=5)
+        expected = self.exhaustive.match_all(Frame(image), template, 0.8, max_hits=5)
+        self.assertEqual([hit[:2] for hit in hits], [hit[:2] for hit in expected])
+
+    def test_crop_uses_parent_transform(self):
+        template = make_template((24, 24, 3))
+        frame = Frame(make_scene((240, 320, 3), template, (200, 150)))
+        crop = frame.crop(120, 90, 180, 140)
+
+        expected = cv2.matchTemplate(crop.image, template, cv2.TM_CCOEFF_NORMED)
+        np.testing.assert_allclose(self.fft.scores(crop, template), expected, atol=1e-4)
+        # 頻譜只在整張畫面計算一次
+        self.assertIn("fft", frame.cache)
+        self.assertNotIn("fft", crop.cache)
+
+        request = SearchRequest("t", (120, 90, 180, 140), 0.8)
+        hits = search(self.fft, frame, template, request)
+        self.assertEqual([hit[:2] for hit in hits], [(80, 60)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+The capture -> match loop must not grow the Python heap once it is warm.
+
+Run with ``python -m unittest discover tests`` (or pytest).
+"""
+
+import logging
+import tempfile
+import tracemalloc
+import unittest
+
+from modules.benchmark import SCENARIO, NullNotifier, RecordingInput, SyntheticCapture, make_templates
+from modules.config import load_config
+from modules.key_wizard import KeyWizard
+
+WARMUP = 3 * len(SCENARIO)
+CYCLES = 10 * len(SCENARIO)
+# 穩定後每輪可以留下的記憶體 (例如統計用的計數器)，遠小於一張 640x480 畫面
+MAX_GROWTH = 32 * 1024
+
+
+class SteadyStateMemoryTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        config = load_config(overrides={"template_cache": False, "template_dir": self.workdir.name})
+        config["input_pause_scale"] = 0
+        config["action_debounce"] = 0
+        templates = make_templates(self.workdir.name)
+
+        self.device = RecordingInput()
+        self.wizard = KeyWizard(line_notifier=NullNotifier(), config=config, input_device=self.device)
+        logging.getLogger('key_wizard.press').disabled = True
+        self.capture = SyntheticCapture((640, 480), templates, frames=WARMUP + CYCLES, record_truth=False)
+        self.wizard._ensure_capture(self.capture)
+        self.assertTrue(self.wizard._load_templates())
+        self.wizard.running = True
+
+    def tearDown(self):
+        self.wizard.actions.close()
+        self.wizard.match_engine.shutdown()
+        self.capture.close()
+        logging.getLogger('key_wizard.press').disabled = False
+        self.workdir.cleanup()
+
+    def run_cycles(self, count):
+        for _ in range(count):
+            self.wizard._process_action()
+            self.wizard.actions.wait_idle()
+            self.device.clicks.clear()
+
+    def test_heap_stays_flat(self):
+        tracemalloc.start(25)
+        try:
+            self.run_cycles(WARMUP)
+            buffers = self.capture.buffers.allocations
+            before = tracemalloc.take_snapshot()
+            self.run_cycles(CYCLES)
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+
+        # pytest 會保留每一筆日誌紀錄，不算在掃描迴圈內
+        ignore = [tracemalloc.Filter(False, logging.__file__, all_frames=True)]
+        before, after = before.filter_traces(ignore), after.filter_traces(ignore)
+
+        stats = after.compare_to(before, "lineno")
+        growth = sum(stat.size_diff for stat in stats)
+        top = "\n".join(str(stat) for stat in stats[:5])
+        self.assertLess(growth, MAX_GROWTH, f"heap grew {growth} bytes over {CYCLES} cycles:\n{top}")
+        # 畫面緩衝區在暖機後不再重新配置
+        self.assertEqual(self.capture.buffers.allocations, buffers)
+
+
+if __name__ == "__main__":
+    unittest.main()
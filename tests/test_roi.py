@@ -0,0 +1,68 @@
+"""
+Adaptive search regions: a miss near the last match rescans the base region.
+
+Run with ``python -m unittest discover tests`` (or pytest).
+"""
+
+import unittest
+
+import cv2
+import numpy as np
+
+from modules.capture import Frame
+from modules.matcher import ExhaustiveMatcher, SearchRequest, search
+from modules.roi import RegionTracker, result_region
+
+
+def make_frame(template, at, shape=(300, 400, 3)):
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, shape, dtype=np.uint8), (0, 0), 2)
+    x, y = at
+    image[y:y + template.shape[0], x:x + template.shape[1]] = template
+    return Frame(image)
+
+
+class AdaptiveRegionTest(unittest.TestCase):
+    def setUp(self):
+        self.template = np.random.default_rng(1).integers(0, 256, (20, 30, 3), dtype=np.uint8)
+        self.size = (30, 20)
+        self.tracker = RegionTracker("button", margin=10, max_misses=2)
+
+    def test_moved_template_found_in_same_cycle(self):
+        frame = make_frame(self.template, (50, 40))
+        region, fallback = self.tracker.search_region(frame, self.size)
+        self.assertIsNone(fallback)
+        self.tracker.record(frame, region, (50, 40, 30, 20))
+
+        # 按鈕移到別處: 上次位置附近落空，同一輪就在整個畫面找到
+        frame = make_frame(self.template, (300, 250))
+        region, fallback = self.tracker.search_region(frame, self.size)
+        self.assertEqual(region, (40, 30, 50, 40))
+        self.assertEqual(fallback, (0, 0, 400, 300))
+        request = SearchRequest("button", region, 0.9, fallback=fallback)
+        matches = search(ExhaustiveMatcher(), frame, self.template, request)
+        self.assertEqual([(region[0] + x, region[1] + y) for x, y, _ in matches], [(300, 250)])
+
+        rect = (300, 250, 30, 20)
+        self.assertEqual(result_region(region, rect, fallback), fallback)
+        self.tracker.record(frame, region, rect, fallback)
+        self.assertEqual(self.tracker.last_rect, rect)
+        self.assertEqual(self.tracker.stats()["misses"], 0)
+
+    def test_window_dropped_after_max_misses(self):
+        frame = make_frame(self.template, (50, 40))
+        self.tracker.record(frame, (0, 0, 400, 300), (50, 40, 30, 20))
+        for _ in range(2):
+            region, fallback = self.tracker.search_region(frame, self.size)
+            self.assertIsNotNone(fallback)
+            self.assertEqual(result_region(region, None, fallback), fallback)
+            self.tracker.record(frame, region, None, fallback)
+        self.assertEqual(self.tracker.search_region(frame, self.size), ((0, 0, 400, 300), None))
+
+    def test_request_round_trip(self):
+        request = SearchRequest("button", (1, 2, 3, 4), 0.8, fallback=(0, 0, 10, 10))
+        self.assertEqual(SearchRequest.from_dict(request.to_dict()).fallback, (0, 0, 10, 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
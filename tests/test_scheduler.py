@@ -0,0 +1,63 @@
+"""
+A stop() that arrives before the scanning loop starts must not be lost.
+
+Run with ``python -m unittest discover tests`` (or pytest).
+"""
+
+import logging
+import tempfile
+import threading
+import unittest
+
+from modules.benchmark import NullNotifier, RecordingInput, SyntheticCapture, make_templates
+from modules.config import load_config
+from modules.key_wizard import KeyWizard
+from modules.scheduler import ScanScheduler
+
+
+class ScanSchedulerTest(unittest.TestCase):
+    def test_reset_keeps_pending_stop(self):
+        scheduler = ScanScheduler(min_interval=0.1, max_interval=1.0)
+        scheduler.next_interval(False)
+        scheduler.stop()
+        scheduler.reset()
+        self.assertTrue(scheduler.stopped)
+        self.assertEqual(scheduler.interval, 0.1)
+        self.assertTrue(scheduler.wait(5))
+
+        scheduler.rearm()
+        self.assertFalse(scheduler.stopped)
+
+
+class StopBeforeStartTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        config = load_config(overrides={"template_cache": False, "template_dir": self.workdir.name})
+        self.templates = make_templates(self.workdir.name)
+        self.wizard = KeyWizard(line_notifier=NullNotifier(), config=config, input_device=RecordingInput())
+        logging.getLogger('key_wizard.press').disabled = True
+
+    def tearDown(self):
+        logging.getLogger('key_wizard.press').disabled = False
+        self.workdir.cleanup()
+
+    def run_wizard(self, frames):
+        self.wizard._ensure_capture(SyntheticCapture((320, 240), self.templates, frames=frames))
+        thread = threading.Thread(target=self.wizard.start)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+    def test_stop_before_start(self):
+        # 例如 supervisor 在精靈載入模板時就要求停止
+        self.wizard.stop("測試")
+        self.run_wizard(frames=5)
+        self.assertEqual(self.wizard.frame_count, 0)
+
+        # 停止要求只影響那一次執行
+        self.run_wizard(frames=3)
+        self.assertGreater(self.wizard.frame_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
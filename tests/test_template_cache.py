@@ -0,0 +1,76 @@
+"""
+On-disk template cache: skipping unchanged files and cached FFT spectra.
+
+Run with ``python -m unittest discover tests`` (or pytest).
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+
+from modules.capture import Frame
+from modules.matcher import FFTMatcher
+from modules.template_cache import TemplateCache
+
+
+class TemplateCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self.path = os.path.join(self.directory, "button.png")
+        rng = np.random.default_rng(0)
+        self.image = cv2.GaussianBlur(rng.integers(0, 256, (30, 50, 3), dtype=np.uint8), (0, 0), 1)
+        cv2.imwrite(self.path, self.image)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def load_once(self):
+        cache = TemplateCache(self.cache_dir)
+        image = cache.load(self.path)
+        cache.save_index()
+        return cache, image
+
+    def test_unchanged_file_is_not_decoded(self):
+        _, first = self.load_once()
+        cache = TemplateCache(self.cache_dir)
+        with mock.patch("modules.template_cache.cv2.imdecode", side_effect=AssertionError("decoded again")):
+            image = cache.load(self.path)
+        np.testing.assert_array_equal(image, first)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertIsNotNone(cache.digest(image))
+
+    def test_changed_file_is_decoded(self):
+        self.load_once()
+        cv2.imwrite(self.path, np.zeros((30, 60, 3), np.uint8))
+        cache, image = self.load_once()
+        self.assertEqual(image.shape, (30, 60, 3))
+        self.assertEqual(cache.misses, 1)
+
+    def test_spectra_are_cached(self):
+        frame_shape = (240, 320)
+        cache, template = self.load_once()
+        FFTMatcher(min_pixels=0).prepare([template], frame_shape, cache=cache)
+        self.assertTrue(any(".fft" in name for name in os.listdir(self.cache_dir)))
+
+        # 重新啟動: 頻譜從快取讀取，分數仍與 OpenCV 相同
+        cache = TemplateCache(self.cache_dir)
+        template = cache.load(self.path)
+        matcher = FFTMatcher(min_pixels=0)
+        matcher.prepare([template], frame_shape, cache=cache)
+        self.assertEqual(cache.misses, 0)
+
+        rng = np.random.default_rng(1)
+        image = cv2.GaussianBlur(rng.integers(0, 256, frame_shape + (3,), dtype=np.uint8), (0, 0), 2)
+        image[100:130, 200:250] = template
+        expected = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+        np.testing.assert_allclose(matcher.scores(Frame(image), template), expected, atol=1e-4)
+
+
+if __name__ == "__main__":
+    unittest.main()